@@ -1,29 +1,113 @@
+import argparse
+import contextlib
+import json
 import os
+import runpy
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 mode_list = ["STATIC", "RANDOM", "HEURISTIC", "FUTURE"]
 
-# Make sure the folders exist
-for mode in mode_list:
-    os.makedirs(f"./logs/{mode}", exist_ok=True)
-
 setting_list = [
     {"slots": 1, "step_size": 1e-7, "generations": 2000},
     {"slots": 360, "step_size": 1e-6, "generations": 2000},
     {"slots": 4320, "step_size": 1e-6, "generations": 5000},
 ]
-for mode in mode_list:
-    for setting in setting_list:
-        os.system(
-            "python ./game.py"
-            + " --mode "
-            + str(mode)
-            + " --slots "
-            + str(setting["slots"])
-            + " --step_size "
-            + str(setting["step_size"])
-            + " --generations "
-            + str(setting["generations"])
-            + " > ./logs/"
-            + str(mode)
-            + "/log.txt"
-        )
+
+GAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "game.py")
+
+
+def run_directory(root: str, mode: str, setting: dict) -> str:
+    # Every run writes its figures and logs to its own folder
+    return os.path.join(root, mode, f"{setting['slots']}_slots")
+
+
+def run_config(mode: str, setting: dict, seed: int) -> dict:
+    return {"mode": mode, "seed": seed, **setting}
+
+
+def is_finished(directory: str, config: dict, game_args: list) -> bool:
+    # A run is finished if it wrote its marker with the same configuration
+    try:
+        with open(os.path.join(directory, "done.json")) as f:
+            return json.load(f) == {**config, "game_args": game_args}
+    except (OSError, ValueError):
+        return False
+
+
+def run_game(config: dict, directory: str, game_args: list) -> str:
+    """
+    Runs game.py in the current process with its output redirected to the
+    run's folder, and marks the run as finished.
+
+    Args:
+        config (dict): The mode, seed, slots, step_size and generations.
+        directory (str): The folder of the run.
+        game_args (list): Further options passed on to game.py.
+
+    Returns:
+        str: The folder of the run.
+    """
+    os.makedirs(directory, exist_ok=True)
+    argv = ["game.py", "--output_dir", directory]
+    argv += ["--trace_dir", os.path.join(directory, "trace")]
+    for key, value in config.items():
+        argv += ["--" + key, str(value)]
+    argv += game_args
+
+    saved_argv = sys.argv
+    with open(os.path.join(directory, "log.txt"), "w") as out, open(
+        os.path.join(directory, "progress.txt"), "w"
+    ) as err, contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            sys.argv = argv
+            runpy.run_path(GAME, run_name="__main__")
+        finally:
+            sys.argv = saved_argv
+
+    with open(os.path.join(directory, "done.json"), "w") as f:
+        json.dump({**config, "game_args": game_args}, f)
+    return directory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run all settings in parallel")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=2025,
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="./logs",
+    )
+    parser.add_argument(
+        "--rerun",
+        action="store_true",
+        help="run again even if a run already finished",
+    )
+    # Unknown options, e.g. --price_update secant, are passed on to game.py
+    args, game_args = parser.parse_known_args()
+
+    runs = []
+    for mode in mode_list:
+        for setting in setting_list:
+            config = run_config(mode, setting, args.seed)
+            directory = run_directory(args.output_dir, mode, setting)
+            if args.rerun or not is_finished(directory, config, game_args):
+                runs.append((config, directory, game_args))
+            else:
+                print("Skipping finished run:", directory)
+    # Start the longest runs first
+    runs.sort(key=lambda run: run[0]["slots"], reverse=True)
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(run_game, *run) for run in runs]
+        for future in as_completed(futures):
+            print("Finished run:", future.result())
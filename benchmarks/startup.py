@@ -0,0 +1,53 @@
+"""
+Measures the import time a game.py run pays before its first slot, with and
+without the plotting module, in fresh interpreters.
+
+Usage: python benchmarks/startup.py [--repeats 10] [--runs 12]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "headless": "import simulation",
+    "with plots": "import simulation, reporting",
+}
+
+
+def import_time(statement: str, repeats: int) -> float:
+    # Best wall time of a fresh interpreter running the statement
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], cwd=ROOT, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time benchmark")
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=12,
+        help="number of runs in the sweep to extrapolate to",
+    )
+    args = parser.parse_args()
+
+    baseline = import_time("pass", args.repeats)
+    times = {name: import_time(s, args.repeats) for name, s in SCENARIOS.items()}
+    for name, seconds in times.items():
+        print(f"{name:>12}: {seconds - baseline:.3f} s")
+    saving = times["with plots"] - times["headless"]
+    print(f"Saving per run: {saving:.3f} s, per sweep of {args.runs} runs: ", end="")
+    print(f"{saving * args.runs:.3f} s")
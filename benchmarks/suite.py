@@ -0,0 +1,182 @@
+"""
+Runs the fixed-seed benchmark scenarios, each in a fresh interpreter, and
+compares them with a stored baseline.
+
+Every mode of auto_run.py runs with each of its settings (1, 360 and 4320
+slots), and synthetic HEURISTIC markets of 100, 1k and 10k users run on the
+population with batched best responses. A scenario reports its setup and
+run wall time, the price iterations per slot, the solver evaluations counted
+by the instrumentation, the peak memory and the equilibrium it reached. Any
+equilibrium value that moved from the baseline by more than the tolerance
+is flagged as drift, and the exit status is 1.
+
+Usage: python benchmarks/suite.py [--filter REGEX] [--save] [--tolerance 1e-9]
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from auto_run import mode_list, setting_list
+
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+# Name -> Simulation options
+SCENARIOS = {
+    f"{mode}-{setting['slots']}": {"mode": mode, **setting}
+    for setting in setting_list
+    for mode in mode_list
+}
+for users in (100, 1000, 10000):
+    SCENARIOS[f"market-{users}"] = {
+        "mode": "HEURISTIC",
+        "slots": 10,
+        "step_size": 1e-6,
+        "generations": 50,
+        "hb_users": users // 2,
+        "lr_users": users // 2,
+        "population": True,
+        "batched": True,
+        "price_update": "secant",
+        "demand_rng": "numpy",
+    }
+
+# The counters that are solver evaluations, see profiling.count and instrument
+EVALUATIONS = (
+    "Bidder.find_optimal_bid_as_buyer",
+    "Bidder.find_optimal_bid_as_seller",
+    "batched_first_order_condition",
+    "minimize_scalar_evaluations",
+)
+
+# The summary values that make up the equilibrium a scenario reached
+EQUILIBRIUM = (
+    "total_welfare",
+    "min_welfare",
+    "iterations",
+    "loss_counter",
+    "loss_amount",
+    "waste_counter",
+    "waste_amount",
+)
+
+
+def run_scenario(name: str) -> dict:
+    # Runs the scenario in this interpreter, which should be a fresh one
+    import resource
+
+    import profiling
+    from simulation import Simulation
+
+    options = SCENARIOS[name]
+    start = time.perf_counter()
+    simulation = Simulation(seed=2025, record="none", **options)
+    setup = time.perf_counter() - start
+    profiling.enable()
+    start = time.perf_counter()
+    summary = simulation.run()
+    seconds = time.perf_counter() - start
+    equilibrium = {key: summary[key] for key in EQUILIBRIUM}
+    equilibrium["mean_clearing_price"] = simulation.clr_price_rec.mean()
+    return {
+        "setup_seconds": setup,
+        "seconds": seconds,
+        "iterations_per_slot": summary["iterations"] / summary["slots"],
+        "price_iterations": profiling.calls["price_iterations"],
+        "evaluations": sum(profiling.calls[key] for key in EVALUATIONS),
+        # Kilobytes on Linux
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "equilibrium": equilibrium,
+    }
+
+
+def measure(name: str) -> dict:
+    # Runs the scenario in a fresh interpreter, so the peak memory is its own
+    output = subprocess.run(
+        [sys.executable, __file__, "--scenario", name],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def drift(result: dict, baseline: dict, tolerance: float) -> list:
+    # The equilibrium values that moved by more than the relative tolerance
+    moved = []
+    for key, value in baseline["equilibrium"].items():
+        current = result["equilibrium"].get(key)
+        if current is None or abs(current - value) > tolerance * max(abs(value), 1):
+            moved.append(key)
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark suite")
+    parser.add_argument(
+        "--filter",
+        type=str,
+        default="",
+        help="only run the scenarios whose name matches this regular expression",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=BASELINE,
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="store the results as the new baseline of the scenarios run",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1e-9,
+        help="relative change of an equilibrium value flagged as drift",
+    )
+    parser.add_argument("--scenario", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario is not None:
+        print(json.dumps(run_scenario(args.scenario)))
+        sys.exit()
+
+    try:
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+    names = [name for name in SCENARIOS if re.search(args.filter, name)]
+    print(
+        f"{'scenario':<16}{'seconds':>10}{'baseline':>10}{'it/slot':>10}"
+        f"{'evals':>12}{'peak MB':>10}  drift"
+    )
+    drifted = False
+    results = {}
+    for name in names:
+        result = results[name] = measure(name)
+        baseline = baselines.get(name)
+        moved = drift(result, baseline, args.tolerance) if baseline else []
+        drifted = drifted or bool(moved)
+        print(
+            f"{name:<16}{result['seconds']:>10.3f}"
+            f"{baseline['seconds'] if baseline else float('nan'):>10.3f}"
+            f"{result['iterations_per_slot']:>10.1f}{result['evaluations']:>12d}"
+            f"{result['peak_memory_mb']:>10.1f}  {', '.join(moved) or '-'}"
+        )
+    if args.save:
+        baselines.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+    if drifted:
+        print("The equilibrium drifted from the baseline")
+        sys.exit(1)
@@ -0,0 +1,441 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from channel import Channel
+from pricing import WarmStart
+import profiling
+from profiling import instrument
+from simulation import Simulation
+from tools import apportion, clearing_prices, random_roles
+from user import X_area, Y_area
+
+# Options of Simulation the cell markets do not support, with their defaults
+UNSUPPORTED_OPTIONS = {
+    "incremental": None,
+    "incremental_check": False,
+    "warm_bids": False,
+    "warm_start_check": False,
+    "payoff_engine": "analytic",
+    "equilibrium_cache": None,
+    "equilibrium_tolerance": None,
+    "equilibrium_gap": False,
+}
+
+
+def clear_cells(task: tuple, instrumented: bool = False) -> tuple:
+    """
+    Runs tools.clearing_prices on a group of cell markets, in a worker process
+    when there are jobs, keeping the users' price iterations.
+
+    Args:
+        task (tuple): The positional arguments of clearing_prices.
+        instrumented (bool): Whether to enable the instrumentation while
+            clearing and return what it counted, for a worker process, whose
+            counters the parent does not see.
+
+    Returns:
+        tuple: The clearing prices and iterations of clearing_prices, the
+            buyers' and sellers' records of every iteration and the counters
+            and timers added, see profiling.added_since, or None.
+    """
+    rounds = []
+    if instrumented:
+        enabled, before = profiling.enable(), profiling.snapshot()
+    try:
+        prices, iterations = clearing_prices(
+            *task, record=lambda *role_rounds: rounds.append(role_rounds)
+        )
+    finally:
+        if instrumented:
+            profiling.enable(enabled)
+    return (
+        prices,
+        iterations,
+        rounds,
+        profiling.added_since(before) if instrumented else None,
+    )
+
+
+class CellGrid:
+    """
+    Brokers at the centers of a grid of equal cells.
+
+    The grid is also the spatial index of the users: the nearest broker of a
+    user is the one of the cell it is in, which locate() finds in constant
+    time per user, however many brokers there are.
+    """
+
+    def __init__(
+        self,
+        columns: int = 1,
+        rows: int = 1,
+        cell_width: float = X_area,
+        cell_height: float = Y_area,
+    ):
+        """
+        Args:
+            columns (int): The number of cells along x.
+            rows (int): The number of cells along y.
+            cell_width (float): The width of a cell in meters.
+            cell_height (float): The height of a cell in meters.
+
+        Raises:
+            ValueError: If there is no cell.
+        """
+        if columns < 1 or rows < 1:
+            raise ValueError("The grid needs at least one cell")
+        self.columns, self.rows = columns, rows
+        self.cell_width, self.cell_height = cell_width, cell_height
+        self.width, self.height = columns * cell_width, rows * cell_height
+        # Broker of cell row * columns + column
+        self.brokers = np.array(
+            [
+                ((column + 0.5) * cell_width, (row + 0.5) * cell_height)
+                for row in range(rows)
+                for column in range(columns)
+            ]
+        )
+
+    def __len__(self) -> int:
+        return self.columns * self.rows
+
+    def locate(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        # The cell, and so the nearest broker, of every user
+        column = np.clip((x // self.cell_width).astype(int), 0, self.columns - 1)
+        row = np.clip((y // self.cell_height).astype(int), 0, self.rows - 1)
+        return row * self.columns + column
+
+    def members(self, cells: np.ndarray) -> list:
+        # The indices of the users in every cell, in the order of the users
+        order = np.argsort(cells, kind="stable")
+        bounds = np.searchsorted(cells[order], np.arange(1, len(self)))
+        return np.split(order, bounds)
+
+
+class MultiMarketSimulation(Simulation):
+    """
+    Independent markets over one population, cleared together.
+
+    The users' state is kept in a UserPopulation, and the subclasses group
+    the users into markets every slot. The markets are cleared together by
+    tools.clearing_prices, split over worker processes if jobs > 1, and
+    every market has its own warm start and clearing price series.
+    """
+
+    # The name of a market in the series and the errors
+    market_name = "market"
+
+    def __init__(self, markets: int, jobs: int = 1, batched: bool = True, **kwargs):
+        """
+        Args:
+            markets (int): The number of markets.
+            jobs (int): The number of worker processes clearing the markets,
+                which only pays off for many large markets.
+            batched (bool): The markets are always cleared with batched best
+                responses.
+            **kwargs: The options of Simulation, except population and the
+                UNSUPPORTED_OPTIONS.
+
+        Raises:
+            ValueError: If an unsupported option is given.
+        """
+        if not batched:
+            raise ValueError(
+                f"The {self.market_name} markets are always cleared batched"
+            )
+        for name, default in UNSUPPORTED_OPTIONS.items():
+            if kwargs.get(name, default) != default:
+                raise ValueError(
+                    f"The {self.market_name} markets do not support {name}"
+                )
+        super().__init__(population=True, batched=True, **kwargs)
+        self.warm_starts = [WarmStart(self.warm_start.mode) for _ in range(markets)]
+        self.jobs = jobs
+        self.executor = ProcessPoolExecutor(jobs) if jobs > 1 else None
+        self.market_price_rec = [
+            self.recorder.series(
+                f"{self.market_name}_{market}_clearing_price", "summary"
+            )
+            for market in range(markets)
+        ]
+
+    def __getstate__(self) -> dict:
+        # The worker processes are started again by __setstate__
+        state = self.__dict__.copy()
+        state["executor"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if self.jobs > 1:
+            self.executor = ProcessPoolExecutor(self.jobs)
+
+    def close(self) -> None:
+        # Stops the worker processes
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def _trade(
+        self, groups: list, mean_prices: np.ndarray, mean_buffers: np.ndarray
+    ) -> tuple:
+        """
+        Clears the market of every group of users with a buyer and two
+        sellers, and records the clearing prices and iterations. As in
+        Simulation, the users of a market without trade keep their last
+        trades.
+
+        Args:
+            groups (list): The users of every market, as indices into the
+                population.
+            mean_prices (np.ndarray): The average expected price of every
+                market.
+            mean_buffers (np.ndarray): The average empty buffer of every
+                market.
+
+        Returns:
+            tuple: The clearing price of every market (0 without trade), their
+                mean over the markets that traded and the total number of
+                price iterations.
+        """
+        population = self.population
+        parameters = {
+            "willingness": population.willingness_to_keep,
+            "rate_factor": population.rate_factor,
+            "buffer": population.max_buffer - population.next_loss(),
+            "assigned_blocks": population.assigned_blocks,
+        }
+        markets, initial_prices = [], []
+        for market, index in enumerate(groups):
+            buyers = index[population.is_buyer[index]]
+            sellers = index[~population.is_buyer[index]]
+            if len(buyers) == 0 or len(sellers) < 2:
+                continue
+            features = [mean_prices[market], mean_buffers[market]]
+            markets.append((market, buyers, sellers, features))
+            initial_prices.append(self.warm_starts[market].initial_price(features))
+        market_prices = np.zeros(len(groups))
+        iterations = 0
+        if markets:
+            prices, iterations = self._clear_markets(
+                parameters, markets, initial_prices
+            )
+            for (market, _, _, features), price in zip(markets, prices.tolist()):
+                self.warm_starts[market].record(features, price)
+                market_prices[market] = price
+            self.iteration_rec.append(iterations)
+
+        traded = market_prices > 0
+        clearing_price = float(market_prices[traded].mean()) if traded.any() else 0.0
+        self.clr_price_rec.append(clearing_price)
+        for series, price in zip(self.market_price_rec, market_prices.tolist()):
+            series.append(price)
+        return market_prices, clearing_price, iterations
+
+    @instrument()
+    def _clear_markets(
+        self, parameters: dict, markets: list, initial_prices: list
+    ) -> tuple:
+        """
+        Clears the markets together and settles their trades.
+
+        Args:
+            parameters (dict): The parameters of all users, see
+                tools.user_parameters.
+            markets (list): The cell, buyers, sellers and market features of
+                every market, the users as indices into the population.
+            initial_prices (list): The initial price of every market.
+
+        Returns:
+            tuple: The clearing price of every market and the total number of
+                price iterations.
+        """
+        population = self.population
+        buyers = np.concatenate([market[1] for market in markets])
+        sellers = np.concatenate([market[2] for market in markets])
+        # The users of every market are contiguous, in the order of markets
+        buyer_markets = np.repeat(
+            np.arange(len(markets)), [len(market[1]) for market in markets]
+        )
+        seller_markets = np.repeat(
+            np.arange(len(markets)), [len(market[2]) for market in markets]
+        )
+        buyer_parameters = {name: value[buyers] for name, value in parameters.items()}
+        seller_parameters = {name: value[sellers] for name, value in parameters.items()}
+        tasks, offsets = [], []
+        for group in np.array_split(np.arange(len(markets)), self.jobs):
+            if len(group) == 0:
+                continue
+            first, last = int(group[0]), int(group[-1]) + 1
+            bs = slice(*np.searchsorted(buyer_markets, [first, last]))
+            ss = slice(*np.searchsorted(seller_markets, [first, last]))
+            offsets.append((bs.start, ss.start))
+            tasks.append(
+                (
+                    {name: value[bs] for name, value in buyer_parameters.items()},
+                    {name: value[ss] for name, value in seller_parameters.items()},
+                    buyer_markets[bs] - first,
+                    seller_markets[ss] - first,
+                    initial_prices[first:last],
+                    self.step_size,
+                    self.price_update,
+                )
+            )
+        if self.executor is not None:
+            results = list(
+                self.executor.map(clear_cells, tasks, [profiling.ENABLED] * len(tasks))
+            )
+            # The workers' counters, which the metrics would miss otherwise
+            for result in results:
+                if result[3] is not None:
+                    profiling.merge(result[3])
+        else:
+            results = [clear_cells(task) for task in tasks]
+        prices = np.concatenate([result[0] for result in results])
+        iterations = int(sum(result[1].sum() for result in results))
+
+        # Replay the price iterations of every group into the users' records,
+        # the positions within a group offset to the traders of all markets
+        groups = population.round_series()
+        bids = population.bid.copy()
+        for (buyer_offset, seller_offset), (_, _, rounds, _) in zip(offsets, results):
+            for buyer_rounds, seller_rounds in rounds:
+                for offset, traders, role_rounds in [
+                    (buyer_offset, buyers, buyer_rounds),
+                    (seller_offset, sellers, seller_rounds),
+                ]:
+                    index = traders[offset + role_rounds["index"]]
+                    bids[index] = role_rounds["bids"]
+                    groups["bid_rec"].append(role_rounds["bids"], index)
+                    groups["payoff_rec"].append(role_rounds["payoffs"], index)
+                    groups["utility_rec"].append(role_rounds["utilities"], index)
+        for group in groups.values():
+            group.flush()
+
+        # Round the last bids' trades at the clearing prices to whole RBs,
+        # the buyers and the sellers of every market apportioned separately
+        traders = np.concatenate([buyers, sellers])
+        trader_markets = np.concatenate([buyer_markets, seller_markets])
+        amounts = bids[traders] / prices[trader_markets]
+        amounts[len(buyers) :] -= population.assigned_blocks[sellers]
+        trades = apportion(
+            amounts, np.concatenate([buyer_markets, seller_markets + len(markets)])
+        )
+        population.trading_amount[traders] = trades
+        population.bid[traders] = bids[traders]
+        imbalance = np.bincount(trader_markets, weights=trades, minlength=len(markets))
+        self.trade_imbalance.append(float(np.abs(imbalance).max()))
+        return prices, iterations
+
+
+class MultiCellSimulation(MultiMarketSimulation):
+    """
+    The resale market over a grid of cells, one broker per cell.
+
+    Users move over the whole grid, attach to their nearest broker every slot
+    and trade in the market of its cell only. The cost of a slot grows with
+    the number of users.
+    """
+
+    market_name = "cell"
+
+    def __init__(
+        self,
+        cells: tuple = (1, 1),
+        jobs: int = 1,
+        boundary: str = "clamp",
+        rate_table: int = 0,
+        batched: bool = True,
+        **kwargs,
+    ):
+        """
+        Args:
+            cells (tuple): The number of columns and rows of the grid.
+            jobs (int): The number of worker processes clearing the cells,
+                which only pays off for many large cells.
+            boundary (str): See channel.BOUNDARIES.
+            rate_table (int): See channel.Channel.
+            batched (bool): The cells are always cleared with batched best
+                responses.
+            **kwargs: The options of Simulation, except population,
+                incremental, incremental_check, warm_bids, warm_start_check,
+                equilibrium_tolerance, equilibrium_gap and a payoff_engine
+                other than analytic, which the cell markets do not support.
+
+        Raises:
+            ValueError: If an unsupported option is given.
+        """
+        grid = CellGrid(*cells)
+        super().__init__(len(grid), jobs, batched, **kwargs)
+        self.grid = grid
+        self.config["cells"] = list(cells)
+        population = self.population
+        population.channel = Channel(
+            boundary=boundary,
+            rate_table=rate_table,
+            rng=self.mobility_rng,
+            grid=self.grid,
+        )
+        # Spread the users, placed in a single cell by User, over the grid
+        population.x *= self.grid.columns
+        population.y *= self.grid.rows
+
+    @instrument()
+    def step(self) -> dict:
+        """
+        Simulates one time slot in every cell.
+
+        Returns:
+            dict: As Simulation.step(), with the mean clearing price of the
+                cells that traded and the total number of iterations, plus
+                the clearing price of every cell (0 without trade).
+        """
+        population = self.population
+        population.update()
+        cells = self.grid.locate(population.x, population.y)
+        members = self.grid.members(cells)
+        expected_prices = population.expected_price()
+
+        # Every cell assigns the roles by its own average expected price
+        counts = np.bincount(cells, minlength=len(self.grid))
+        mean_prices = np.bincount(
+            cells, weights=expected_prices, minlength=len(self.grid)
+        ) / np.maximum(counts, 1)
+        if self.mode == "RANDOM":
+            for index in members:
+                population.is_buyer[index] = random_roles(len(index), self.role_rng)
+        else:
+            population.is_buyer = expected_prices > mean_prices[cells]
+        market_clearing_welfare = population.welfare()
+        self.welfare_rec.append(market_clearing_welfare)
+
+        cell_prices = np.zeros(len(self.grid))
+        iterations = 0
+        if self.mode != "STATIC":
+            mean_buffers = np.bincount(
+                cells, weights=population.emp_buffer, minlength=len(self.grid)
+            ) / np.maximum(counts, 1)
+            cell_prices, market_clearing_price, iterations = self._trade(
+                members, mean_prices, mean_buffers
+            )
+            market_clearing_welfare = population.welfare(population.trading_amount)
+        else:
+            market_clearing_price = 0.0
+
+        self.market_clearing_welfare.append(market_clearing_welfare)
+        population.record_current_state()
+
+        self.slot += 1
+        result = {
+            "slot": self.slot,
+            "clearing_price": market_clearing_price,
+            "iterations": iterations,
+            "buyers": int(population.is_buyer.sum()),
+            "sellers": int((~population.is_buyer).sum()),
+            "welfare": market_clearing_welfare,
+            "cell_prices": cell_prices.tolist(),
+        }
+        if self.trace is not None:
+            self.trace.write(result, self.users)
+        return result
@@ -0,0 +1,151 @@
+import math
+import random
+
+import numpy as np
+
+from user import (
+    H,
+    X_area,
+    Y_area,
+    X_broker,
+    Y_broker,
+    bandwidth,
+    c,
+    frequency,
+    noise,
+    transmission_power,
+)
+
+# How a move that leaves the area is handled: "clamp" stops the user at the
+# boundary as User.calculate_next_position does, "reflect" mirrors it back
+BOUNDARIES = ("clamp", "reflect")
+
+
+class Channel:
+    """
+    Random walk mobility and the channel of all users to their brokers.
+
+    Moves all users and computes their rate factors, the data rate of one
+    resource block in bits per slot, in single NumPy passes with the same
+    Friis transmission equation and Shannon-Hartley theorem as User.update.
+    """
+
+    def __init__(
+        self,
+        speed: float = 10.0,
+        boundary: str = "clamp",
+        rate_table: int = 0,
+        rng=None,
+        grid=None,
+    ):
+        """
+        Args:
+            speed (float): The distance a user moves per slot in meters.
+            boundary (str): One of BOUNDARIES.
+            rate_table (int): The number of distances the rate factor is
+                tabulated at for linear interpolation, or 0 to compute it
+                exactly. The table covers every distance to the broker within
+                the area, so it serves any position in this fixed geometry.
+            rng: The stream the directions are drawn from, a NumPy
+                Generator drawn from vectorized or a random.Random drawn from
+                one user after the other, as User.update does. By default
+                the random module. A list of streams splits the users into
+                as many equal consecutive groups, each moved by its own
+                stream, e.g. the replicas of replicas.ReplicaSimulation.
+            grid (cells.CellGrid): The brokers, users attach to the nearest
+                one. By default there is a single broker at the center of the
+                area of User.
+
+        Raises:
+            ValueError: If the boundary is unknown or the table is too small.
+        """
+        if boundary not in BOUNDARIES:
+            raise ValueError(f"Unknown boundary: {boundary}")
+        if rate_table == 1 or rate_table < 0:
+            raise ValueError("The rate table needs at least two distances")
+        self.speed = speed
+        self.boundary = boundary
+        self.rng = rng
+        self.grid = grid
+        self.area = (X_area, Y_area) if grid is None else (grid.width, grid.height)
+        self.wavelength = c / frequency
+        self.table = None
+        if rate_table:
+            # The farthest a user can be from its nearest broker
+            if grid is None:
+                max_distance = math.sqrt(
+                    max(X_broker, X_area - X_broker) ** 2
+                    + max(Y_broker, Y_area - Y_broker) ** 2
+                    + H**2
+                )
+            else:
+                max_distance = math.sqrt(
+                    (grid.cell_width / 2) ** 2 + (grid.cell_height / 2) ** 2 + H**2
+                )
+            distances = np.linspace(H, max_distance, rate_table)
+            self.table = (distances, self._rate_factor(distances))
+
+    def move(self, x: np.ndarray, y: np.ndarray) -> tuple:
+        """
+        Moves every user by speed in a random direction.
+
+        Args:
+            x (np.ndarray): The users' x-coordinates.
+            y (np.ndarray): The users' y-coordinates.
+
+        Returns:
+            tuple: The next x- and y-coordinates, within the area.
+        """
+        if isinstance(self.rng, list):
+            count = len(x) // len(self.rng)
+            angles = np.concatenate([self._angles(rng, count) for rng in self.rng])
+        else:
+            angles = self._angles(self.rng, len(x))
+        x = x + self.speed * np.cos(angles)
+        y = y + self.speed * np.sin(angles)
+        width, height = self.area
+        if self.boundary == "reflect":
+            # A move is shorter than the area, so one reflection suffices
+            x = np.abs(x)
+            x = np.where(x > width, 2 * width - x, x)
+            y = np.abs(y)
+            y = np.where(y > height, 2 * height - y, y)
+        return np.clip(x, 0.0, width), np.clip(y, 0.0, height)
+
+    @staticmethod
+    def _angles(rng, count: int) -> np.ndarray:
+        # The directions of count moves, drawn as User.update draws them
+        if isinstance(rng, np.random.Generator):
+            return rng.uniform(0, 2 * math.pi, count)
+        stream = random if rng is None else rng
+        return np.array([stream.uniform(0, 2 * math.pi) for _ in range(count)])
+
+    def distance(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        # Distance to the nearest broker, which is H meters above the ground
+        if self.grid is None:
+            broker_x, broker_y = X_broker, Y_broker
+        else:
+            broker_x, broker_y = self.grid.brokers[self.grid.locate(x, y)].T
+        return np.sqrt((broker_x - x) ** 2 + (broker_y - y) ** 2 + H**2)
+
+    def _rate_factor(self, distance: np.ndarray) -> np.ndarray:
+        # P_r = P_t * (λ / (4πd))^2, C = B * log2(1 + SNR)
+        received_power = (
+            transmission_power * (self.wavelength / (4 * math.pi * distance)) ** 2
+        )
+        return bandwidth / 2000 * np.log2(1 + received_power / noise)
+
+    def rate_factor(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            x (np.ndarray): The users' x-coordinates.
+            y (np.ndarray): The users' y-coordinates.
+
+        Returns:
+            np.ndarray: The data rate of one resource block for every user,
+                interpolated from the table if there is one.
+        """
+        distance = self.distance(x, y)
+        if self.table is not None:
+            return np.interp(distance, *self.table)
+        return self._rate_factor(distance)
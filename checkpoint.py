@@ -0,0 +1,86 @@
+import os
+import pickle
+
+# Settings of a simulation that a fork may change, see load
+FORK_OPTIONS = (
+    "slots",
+    "step_size",
+    "price_update",
+    "payoff_engine",
+    "kernel_backend",
+    "warm_bids",
+    "equilibrium_tolerance",
+)
+
+
+def save(simulation, path: str) -> None:
+    """
+    Writes the full state of a simulation between two slots, so that load()
+    continues it exactly where it stopped.
+
+    The simulation is pickled as a whole: users, population, demand, its
+    random streams, recorders, warm start and incremental caches. Series and
+    traces streamed to files only keep how much was written, so the
+    checkpoint does not grow with them. The file is replaced atomically, so a
+    crash while saving keeps the previous one.
+
+    Args:
+        simulation: A Simulation or MultiCellSimulation.
+        path (str): The checkpoint file.
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        pickle.dump(simulation, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def load(path: str, record_dir: str = None, trace_dir: str = None, **changes):
+    """
+    Restores a simulation saved by save(), to resume it or to fork it.
+
+    Running the restored simulation gives the same results, bit for bit, as
+    running the saved one would have. The series and traces streamed to files
+    are taken back to the checkpoint, dropping what was written after it. To
+    fork many branches from one checkpoint, load it once per branch with the
+    changed settings and, if the runs stream to files, their own record_dir
+    and trace_dir, so the branches do not overwrite each other.
+
+    Args:
+        path (str): The checkpoint file.
+        record_dir (str): Where the recorded series are streamed to from now
+            on, with a copy of those written before the checkpoint. By
+            default the saved directory is kept.
+        trace_dir (str): The same for the per-slot trace.
+        **changes: New values of the settings in FORK_OPTIONS.
+
+    Returns:
+        The restored simulation.
+
+    Raises:
+        ValueError: If a setting cannot be changed.
+    """
+    for name in changes:
+        if name not in FORK_OPTIONS:
+            raise ValueError(f"A fork cannot change {name}")
+    with open(path, "rb") as f:
+        simulation = pickle.load(f)
+    simulation.recorder.restore(record_dir)
+    if simulation.trace is not None:
+        simulation.trace.restore(trace_dir)
+    for name, value in changes.items():
+        setattr(simulation, name, value)
+        if name in simulation.config:
+            simulation.config[name] = value
+    if changes.get("equilibrium_tolerance") is not None:
+        if simulation.incremental is not None:
+            raise ValueError("The incremental clearing stops on the price change")
+        simulation.equilibrium_gap = True
+    incremental = simulation.incremental
+    if incremental is not None:
+        # The incremental clearing keeps its own copy of the price settings
+        if "step_size" in changes:
+            incremental.step_size = simulation.step_size
+            incremental.price_tolerance = 5.0 * simulation.step_size
+        if "price_update" in changes:
+            incremental.price_update = simulation.price_update
+    return simulation
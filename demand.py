@@ -1,12 +1,13 @@
 UNIFORM = False
 PARETO = True
 
+import json
+import os
 import random
-import matplotlib.pyplot as plt
+import tempfile
+import numpy as np
 from scipy.optimize import fsolve
 
-random.seed(2025)
-
 round_number = 720
 HB_user_number = 5
 LR_user_number = 5
@@ -19,13 +20,131 @@ HB_avg_demand = 1000
 HB_max_demand = 4000
 
 
+# Memoized alpha per (min_value, max_value, mean), and the optional file it
+# is persisted to
+_alpha_cache = {}
+_alpha_cache_file = None
+
+
+def _pareto_mean(alpha, min_val, max_val, target_mean):
+    if alpha <= 0:
+        return float("inf")
+    if alpha == 1:
+        return float("inf")
+    # The correct equation to solve for alpha, setting it equal to 0
+    return (
+        (alpha * min_val) / (alpha - 1)
+        - (alpha * max_val ** (1 - alpha) * min_val**alpha)
+        / (1 - (max_val / min_val) ** (-alpha))
+        - target_mean
+    )
+
+
+def _cache_key(min_value: float, max_value: float, mean: float) -> str:
+    return f"{float(min_value)!r},{float(max_value)!r},{float(mean)!r}"
+
+
+def calibrate_alpha(min_value: float, max_value: float, mean: float) -> float:
+    """
+    Calculates the alpha of a Pareto distribution truncated at max_value with
+    the given minimum and mean, using scipy.optimize.fsolve. The result is
+    memoized per parameters, and persisted if use_alpha_cache_file was called.
+
+    Returns:
+        float: The calculated alpha parameter.
+    """
+    key = _cache_key(min_value, max_value, mean)
+    if key not in _alpha_cache:
+        alpha_initial_guess = mean / (
+            mean - min_value
+        )  # Provide a reasonable starting point
+        (alpha,) = fsolve(
+            _pareto_mean,
+            alpha_initial_guess,
+            args=(min_value, max_value, mean),
+        )  # Unpack the result of fsolve
+        _store_alpha(key, alpha)
+    return _alpha_cache[key]
+
+
+def use_alpha_cache_file(path: str) -> None:
+    """
+    Loads the alphas calibrated in earlier runs from a JSON file, and writes
+    every new calibration to it.
+    """
+    global _alpha_cache_file
+    _alpha_cache_file = path
+    if os.path.exists(path):
+        with open(path) as f:
+            _alpha_cache.update(json.load(f))
+
+
+def _store_alpha(key: str, alpha: float) -> None:
+    _alpha_cache[key] = float(alpha)
+    if _alpha_cache_file is not None:
+        # Several runs may share the file, e.g. under auto_run.py: merge in
+        # what the file holds and replace it atomically, so a reader never
+        # sees a partial write. A run storing at the same time may still
+        # lose its alphas, which then are calibrated again on its next run
+        directory = os.path.dirname(os.path.abspath(_alpha_cache_file))
+        stored = {}
+        try:
+            with open(_alpha_cache_file) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            pass
+        stored.update(_alpha_cache)
+        fd, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(stored, f, indent=1)
+            os.replace(path, _alpha_cache_file)
+        except BaseException:
+            os.remove(path)
+            raise
+
+
+class DemandStream:
+    """
+    Demand of a generator drawn lazily in chunks as the rounds advance.
+
+    Only the current chunk is kept, so the rounds must be read in increasing
+    order, as User.update does.
+    """
+
+    def __init__(self, generator, chunk_size: int = 1024):
+        self.generator = generator
+        self.chunk_size = chunk_size
+        self.offset = 0
+        self.chunk = generator.generate(chunk_size)
+
+    def __getitem__(self, index: int) -> float:
+        if index < self.offset:
+            raise IndexError("DemandStream can only move forward")
+        while index >= self.offset + len(self.chunk):
+            self.offset += len(self.chunk)
+            self.chunk = self.generator.generate(self.chunk_size)
+        return self.chunk[index - self.offset]
+
+
 class UniformGenerator:
-    def __init__(self, min_value: float, max_value: float):
+    def __init__(self, min_value: float, max_value: float, rng=None):
         self.min_value = min_value
         self.max_value = max_value
+        self.rng = rng
+
+    def generate(self, len) -> np.ndarray:
+        if isinstance(self.rng, np.random.Generator):
+            return self.rng.uniform(self.min_value, self.max_value, len)
+        stream = random if self.rng is None else self.rng
+        return np.array(
+            [stream.uniform(self.min_value, self.max_value) for _ in range(len)]
+        )
 
-    def generate(self, len) -> float:
-        return [random.uniform(self.min_value, self.max_value) for _ in range(len)]
+    def stream(self, chunk_size: int = 1024) -> DemandStream:
+        if not isinstance(self.rng, np.random.Generator):
+            raise ValueError("Lazy generation needs a NumPy Generator")
+        return DemandStream(self, chunk_size)
 
 
 class ParetoGenerator:
@@ -34,7 +153,7 @@ class ParetoGenerator:
     maximum value, and mean.
     """
 
-    def __init__(self, min_value: float, max_value: float, mean: float):
+    def __init__(self, min_value: float, max_value: float, mean: float, rng=None):
         """
         Initializes the ParetoGenerator with the given parameters.
 
@@ -42,6 +161,10 @@ class ParetoGenerator:
             min_value (float): The minimum value of the distribution.
             max_value (float): The maximum value of the distribution.
             mean (float): The desired mean of the distribution.
+            rng: The stream to draw from, a NumPy Generator drawn from
+                vectorized or a random.Random drawn from one value after the
+                other. By default the values are drawn one by one from the
+                random module.
 
         Raises:
             ValueError: If any of the input parameters are invalid
@@ -57,6 +180,7 @@ class ParetoGenerator:
         self.min_value = min_value
         self.max_value = max_value
         self.mean = mean
+        self.rng = rng
         self.alpha = (
             self._calculate_alpha()
         )  # Calculate alpha based on min, max, and mean
@@ -66,57 +190,51 @@ class ParetoGenerator:
         Calculates the alpha (shape) parameter of the Pareto distribution based on
         the desired min_value, max_value and mean.
 
-        The formula to derive alpha is complex and requires numerical solution.
-        We use scipy.optimize.fsolve to find the alpha.
+        The formula to derive alpha is complex and requires numerical solution,
+        so the result is memoized per parameters, see calibrate_alpha.
 
         Returns:
             float: The calculated alpha parameter.
         """
+        return calibrate_alpha(self.min_value, self.max_value, self.mean)
 
-        def pareto_mean(alpha, min_val, max_val, target_mean):
-            if alpha <= 0:
-                return float("inf")
-            if alpha == 1:
-                return float("inf")
-            # The correct equation to solve for alpha, setting it equal to 0
-            return (
-                (alpha * min_val) / (alpha - 1)
-                - (alpha * max_val ** (1 - alpha) * min_val**alpha)
-                / (1 - (max_val / min_val) ** (-alpha))
-                - target_mean
-            )
-
-        alpha_initial_guess = self.mean / (
-            self.mean - self.min_value
-        )  # Provide a reasonable starting point
-        (alpha,) = fsolve(
-            pareto_mean,
-            alpha_initial_guess,
-            args=(self.min_value, self.max_value, self.mean),
-        )  # Unpack the result of fsolve
-
-        return alpha
-
-    def generate(self, size: int) -> list:
+    def generate(self, size: int) -> np.ndarray:
         """
-        Generates a list of numbers following the Pareto distribution.
+        Generates an array of numbers following the Pareto distribution.
 
         Args:
             size (int): The number of values to generate.
 
         Returns:
-            list: A list of numbers following the Pareto distribution with the
-                  specified parameters.
+            np.ndarray: Numbers following the Pareto distribution with the
+                specified parameters.
         """
+        if isinstance(self.rng, np.random.Generator):
+            # Generate from the standard Pareto, scaled to the minimum value
+            with np.errstate(divide="ignore"):
+                samples = self.min_value * self.rng.random(size) ** (-1 / self.alpha)
+            return np.minimum(samples, self.max_value)
 
+        stream = random if self.rng is None else self.rng
         samples = []
         for _ in range(size):
             # Generate from the standard Pareto
-            standard_pareto = (random.random()) ** (-1 / self.alpha)
+            standard_pareto = (stream.random()) ** (-1 / self.alpha)
             # Scale and shift to fit the minimum value
             value = self.min_value * standard_pareto
             if value <= self.max_value:
                 samples.append(value)
             else:
                 samples.append(self.max_value)
-        return samples
+        return np.array(samples)
+
+    def stream(self, chunk_size: int = 1024) -> DemandStream:
+        """
+        Generates the numbers lazily in chunks of chunk_size.
+
+        Raises:
+            ValueError: If the generator has no NumPy Generator.
+        """
+        if not isinstance(self.rng, np.random.Generator):
+            raise ValueError("Lazy generation needs a NumPy Generator")
+        return DemandStream(self, chunk_size)
@@ -0,0 +1,145 @@
+import hashlib
+import math
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+# The per-user inputs of the best responses a fingerprint is taken of
+FINGERPRINT_PARAMETERS = ("willingness", "rate_factor", "buffer", "assigned_blocks")
+
+
+class EquilibriumCache:
+    """
+    Memoizes the equilibria of cleared slots by a fingerprint of the market.
+
+    A user's best response depends on its role, willingness, rate factor,
+    buffer term (max_buffer - next_loss) and assigned blocks, so a slot
+    whose buyers are the same users and whose inputs fall in the same
+    relative bins of width quantum as a cleared one has nearly the same
+    clearing price and bids. The equilibria are kept in memory up to size
+    entries, the least recently used ones are dropped first, and optionally
+    in a folder shared by runs and sweep points, one file per fingerprint.
+    """
+
+    def __init__(self, quantum: float = 1e-2, size: int = 4096, directory=None):
+        """
+        Args:
+            quantum (float): The relative width of the bins the inputs are
+                quantized to.
+            size (int): The number of equilibria kept in memory.
+            directory (str): Where the equilibria are also stored, read by
+                every run using the folder. None keeps them in memory only.
+
+        Raises:
+            ValueError: If the quantum or the size is not positive.
+        """
+        if quantum <= 0 or size < 1:
+            raise ValueError("The quantum and the size must be positive")
+        self.quantum = quantum
+        self.size = size
+        self.directory = directory
+        self.entries = OrderedDict()
+        # Lookups found in memory, found on disk and not found
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def fingerprint(
+        self, buyer_ids, buyer_parameters: dict, seller_parameters: dict
+    ) -> str:
+        """
+        Args:
+            buyer_ids: The ids of the buyers, in the order of their bids.
+            buyer_parameters (dict): The buyers' parameters, see
+                tools.user_parameters.
+            seller_parameters (dict): The sellers' parameters.
+
+        Returns:
+            str: The hex digest of the roles and the quantized inputs.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.float64(self.quantum).tobytes())
+        digest.update(np.asarray(buyer_ids, dtype=np.int64).tobytes())
+        scale = 1.0 / math.log1p(self.quantum)
+        for parameters in (buyer_parameters, seller_parameters):
+            for name in FINGERPRINT_PARAMETERS:
+                values = np.maximum(parameters[name], np.finfo(float).tiny)
+                bins = np.floor(np.log(values) * scale).astype(np.int64)
+                digest.update(bins.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """
+        Looks an equilibrium up, in memory first and then on disk.
+
+        Returns:
+            dict: The "price", the "demand" of the last price iteration and
+                the "buyer_bids" and "seller_bids", or None if the fingerprint
+                was not cleared yet.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        if self.directory is not None:
+            try:
+                with np.load(self._path(key)) as stored:
+                    entry = {name: stored[name] for name in stored.files}
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None:
+                entry["price"] = float(entry["price"])
+                entry["demand"] = float(entry["demand"])
+                self._remember(key, entry)
+                self.disk_hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, key: str, price, demand, buyer_bids, seller_bids) -> None:
+        """
+        Stores the equilibrium of a cleared slot.
+
+        Args:
+            key (str): The fingerprint of the slot.
+            price (float): The clearing price.
+            demand (float): The demand of the last price iteration.
+            buyer_bids (np.ndarray): The last bids of the buyers.
+            seller_bids (np.ndarray): The last bids of the sellers.
+        """
+        entry = {
+            "price": float(price),
+            "demand": float(demand),
+            "buyer_bids": np.array(buyer_bids, dtype=float),
+            "seller_bids": np.array(seller_bids, dtype=float),
+        }
+        self._remember(key, entry)
+        if self.directory is not None:
+            # Replace atomically, so other runs never read a partial file
+            fd, path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, **entry)
+                os.replace(path, self._path(key))
+            except BaseException:
+                os.remove(path)
+                raise
+
+    def hit_rate(self) -> float:
+        # The fraction of lookups answered from memory or disk
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def _remember(self, key: str, entry: dict) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".npz")
@@ -1,27 +1,23 @@
-from user import User
-from tqdm import tqdm
-import matplotlib.pyplot as plt
-from tools import *
-import random
+from user import KERNEL_BACKENDS, PAYOFF_ENGINES
+from pricing import PRICE_UPDATES, WarmStart
+from simulation import MODES, Simulation, print_summary
+from recorder import LEVELS
+from demand import use_alpha_cache_file
+from channel import BOUNDARIES
+from cells import MultiCellSimulation
+from replicas import print_statistics, run_replicas
+from profiling import PROFILERS, profile
+from checkpoint import FORK_OPTIONS, load as load_checkpoint
 import argparse
-
-random.seed(2025)
-SMALL_SIZE = 10
-MEDIUM_SIZE = 14
-BIG_SIZE = 15
-plt.rc("font", size=BIG_SIZE)  # controls default text sizes
-plt.rc("axes", titlesize=BIG_SIZE)  # fontsize of the axes title
-plt.rc("axes", labelsize=BIG_SIZE)  # fontsize of the x and y labels
-plt.rc("xtick", labelsize=BIG_SIZE)  # fontsize of the tick labels
-plt.rc("ytick", labelsize=BIG_SIZE)  # fontsize of the tick labels
-plt.rc("legend", fontsize=BIG_SIZE)  # legend fontsize
-plt.rc("figure", titlesize=BIG_SIZE)  # fontsize of the figure title
+import os
+import sys
 
 parser = argparse.ArgumentParser(description="Construct SAGs")
 parser.add_argument(
     "--mode",
     type=str,
     default="FUTURE",
+    choices=MODES,
 )
 parser.add_argument(
     "--slots",
@@ -38,200 +34,458 @@ parser.add_argument(
     type=int,
     default=2000,
 )
+parser.add_argument(
+    "--seed",
+    type=int,
+    default=2025,
+)
+parser.add_argument(
+    "--hb_users",
+    type=int,
+    default=5,
+)
+parser.add_argument(
+    "--lr_users",
+    type=int,
+    default=5,
+)
+parser.add_argument(
+    "--output_dir",
+    type=str,
+    default=None,
+    help="where figures are saved, ./logs/{mode} by default",
+)
+parser.add_argument(
+    "--no_plots",
+    "--no-plots",
+    action="store_true",
+    help="skip the figures and never load matplotlib",
+)
+parser.add_argument(
+    "--record",
+    type=str,
+    default="auto",
+    choices=("auto",) + LEVELS,
+    help="recording level, by default only what the setting reports",
+)
+parser.add_argument(
+    "--record_dir",
+    type=str,
+    default=None,
+    help="stream the recorded series to this folder",
+)
+parser.add_argument(
+    "--trace_dir",
+    type=str,
+    default=None,
+    help="write the per-slot state to this folder, see traces.py",
+)
+parser.add_argument(
+    "--demand_rng",
+    type=str,
+    default="random",
+    choices=("random", "numpy"),
+    help="draw the demand (and with --population the moves) from the random "
+    "module or NumPy streams spawned from the seed",
+)
+parser.add_argument(
+    "--lazy_demand",
+    action="store_true",
+    help="draw the demand in chunks as the slots advance (numpy only)",
+)
+parser.add_argument(
+    "--population",
+    action="store_true",
+    help="keep the users' state in arrays and update all users at once",
+)
+parser.add_argument(
+    "--boundary",
+    type=str,
+    default="clamp",
+    choices=BOUNDARIES,
+    help="how moves out of the area are handled (needs --population)",
+)
+parser.add_argument(
+    "--rate_table",
+    type=int,
+    default=0,
+    help="interpolate the rates from a table of this size (needs --population)",
+)
+parser.add_argument(
+    "--incremental",
+    type=float,
+    default=None,
+    metavar="TOLERANCE",
+    help="re-solve only users whose inputs moved by more than this fraction",
+)
+parser.add_argument(
+    "--incremental_check",
+    action="store_true",
+    help="also clear every slot in full and report the deviation",
+)
+parser.add_argument(
+    "--equilibrium_cache",
+    type=float,
+    default=None,
+    metavar="QUANTUM",
+    help="reuse the equilibria of slots whose roles match and whose users' "
+    "inputs are within relative bins of this width",
+)
+parser.add_argument(
+    "--equilibrium_cache_size",
+    type=int,
+    default=4096,
+    help="equilibria kept in memory, least recently used dropped first",
+)
+parser.add_argument(
+    "--equilibrium_cache_dir",
+    type=str,
+    default=None,
+    help="also store the equilibria in this folder, shared across runs",
+)
+parser.add_argument(
+    "--equilibrium_cache_warm",
+    action="store_true",
+    help="only start the price iteration and bids from a cached equilibrium",
+)
+parser.add_argument(
+    "--equilibrium_cache_check",
+    action="store_true",
+    help="also clear the slots found in the cache and report the deviation",
+)
+parser.add_argument(
+    "--equilibrium_tolerance",
+    type=float,
+    default=None,
+    metavar="GAP",
+    help="clear each slot until no user gains more than GAP by its best "
+    "response at the price the bids induce, instead of until the price settles",
+)
+parser.add_argument(
+    "--equilibrium_gap",
+    action="store_true",
+    help="report the equilibrium gap and excess demand of every slot's bids",
+)
+parser.add_argument(
+    "--metrics",
+    type=str,
+    default=None,
+    metavar="CSV",
+    help="instrument the hot paths and write a per-slot metrics table",
+)
+parser.add_argument(
+    "--profile",
+    type=str,
+    default=None,
+    choices=PROFILERS,
+    help="profile the run and save the result to the output folder",
+)
+parser.add_argument(
+    "--cells",
+    type=int,
+    nargs=2,
+    default=None,
+    metavar=("COLUMNS", "ROWS"),
+    help="run a market per cell of a grid of brokers, see cells.py "
+    "(implies --population and --batched)",
+)
+parser.add_argument(
+    "--jobs",
+    type=int,
+    default=1,
+    help="worker processes clearing the cell markets (with --cells or --replicas)",
+)
+parser.add_argument(
+    "--replicas",
+    type=int,
+    default=0,
+    help="run this many replicas, seeded --seed, --seed + 1, ..., together "
+    "and report the mean and 95%% confidence interval of the results, see "
+    "replicas.py (implies --population and --batched)",
+)
+parser.add_argument(
+    "--replica_batch",
+    type=int,
+    default=None,
+    help="replicas advanced together, all by default",
+)
+parser.add_argument(
+    "--alpha_cache",
+    type=str,
+    default=None,
+    help="JSON file persisting the Pareto calibrations across runs",
+)
+parser.add_argument(
+    "--payoff_engine",
+    type=str,
+    default="analytic",
+    choices=PAYOFF_ENGINES,
+)
+parser.add_argument(
+    "--kernel_backend",
+    type=str,
+    default="python",
+    choices=KERNEL_BACKENDS,
+    help="run the users' payoffs and best responses as Python methods or as "
+    "kernels compiled by Numba, auto when it is installed",
+)
+parser.add_argument(
+    "--price_update",
+    type=str,
+    default="gradient",
+    choices=list(PRICE_UPDATES),
+)
+parser.add_argument(
+    "--warm_start",
+    type=str,
+    default="cold",
+    choices=WarmStart.MODES,
+    help="initial market price of each slot",
+)
+parser.add_argument(
+    "--warm_bids",
+    action="store_true",
+    help="start each best response search around the user's last bid",
+)
+parser.add_argument(
+    "--warm_start_check",
+    action="store_true",
+    help="also clear each slot from the cold start and compare",
+)
+parser.add_argument(
+    "--batched",
+    action="store_true",
+    help="solve all best responses together with NumPy",
+)
+parser.add_argument(
+    "--checkpoint",
+    type=str,
+    default=None,
+    help="save the full state of the run to this file every --checkpoint_every slots",
+)
+parser.add_argument(
+    "--checkpoint_every",
+    type=int,
+    default=100,
+)
+parser.add_argument(
+    "--resume",
+    type=str,
+    default=None,
+    metavar="CHECKPOINT",
+    help="continue the run saved in this checkpoint; the settings come from "
+    "it, except --slots, --step_size, --price_update, --payoff_engine, "
+    "--kernel_backend, --warm_bids, --equilibrium_tolerance, --record_dir and "
+    "--trace_dir when given",
+)
 
-slots = parser.parse_args().slots
-step_size = parser.parse_args().step_size
-generations = parser.parse_args().generations
-RANDOM = parser.parse_args().mode == "RANDOM"
-STATIC = parser.parse_args().mode == "STATIC"
-HEURISTIC = parser.parse_args().mode == "HEURISTIC"
-FUTURE = parser.parse_args().mode == "FUTURE"
-
-users = [User(i, "HB", generations) for i in range(1, 6)] + [
-    User(j, "LR", generations) for j in range(6, 11)
-]
-if FUTURE:
-    for user in users:
-        user.next_loss = lambda: 10.0 * user.last_loss
-
-price_rec = []
-demand_rec = []
-supply_rec = []
-welfare_rec = []
-clr_price_rec = []
-market_clearing_welfare = []
-
-for _ in tqdm(range(slots)):
-
-    # Phase 1: Update the user's buffer
-    for user in users:
-        user.update()
-
-    # print("Round:", _ + 1)
-    # Calculate the average expected price as the initial market price
-    initial_market_price = sum(user.expected_price() for user in users) / len(users)
-
-    if RANDOM:
-        buyers = random.sample(users, 5)
-        for user in users:
-            user.is_buyer = user in buyers
+args = parser.parse_args()
+if args.alpha_cache:
+    use_alpha_cache_file(args.alpha_cache)
+record = args.record
+if record == "auto":
+    # The 1-slot figures need the iterations, the 360-slot ones the slots
+    if args.slots == 1 and not args.no_plots:
+        record = "trace"
+    elif args.slots == 360 and not args.no_plots:
+        record = "summary"
     else:
-        # Determine the role of each user based on the market price
-        for user in users:
-            user.is_buyer = user.expected_price() > initial_market_price
+        record = "none"
 
-    buyers = [user for user in users if user.is_buyer]
-    sellers = [user for user in users if user.is_seller()]
-    market_clearing_welfare.append(calculate_initial_welfare(sellers, buyers))
-    welfare_rec.append(calculate_initial_welfare(sellers, buyers))
-
-    if not STATIC:
-        market_clearing_price = 0.0
-        initial_market_price = 1.095
-        ############### Do Trade ################
-        if buyers and len(sellers) > 1:
-            (
-                market_clearing_price,
-                local_price_rec,
-                local_demand_rec,
-                local_supply_rec,
-                local_welfare_rec,
-            ) = optimal_bidding(buyers, sellers, initial_market_price, step_size)
-            price_rec += local_price_rec
-            demand_rec += local_demand_rec
-            supply_rec += local_supply_rec
-            welfare_rec += local_welfare_rec
+options = dict(
+    mode=args.mode,
+    slots=args.slots,
+    step_size=args.step_size,
+    generations=args.generations,
+    hb_users=args.hb_users,
+    lr_users=args.lr_users,
+    seed=args.seed,
+    payoff_engine=args.payoff_engine,
+    kernel_backend=args.kernel_backend,
+    batched=args.batched,
+    price_update=args.price_update,
+    warm_start=args.warm_start,
+    warm_bids=args.warm_bids,
+    warm_start_check=args.warm_start_check,
+    record=record,
+    record_dir=args.record_dir,
+    trace_dir=args.trace_dir,
+    demand_rng=args.demand_rng,
+    lazy_demand=args.lazy_demand,
+    boundary=args.boundary,
+    rate_table=args.rate_table,
+    incremental=args.incremental,
+    incremental_check=args.incremental_check,
+    equilibrium_cache=args.equilibrium_cache,
+    equilibrium_cache_size=args.equilibrium_cache_size,
+    equilibrium_cache_dir=args.equilibrium_cache_dir,
+    equilibrium_cache_warm=args.equilibrium_cache_warm,
+    equilibrium_cache_check=args.equilibrium_cache_check,
+    equilibrium_tolerance=args.equilibrium_tolerance,
+    equilibrium_gap=args.equilibrium_gap,
+    metrics=args.metrics is not None,
+)
+if args.replicas:
+    options["batched"] = True
+    seed = options.pop("seed")
+    summary = run_replicas(
+        range(seed, seed + args.replicas),
+        args.replica_batch,
+        progress=True,
+        jobs=args.jobs,
+        **options,
+    )
+    print_statistics(summary)
+    sys.exit()
+if args.resume:
+    # A fork of the saved run if any of its settings is changed
+    changes = {
+        name: getattr(args, name)
+        for name in FORK_OPTIONS
+        if getattr(args, name) != parser.get_default(name)
+    }
+    simulation = load_checkpoint(
+        args.resume, record_dir=args.record_dir, trace_dir=args.trace_dir, **changes
+    )
+elif args.cells:
+    options["batched"] = True
+    simulation = MultiCellSimulation(cells=tuple(args.cells), jobs=args.jobs, **options)
+else:
+    simulation = Simulation(population=args.population, **options)
+slots = simulation.slots
+output_dir = args.output_dir or f"./logs/{simulation.mode}"
+run_options = dict(
+    progress=True,
+    checkpoint=args.checkpoint,
+    checkpoint_every=args.checkpoint_every if args.checkpoint else 0,
+)
+if args.profile:
+    os.makedirs(output_dir, exist_ok=True)
+    extension = ".prof" if args.profile == "cprofile" else ".html"
+    with profile(args.profile, os.path.join(output_dir, "profile" + extension)):
+        summary = simulation.run(**run_options)
+else:
+    summary = simulation.run(**run_options)
+if isinstance(simulation, MultiCellSimulation):
+    simulation.close()
 
-            # Round up
-            buyer_amounts, seller_amounts = [], []
-            original_amounts = []
-            for user in users:
-                if user.is_buyer:
-                    buyer_amounts.append(user.bid / market_clearing_price)
-                    original_amounts.append(user.bid / market_clearing_price)
-                else:
-                    seller_amounts.append(
-                        user.bid / market_clearing_price - user.assigned_blocks
-                    )
-                    original_amounts.append(
-                        user.bid / market_clearing_price - user.assigned_blocks
-                    )
-            buyer_int, seller_int = largest_remainder_method(
-                buyer_amounts
-            ), largest_remainder_method(seller_amounts)
-            for user in users:
-                if user.is_buyer:
-                    user.trading_amount = buyer_int.pop(0)
-                else:
-                    user.trading_amount = seller_int.pop(0)
-            # print("Amount", [user.trading_amount for user in users])
+users = simulation.users
+iteration_rec = simulation.iteration_rec
+cold_iteration_rec = simulation.cold_iteration_rec
 
-        # Record the market clearing price
-        clr_price_rec.append(market_clearing_price)
+# Report the number of price iterations needed to clear the slots
+if iteration_rec.count:
+    print(
+        "Price iterations:",
+        int(iteration_rec.total),
+        "(mean per slot: %.1f, max: %d)"
+        % (iteration_rec.mean(), iteration_rec.maximum),
+    )
+if cold_iteration_rec.count:
+    print(
+        "Iterations saved by warm start:",
+        int(cold_iteration_rec.total - iteration_rec.total),
+        "of",
+        int(cold_iteration_rec.total),
+    )
+    # Slots without trade clear at any price of an interval, so the traded
+    # amounts are compared as well
+    print(
+        "Max deviation from cold start: price %.3e, traded RBs %.3f"
+        % (
+            simulation.cold_price_deviation.maximum,
+            simulation.cold_amount_deviation.maximum,
+        )
+    )
 
-        market_clearing_welfare[-1] = calculate_social_welfare(sellers, buyers)
-        ############### Do Trade ################
+if simulation.clearing_seconds.count:
+    print(
+        "Market clearing time: %.3f ms per slot"
+        % (1e3 * simulation.clearing_seconds.mean())
+    )
+if simulation.trade_imbalance.count:
+    # Each side keeps its rounded total, so this is the excess demand left
+    # by the price tolerance plus at most one RB of rounding
+    print(
+        "Largest gap between RBs bought and sold: %d"
+        % simulation.trade_imbalance.maximum
+    )
+if simulation.equilibrium_gap_rec.count:
+    # The payoff any user could still gain by deviating from its last bid,
+    # and the RBs the last bids leave unmatched at the clearing price
+    print(
+        "Equilibrium gap: max %.3e, mean %.3e per slot"
+        % (
+            simulation.equilibrium_gap_rec.maximum,
+            simulation.equilibrium_gap_rec.mean(),
+        )
+    )
+    print(
+        "Excess demand at the clearing price: max %.3f RBs"
+        % simulation.excess_demand_rec.maximum
+    )
+if simulation.skipped_rec.count:
+    # Estimated best responses are cheaper than solved ones, not free, so
+    # compare the clearing time with a run without --incremental
+    print(
+        "Best responses estimated by incremental clearing: %.1f%%"
+        % (100 * simulation.skipped_rec.mean())
+    )
+if simulation.full_price_deviation.count:
+    print(
+        "Max deviation from full clearing: price %.3e, traded RBs %.3f"
+        % (
+            simulation.full_price_deviation.maximum,
+            simulation.full_amount_deviation.maximum,
+        )
+    )
+if simulation.equilibrium_cache is not None:
+    cache = simulation.equilibrium_cache
+    print(
+        "Equilibrium cache hit rate: %.1f%% (%d in memory, %d on disk, %d misses)"
+        % (100 * cache.hit_rate(), cache.hits, cache.disk_hits, cache.misses)
+    )
+if simulation.cache_price_deviation.count:
+    print(
+        "Max deviation of cached equilibria: price %.3e, traded RBs %.3f"
+        % (
+            simulation.cache_price_deviation.maximum,
+            simulation.cache_amount_deviation.maximum,
+        )
+    )
 
-    buyers = [user for user in users if user.is_buyer]
-    sellers = [user for user in users if user.is_seller()]
+if simulation.metrics is not None:
+    simulation.metrics.print_totals()
+    # A resumed run keeps the metrics of the saved one
+    if args.metrics:
+        simulation.metrics.to_csv(args.metrics)
 
-    # Record the current state of each user
-    for user in users:
-        user.record_current_state()
+# Make sure the output folder exists
+os.makedirs(output_dir, exist_ok=True)
 
 # Output and plot results for specific settings
 # Output the numerical results for 12 hours (4320 slots)
 if slots == 4320:
-    print("Loss counter:", sum([user.loss_counter for user in users]))
-    print("Loss amount:", sum([user.loss_amount_counter for user in users]))
-    print("Waste counter:", sum([user.waste_counter for user in users]))
-    print("Waste amount:", sum([user.waste_amount_counter for user in users]))
-    print("Total social welfare:", sum(market_clearing_welfare))
-    print("Min_welfare:", min(market_clearing_welfare))
-
-    for user in users:
-        print(
-            user.id,
-            user.loss_counter,
-            user.loss_amount_counter,
-            user.waste_counter,
-            user.waste_amount_counter,
-            sum(user.utility_rec),
-        )
+    print_summary(summary)
 
 # Plot the buffer and willingness trends for 1 hour (360 slots)
-elif slots == 360:
-    plt.plot([], linestyle="--", label="LR users", linewidth=2, color="black")
-    plt.plot([], linestyle="-", label="HB users", linewidth=2, color="black")
-    for user in users:
-        if user.type == "LR":
-            plt.plot(user.emp_buffer_rec, linestyle="--", linewidth=2)
-        else:
-            plt.plot(user.emp_buffer_rec, linestyle="-", linewidth=2)
-    plt.xlabel("Number of Time Slots", fontsize=BIG_SIZE)
-    plt.ylabel("Bits", fontsize=BIG_SIZE)
-    plt.legend(loc="best", fontsize=MEDIUM_SIZE)
-    plt.savefig(
-        f"./logs/{parser.parse_args().mode}/" + "Empty Buffer Trend" + ".png",
-        dpi=300,
-        bbox_inches="tight",
-    )
-    plt.clf()
+elif slots == 360 and not args.no_plots:
+    # matplotlib is only loaded when figures are requested
+    from reporting import plot_trends
 
-    plt.plot([], linestyle="--", label="LR users", linewidth=2, color="black")
-    plt.plot([], linestyle="-", label="HB users", linewidth=2, color="black")
-    for user in users:
-        if user.type == "LR":
-            plt.plot(user.expected_price_rec, linestyle="--", linewidth=2)
-        else:
-            plt.plot(user.expected_price_rec, linestyle="-", linewidth=2)
-    plt.gca().ticklabel_format(
-        axis="y", style="sci", scilimits=(0, 0), useMathText=True
-    )
-    plt.xlabel("Number of Time Slots", fontsize=BIG_SIZE)
-    plt.ylabel("Willingness to Buy", fontsize=BIG_SIZE)
-    plt.legend(loc="best", fontsize=MEDIUM_SIZE)
-    plt.savefig(
-        f"./logs/{parser.parse_args().mode}/" + "Willingness Trend" + ".png",
-        dpi=300,
-        bbox_inches="tight",
-    )
-    plt.clf()
+    plot_trends(users, output_dir)
 
 # Plot the price, resource, and social welfare convergence for 1 slot
-elif slots == 1:
-    plt.plot(price_rec, label="Market Price", linewidth=2.5)
-    plt.xlabel("Number of Iterations", fontsize=MEDIUM_SIZE)
-    plt.ylabel("Unit Price", fontsize=MEDIUM_SIZE)
-    plt.legend(loc="best", fontsize=BIG_SIZE)
-    plt.savefig(
-        f"./logs/{parser.parse_args().mode}/" + "Price Trend" + ".png",
-        dpi=300,
-        bbox_inches="tight",
-    )
-    plt.clf()
-
-    plt.plot(demand_rec[1:], linestyle="-", label="Resource Requesting", linewidth=1.5)
-    plt.plot(supply_rec[1:], linestyle="--", label="Resource Sharing", linewidth=1.5)
-    plt.xlabel("Number of Iterations", fontsize=MEDIUM_SIZE)
-    plt.ylabel("Number of RBs", fontsize=MEDIUM_SIZE)
-    plt.legend(loc="best", fontsize=BIG_SIZE)
-    plt.savefig(
-        f"./logs/{parser.parse_args().mode}/"
-        + "Requested & Shared Resources Trend"
-        + ".png",
-        dpi=300,
-        bbox_inches="tight",
-    )
-    plt.clf()
+# The cell markets do not record their iterations
+elif (
+    slots == 1 and not args.no_plots and not isinstance(simulation, MultiCellSimulation)
+):
+    from reporting import plot_convergence
 
-    plt.plot(welfare_rec, label="Social Welfare", linewidth=2.5)
-    plt.xlabel("Number of Iterations", fontsize=MEDIUM_SIZE)
-    plt.ylabel("Utility Value", fontsize=MEDIUM_SIZE)
-    plt.legend(loc="best", fontsize=BIG_SIZE)
-    plt.savefig(
-        f"./logs/{parser.parse_args().mode}/" + "Social Welfare Trend" + ".png",
-        dpi=300,
-        bbox_inches="tight",
+    plot_convergence(
+        simulation.price_rec.values(),
+        simulation.demand_rec.values(),
+        simulation.supply_rec.values(),
+        simulation.welfare_rec.values(),
+        output_dir,
     )
-    plt.clf()
@@ -0,0 +1,345 @@
+import numpy as np
+
+from pricing import make_price_update
+from profiling import count, instrument
+from recorder import SeriesGroup
+from tools import (
+    batched_bids_as_buyer,
+    batched_bids_as_seller,
+    batched_payoff_as_buyer,
+    batched_payoff_as_seller,
+    batched_payoff_gradient_as_buyer,
+    batched_payoff_gradient_as_seller,
+    batched_utility,
+    user_parameters,
+)
+
+# Stale users up to this many are solved one by one with the scalar solver
+# of user.Bidder, which is faster than a batched bisection for few users
+SCALAR_USERS = 64
+
+# The columns of a cache row
+IS_BUYER, RATE_FACTOR, BUFFER, TOTAL_SUPPLY, PRICE, BID = range(6)
+PRICE_SLOPE, RATE_FACTOR_SLOPE, BUFFER_SLOPE, TOTAL_SUPPLY_SLOPE, G_BID = range(6, 11)
+
+
+class IncrementalClearing:
+    """
+    Clears the market re-solving only the users whose inputs changed.
+
+    A user's best response depends on its role, rate factor and buffer term
+    (max_buffer - next_loss), the total supply and the price. Whenever it is
+    solved, the bid is cached with its slopes in the price, the rate factor,
+    the buffer term and the total supply, which follow from the first-order
+    condition by the implicit function theorem. While the user keeps its role
+    and its rate factor, buffer term and total supply stay within a relative
+    tolerance of the cached ones, its bid is estimated from the cache: the
+    first-order estimate is a linear function of the price, set up once per
+    slot, which every price iteration refines by one vectorized Newton step on
+    the current payoff gradient. The price iterations only solve the best
+    responses of the other users, and the users' records are computed for all
+    iterations at once at the end of the slot.
+    """
+
+    def __init__(
+        self,
+        step_size: float,
+        price_update: str = "gradient",
+        tolerance: float = 1e-2,
+        price_tolerance: float = None,
+        relative_step: float = 1e-6,
+    ):
+        """
+        Args:
+            step_size (float): The step of the gradient price update.
+            price_update (str): See pricing.PRICE_UPDATES.
+            tolerance (float): The relative change of a user's rate factor,
+                buffer term or total supply above which its best response is
+                solved again.
+            price_tolerance (float): See tools.clearing_price.
+            relative_step (float): The relative step of the finite differences
+                of the payoff gradient the slopes are computed from.
+        """
+        self.step_size = step_size
+        self.price_update = price_update
+        self.tolerance = tolerance
+        self.price_tolerance = (
+            5.0 * step_size if price_tolerance is None else price_tolerance
+        )
+        self.relative_step = relative_step
+        # One row per user id, see the column names above, NaN until solved
+        self.cache = np.full((0, 11), np.nan)
+        # Best responses solved and those a full re-clear would have solved
+        self.solved = 0
+        self.full = 0
+
+    def skipped(self) -> float:
+        # The fraction of best responses a full re-clear solves that were not
+        return 1.0 - self.solved / self.full if self.full else 0.0
+
+    def _fresh(self, role: dict, total_supply: float) -> np.ndarray:
+        # Whether the cache rows of the role's users are still valid
+        ids = role["ids"]
+        if len(self.cache) <= ids.max(initial=-1):
+            grown = np.full((ids.max() + 1, 11), np.nan)
+            grown[: len(self.cache)] = self.cache
+            self.cache = grown
+        cached = self.cache[ids]
+        parameters = role["parameters"]
+        fresh = cached[:, IS_BUYER] == role["is_buyer"]
+        for column, value in [
+            (RATE_FACTOR, parameters["rate_factor"]),
+            (BUFFER, parameters["buffer"]),
+            (TOTAL_SUPPLY, total_supply),
+        ]:
+            # NaN rows compare False and stay stale
+            fresh &= np.abs(value - cached[:, column]) <= self.tolerance * np.abs(
+                cached[:, column]
+            )
+        return fresh
+
+    def _linearize(self, role: dict, total_supply: float) -> None:
+        # The first-order estimates of the fresh users' bids from the cache,
+        # linear in the price, with the derivatives of their payoff gradients
+        cached = self.cache[role["ids"][role["fresh"]]]
+        parameters = role["fresh_parameters"]
+        role["intercepts"] = (
+            cached[:, BID]
+            - cached[:, PRICE_SLOPE] * cached[:, PRICE]
+            + cached[:, RATE_FACTOR_SLOPE]
+            * (parameters["rate_factor"] - cached[:, RATE_FACTOR])
+            + cached[:, BUFFER_SLOPE] * (parameters["buffer"] - cached[:, BUFFER])
+            + cached[:, TOTAL_SUPPLY_SLOPE] * (total_supply - cached[:, TOTAL_SUPPLY])
+        )
+        role["slopes"] = cached[:, PRICE_SLOPE]
+        role["g_bid"] = cached[:, G_BID]
+
+    def _estimate(self, role: dict, price: float, total_supply: float) -> np.ndarray:
+        # The fresh users' bids at the price, the linear estimate refined by
+        # a Newton step on the current payoff gradient, within the bounds
+        if role["is_buyer"]:
+            gradient = batched_payoff_gradient_as_buyer
+        else:
+            gradient = batched_payoff_gradient_as_seller
+        upper_bounds = role["fresh_bounds"] * price
+        bids = np.minimum(
+            np.maximum(role["intercepts"] + role["slopes"] * price, 0.0), upper_bounds
+        )
+        bids -= (
+            gradient(role["fresh_parameters"], bids, price, total_supply)
+            / role["g_bid"]
+        )
+        return np.minimum(np.maximum(bids, 0.0), upper_bounds)
+
+    def _solve(self, role: dict, price: float, total_supply: float, guesses):
+        # The best responses of the stale users, warm-started at the guesses
+        users = role["stale_users"]
+        if len(users) > SCALAR_USERS:
+            return role["bids_as"](
+                role["stale_parameters"], price, total_supply, guesses
+            )
+        if guesses is None:
+            guesses = [None] * len(users)
+        else:
+            guesses = guesses.tolist()
+        bids = np.empty(len(users))
+        for i, (user, guess) in enumerate(zip(users, guesses)):
+            if role["is_buyer"]:
+                user.find_optimal_bid_as_buyer(price, total_supply, guess)
+            else:
+                user.find_optimal_bid_as_seller(price, total_supply, guess)
+            bids[i] = user.bid
+        return bids
+
+    def _slopes(self, role: dict, parameters: dict, bids, price, total_supply):
+        # Implicit function theorem on the first-order condition g = 0:
+        # d bid / d x = -(dg / dx) / (dg / d bid), by central differences,
+        # returned with dg / d bid for the Newton steps
+        h = self.relative_step
+        if role["is_buyer"]:
+            gradient = batched_payoff_gradient_as_buyer
+        else:
+            gradient = batched_payoff_gradient_as_seller
+
+        def g(parameters=parameters, bids=bids, price=price, total_supply=total_supply):
+            return gradient(parameters, bids, price, total_supply)
+
+        def times(name, factor):
+            return {**parameters, name: parameters[name] * factor}
+
+        bid_step = h * np.maximum(bids, 1.0)
+        g_bid = (g(bids=bids + bid_step) - g(bids=bids - bid_step)) / (2 * bid_step)
+        g_price = (g(price=price * (1 + h)) - g(price=price * (1 - h))) / (
+            2 * h * price
+        )
+        g_rate_factor = (
+            g(parameters=times("rate_factor", 1 + h))
+            - g(parameters=times("rate_factor", 1 - h))
+        ) / (2 * h * parameters["rate_factor"])
+        # The buffer term can be 0, so its step is absolute near 0
+        buffer_step = h * np.maximum(np.abs(parameters["buffer"]), 1.0)
+        g_buffer = (
+            g(parameters={**parameters, "buffer": parameters["buffer"] + buffer_step})
+            - g(parameters={**parameters, "buffer": parameters["buffer"] - buffer_step})
+        ) / (2 * buffer_step)
+        g_total_supply = (
+            g(total_supply=total_supply * (1 + h))
+            - g(total_supply=total_supply * (1 - h))
+        ) / (2 * h * total_supply)
+        slopes = -np.column_stack([g_price, g_rate_factor, g_buffer, g_total_supply])
+        slopes /= g_bid[:, None]
+
+        # Bids at a bound move with the bound
+        slopes[bids <= 0.0] = 0.0
+        if role["is_buyer"]:
+            slopes[bids >= total_supply * price] = [total_supply, 0.0, 0.0, price]
+        else:
+            at_upper = bids >= parameters["assigned_blocks"] * price
+            slopes[at_upper, 0] = parameters["assigned_blocks"][at_upper]
+            slopes[at_upper, 1:] = 0.0
+        return np.column_stack([slopes, g_bid])
+
+    @instrument()
+    def clear(
+        self, buyers, sellers, initial_price: float, welfare: bool = True
+    ) -> tuple:
+        """
+        Iterates best responses and price updates as tools.optimal_bidding.
+
+        The users' records are set from the best responses of every
+        iteration, solved or estimated, and their bids and trading amounts
+        from those of the last iteration.
+
+        Args:
+            buyers: The buyers of the slot.
+            sellers: The sellers of the slot.
+            initial_price (float): The market price of the first iteration.
+            welfare (bool): Whether to record the social welfare of every
+                iteration, see tools.optimal_bidding.
+
+        Returns:
+            tuple: The market clearing price and the per-iteration records of
+                price, demand, supply and social welfare, as optimal_bidding.
+        """
+        update_price = make_price_update(self.price_update, self.step_size)
+        total_supply = float(sum(seller.assigned_blocks for seller in sellers))
+        roles = [
+            {"is_buyer": True, "users": buyers, "bids_as": batched_bids_as_buyer},
+            {"is_buyer": False, "users": sellers, "bids_as": batched_bids_as_seller},
+        ]
+        for role in roles:
+            users = role["users"]
+            role["ids"] = np.array([user.id for user in users], dtype=int)
+            role["parameters"] = parameters = user_parameters(users)
+            # The upper bounds of the bids per unit of price
+            if role["is_buyer"]:
+                role["bounds"] = np.full(len(users), total_supply)
+            else:
+                role["bounds"] = parameters["assigned_blocks"]
+            role["fresh"] = fresh = self._fresh(role, total_supply)
+            role["stale"] = stale = ~fresh
+            role["fresh_parameters"] = {
+                name: value[fresh] for name, value in parameters.items()
+            }
+            role["stale_parameters"] = {
+                name: value[stale] for name, value in parameters.items()
+            }
+            role["stale_users"] = [users[i] for i in np.flatnonzero(stale).tolist()]
+            role["fresh_users"] = int(fresh.sum())
+            role["fresh_bounds"] = role["bounds"][fresh]
+            self._linearize(role, total_supply)
+            role["bids"] = np.empty(len(users))
+            role["bid_rows"] = []
+            solved = int(stale.sum())
+            self.solved += solved
+            self.full += len(users)
+            count("best_responses", solved)
+
+        market_price = initial_price
+        local_price_rec = []
+        delta_price = 100
+        while abs(delta_price) > self.price_tolerance:
+            total_bid = 0.0
+            for role in roles:
+                fresh, bids = role["fresh"], role["bids"]
+                if role["fresh_users"]:
+                    bids[fresh] = self._estimate(role, market_price, total_supply)
+                if role["stale_users"]:
+                    # Warm-start at the previous iteration after the first
+                    guesses = bids[role["stale"]] if local_price_rec else None
+                    bids[role["stale"]] = self._solve(
+                        role, market_price, total_supply, guesses
+                    )
+                role["bid_rows"].append(bids.copy())
+                total_bid += float(bids.sum())
+            # Stop on the price change that is actually applied
+            next_price = update_price(
+                market_price, total_supply - total_bid / market_price
+            )
+            delta_price = next_price - market_price
+            market_price = next_price
+            local_price_rec.append(market_price)
+
+        # The records of all iterations at once, one row per iteration
+        bid_prices = np.array([initial_price] + local_price_rec[:-1])[:, None]
+        local_welfare_rec = np.zeros(len(bid_prices) if welfare else 0)
+        for role in roles:
+            parameters, stale = role["parameters"], role["stale"]
+            bids = np.array(role["bid_rows"])
+            if role["is_buyer"]:
+                amounts = bids / bid_prices
+                payoffs = batched_payoff_as_buyer(
+                    parameters, bids, bid_prices, total_supply
+                )
+                local_demand_rec = amounts.sum(axis=1).tolist()
+            else:
+                amounts = parameters["assigned_blocks"] - bids / bid_prices
+                payoffs = batched_payoff_as_seller(
+                    parameters, bids, bid_prices, total_supply
+                )
+                local_supply_rec = amounts.sum(axis=1).tolist()
+            utilities = batched_utility(parameters, amounts)
+            for name, rows in [
+                ("bid_rec", bids),
+                ("payoff_rec", payoffs),
+                ("utility_rec", utilities),
+            ]:
+                group = SeriesGroup([getattr(user, name) for user in role["users"]])
+                group.extend(rows)
+                group.flush()
+            if welfare:
+                # The welfare without trade plus the utilities
+                local_welfare_rec += np.sum(
+                    parameters["willingness"] * np.sqrt(parameters["buffer"])
+                ) + np.sum(utilities, axis=1)
+
+            # The bids and trades of the last iteration
+            bids, amounts = bids[-1], amounts[-1]
+            for user, bid, amount in zip(
+                role["users"], bids.tolist(), amounts.tolist()
+            ):
+                user.bid = bid
+                user.trading_amount = amount
+
+            # Cache the solved users at the price of their last bids
+            if stale.any():
+                bid_price = float(bid_prices[-1, 0])
+                stale_parameters = role["stale_parameters"]
+                rows = np.empty((int(stale.sum()), 11))
+                rows[:, IS_BUYER] = role["is_buyer"]
+                rows[:, RATE_FACTOR] = stale_parameters["rate_factor"]
+                rows[:, BUFFER] = stale_parameters["buffer"]
+                rows[:, TOTAL_SUPPLY] = total_supply
+                rows[:, PRICE] = bid_price
+                rows[:, BID] = bids[stale]
+                rows[:, PRICE_SLOPE:] = self._slopes(
+                    role, stale_parameters, bids[stale], bid_price, total_supply
+                )
+                self.cache[role["ids"][stale]] = rows
+        return (
+            market_price,
+            local_price_rec,
+            local_demand_rec,
+            local_supply_rec,
+            local_welfare_rec.tolist(),
+        )
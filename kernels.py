@@ -0,0 +1,232 @@
+import math
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# The scalar formulas of user.Bidder, its payoffs and best responses as plain
+# functions of floats, compiled in nopython mode when Numba is installed and
+# run as they are otherwise. The payoffs and best responses replace the
+# methods with the numba backend, the formulas are their building blocks: on
+# their own, the call costs more than they do. Every kernel takes the user's
+# state as w = willingness_to_keep, a = rate_factor, m = max_buffer and
+# n = next_loss and evaluates the same operations in the same order as the
+# methods, so the compiled kernels give the same floats as the reference.
+
+# The tolerances and iteration limit of scipy.optimize.brentq's defaults
+BRENTQ_XTOL = 2e-12
+BRENTQ_RTOL = 4 * 2.220446049250313e-16
+BRENTQ_MAXITER = 100
+
+
+def _jit(function):
+    # Compiled on the first call and cached on disk for later runs
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+@_jit
+def utility(w, a, m, n, demand):
+    # Bidder.utility
+    return w * (math.sqrt(demand * a + m - n) - math.sqrt(0.0 * a + m - n))
+
+
+@_jit
+def absolute_utility(w, a, m, n, amount):
+    # Bidder.absolute_utility
+    return w * math.sqrt(amount * a + m - n)
+
+
+@_jit
+def expected_price(w, m, n, emp_buffer):
+    # Bidder.expected_price
+    return (0.5 / math.sqrt(emp_buffer + m - n)) * w
+
+
+@_jit
+def marginal_utility(w, a, m, n, demand):
+    # Bidder.marginal_utility
+    return 0.5 * w * a / math.sqrt(demand * a + m - n)
+
+
+@_jit
+def _area(a, m, n, x):
+    # The antiderivative F of Bidder.utility_area, without the willingness
+    s0 = math.sqrt(m - n)
+    s1 = math.sqrt(x * a + s0**2)
+    return a * x**2 * (2 * s1 + s0) / (3 * (s1 + s0) ** 2)
+
+
+@_jit
+def utility_area(w, a, m, n, lower, upper):
+    # Bidder.utility_area with the analytic engine
+    return w * (_area(a, m, n, upper) - _area(a, m, n, lower))
+
+
+@_jit
+def payoff_as_buyer(w, a, m, n, bid, price, total_supply):
+    # Bidder.payoff_as_buyer with the analytic engine
+    amount = bid / price
+    area = utility_area(w, a, m, n, 0.0, amount)
+    return (
+        (1 - (amount / total_supply)) * utility(w, a, m, n, amount)
+        + (area / total_supply)
+        - bid
+    )
+
+
+@_jit
+def payoff_as_seller(w, a, m, n, assigned_blocks, bid, price, total_supply):
+    # Bidder.payoff_as_seller with the analytic engine
+    amount = assigned_blocks - bid / price
+    area = utility_area(w, a, m, n, -amount, 0.0)
+    return (
+        assigned_blocks * price
+        - bid
+        + (1 + (amount / (total_supply - assigned_blocks)))
+        * utility(w, a, m, n, -amount)
+        + (area / (total_supply - assigned_blocks))
+    )
+
+
+@_jit
+def payoff_gradient_as_buyer(w, a, m, n, bid, price, total_supply):
+    # Bidder.payoff_gradient_as_buyer
+    amount = bid / price
+    return (
+        (1 - (amount / total_supply)) * marginal_utility(w, a, m, n, amount) - price
+    ) / price
+
+
+@_jit
+def payoff_gradient_as_seller(w, a, m, n, assigned_blocks, bid, price, total_supply):
+    # Bidder.payoff_gradient_as_seller
+    amount = assigned_blocks - bid / price
+    others = total_supply - assigned_blocks
+    return (
+        -(
+            price
+            + 2 * utility(w, a, m, n, -amount) / others
+            - (1 + (amount / others)) * marginal_utility(w, a, m, n, -amount)
+        )
+        / price
+    )
+
+
+@_jit
+def _gradient(seller, w, a, m, n, assigned_blocks, bid, price, total_supply):
+    if seller:
+        return payoff_gradient_as_seller(
+            w, a, m, n, assigned_blocks, bid, price, total_supply
+        )
+    return payoff_gradient_as_buyer(w, a, m, n, bid, price, total_supply)
+
+
+@_jit
+def _brentq(seller, w, a, m, n, assigned_blocks, price, total_supply, xa, xb):
+    # The root of the payoff gradient in [xa, xb], step by step the algorithm
+    # of scipy.optimize.brentq with its default tolerances, so both find the
+    # same root. The gradient changes sign in the bracket.
+    xpre, xcur = xa, xb
+    xblk, fblk, spre, scur = 0.0, 0.0, 0.0, 0.0
+    fpre = _gradient(seller, w, a, m, n, assigned_blocks, xpre, price, total_supply)
+    fcur = _gradient(seller, w, a, m, n, assigned_blocks, xcur, price, total_supply)
+    if fpre == 0:
+        return xpre
+    if fcur == 0:
+        return xcur
+    for _ in range(BRENTQ_MAXITER):
+        if fpre != 0 and fcur != 0 and (fpre < 0) != (fcur < 0):
+            xblk, fblk = xpre, fpre
+            spre = scur = xcur - xpre
+        if abs(fblk) < abs(fcur):
+            xpre, xcur, xblk = xcur, xblk, xcur
+            fpre, fcur, fblk = fcur, fblk, fcur
+        delta = (BRENTQ_XTOL + BRENTQ_RTOL * abs(xcur)) / 2
+        sbis = (xblk - xcur) / 2
+        if fcur == 0 or abs(sbis) < delta:
+            return xcur
+        if abs(spre) > delta and abs(fcur) < abs(fpre):
+            if xpre == xblk:
+                # Interpolate
+                stry = -fcur * (xcur - xpre) / (fcur - fpre)
+            else:
+                # Extrapolate
+                dpre = (fpre - fcur) / (xpre - xcur)
+                dblk = (fblk - fcur) / (xblk - xcur)
+                stry = (
+                    -fcur * (fblk * dblk - fpre * dpre) / (dblk * dpre * (fblk - fpre))
+                )
+            if 2 * abs(stry) < min(abs(spre), 3 * abs(sbis) - delta):
+                # Good short step
+                spre, scur = scur, stry
+            else:
+                spre = scur = sbis
+        else:
+            spre = scur = sbis
+        xpre, fpre = xcur, fcur
+        if abs(scur) > delta:
+            xcur += scur
+        else:
+            xcur += delta if sbis > 0 else -delta
+        fcur = _gradient(seller, w, a, m, n, assigned_blocks, xcur, price, total_supply)
+    return xcur
+
+
+@_jit
+def _best_bid(
+    seller, w, a, m, n, assigned_blocks, price, total_supply, upper_bound, guess
+):
+    # Bidder._solve_first_order_condition, a NaN guess for no guess
+    width = 1e-2
+    if _gradient(seller, w, a, m, n, assigned_blocks, 0.0, price, total_supply) <= 0:
+        return 0.0
+    if (
+        _gradient(seller, w, a, m, n, assigned_blocks, upper_bound, price, total_supply)
+        >= 0
+    ):
+        return upper_bound
+    if not math.isnan(guess):
+        lower = min(upper_bound, max(0.0, guess * (1 - width)))
+        upper = min(upper_bound, max(0.0, guess * (1 + width)))
+        if (
+            _gradient(seller, w, a, m, n, assigned_blocks, lower, price, total_supply)
+            > 0
+            and _gradient(
+                seller, w, a, m, n, assigned_blocks, upper, price, total_supply
+            )
+            < 0
+        ):
+            return _brentq(
+                seller, w, a, m, n, assigned_blocks, price, total_supply, lower, upper
+            )
+    return _brentq(
+        seller, w, a, m, n, assigned_blocks, price, total_supply, 0.0, upper_bound
+    )
+
+
+@_jit
+def best_bid_as_buyer(w, a, m, n, price, total_supply, guess):
+    # Bidder.find_optimal_bid_as_buyer with the analytic engine
+    return _best_bid(
+        False, w, a, m, n, 0.0, price, total_supply, total_supply * price, guess
+    )
+
+
+@_jit
+def best_bid_as_seller(w, a, m, n, assigned_blocks, price, total_supply, guess):
+    # Bidder.find_optimal_bid_as_seller with the analytic engine
+    return _best_bid(
+        True,
+        w,
+        a,
+        m,
+        n,
+        assigned_blocks,
+        price,
+        total_supply,
+        assigned_blocks * price,
+        guess,
+    )
@@ -0,0 +1,240 @@
+import numpy as np
+
+from channel import Channel
+from profiling import instrument
+from recorder import SeriesGroup
+from user import Bidder, User
+
+
+def _array_property(name: str) -> property:
+    # Attribute of a UserView backed by an array of its population
+    def get(self):
+        return getattr(self.population, name)[self.index].item()
+
+    def set(self, value):
+        getattr(self.population, name)[self.index] = value
+
+    return property(get, set)
+
+
+class UserView(Bidder):
+    """
+    A single user of a UserPopulation, with the state and the payoff model of
+    a User.
+
+    The state lives in the population's arrays, so the per-user methods of
+    Bidder (payoffs, bid solvers, utilities) work on it unchanged, while the
+    per-slot work, update() and record_current_state(), is done for all users
+    at once by the population.
+    """
+
+    x = _array_property("x")
+    y = _array_property("y")
+    rate_factor = _array_property("rate_factor")
+    emp_buffer = _array_property("emp_buffer")
+    max_buffer = _array_property("max_buffer")
+    willingness_to_keep = _array_property("willingness_to_keep")
+    assigned_blocks = _array_property("assigned_blocks")
+    trading_amount = _array_property("trading_amount")
+    last_loss = _array_property("last_loss")
+    last_waste = _array_property("last_waste")
+    is_buyer = _array_property("is_buyer")
+    loss_counter = _array_property("loss_counter")
+    waste_counter = _array_property("waste_counter")
+    loss_amount_counter = _array_property("loss_amount_counter")
+    waste_amount_counter = _array_property("waste_amount_counter")
+
+    def __init__(self, population, index: int, user: User):
+        self.population = population
+        self.index = index
+        self.id = user.id
+        self.type = user.type
+        self.demand = user.demand
+        # History of attributes
+        self.emp_buffer_rec = user.emp_buffer_rec
+        self.expected_price_rec = user.expected_price_rec
+        self.role_rec = user.role_rec
+        self.bid_rec = user.bid_rec
+        self.payoff_rec = user.payoff_rec
+        self.utility_rec = user.utility_rec
+
+    @property
+    def round(self) -> int:
+        return self.population.round
+
+    @property
+    def bid(self):
+        bid = self.population.bid[self.index]
+        return None if np.isnan(bid) else bid.item()
+
+    @bid.setter
+    def bid(self, value):
+        self.population.bid[self.index] = np.nan if value is None else value
+
+    def is_seller(self) -> bool:
+        return not self.is_buyer
+
+    def next_loss(self) -> float:
+        return self.population.loss_factor[self.index] * self.last_loss
+
+    def ocu_buffer(self) -> float:
+        return self.max_buffer - self.emp_buffer
+
+
+class UserPopulation:
+    """
+    The state of all users in contiguous arrays (structure of arrays).
+
+    update(), expected_price(), welfare() and record_current_state() do the
+    per-slot work of User for all users at once, and views holds one
+    UserView per user for the per-user code paths.
+    """
+
+    def __init__(self, users: list, channel: Channel = None):
+        """
+        Args:
+            users (list): The users to take the state from, all in the same
+                round.
+            channel (Channel): Moves the users and computes their rates, by
+                default as User.update does.
+        """
+        self.channel = channel or Channel()
+        self.round = users[0].round
+        self.x = np.array([user.x for user in users])
+        self.y = np.array([user.y for user in users])
+        self.rate_factor = np.array([user.rate_factor for user in users])
+        self.emp_buffer = np.array([user.emp_buffer for user in users], dtype=float)
+        self.max_buffer = np.array([user.max_buffer for user in users], dtype=float)
+        self.willingness_to_keep = np.array(
+            [user.willingness_to_keep for user in users]
+        )
+        self.assigned_blocks = np.array(
+            [user.assigned_blocks for user in users], dtype=float
+        )
+        self.trading_amount = np.array(
+            [user.trading_amount for user in users], dtype=float
+        )
+        self.last_loss = np.array([user.last_loss for user in users], dtype=float)
+        self.last_waste = np.zeros(len(users))
+        self.is_buyer = np.array([user.is_buyer for user in users])
+        self.loss_counter = np.array([user.loss_counter for user in users])
+        self.waste_counter = np.array([user.waste_counter for user in users])
+        self.loss_amount_counter = np.array(
+            [user.loss_amount_counter for user in users], dtype=float
+        )
+        self.waste_amount_counter = np.array(
+            [user.waste_amount_counter for user in users], dtype=float
+        )
+        self.bid = np.array(
+            [np.nan if user.bid is None else user.bid for user in users]
+        )
+        # next_loss is loss_factor * last_loss, 10 in FUTURE mode
+        self.loss_factor = np.array([user.loss_factor for user in users])
+        # Demand generated up front is stacked, lazy demand stays per user
+        if all(isinstance(user.demand, np.ndarray) for user in users) and (
+            len({len(user.demand) for user in users}) == 1
+        ):
+            self.demand = np.vstack([user.demand for user in users])
+        else:
+            self.demand = [user.demand for user in users]
+        self.views = [UserView(self, i, user) for i, user in enumerate(users)]
+
+    def __len__(self) -> int:
+        return len(self.views)
+
+    def __getitem__(self, index: int) -> UserView:
+        return self.views[index]
+
+    def next_loss(self) -> np.ndarray:
+        return self.loss_factor * self.last_loss
+
+    def parameters(self, index: np.ndarray) -> dict:
+        # tools.user_parameters of the users at index, from the arrays
+        return {
+            "willingness": self.willingness_to_keep[index],
+            "rate_factor": self.rate_factor[index],
+            "buffer": (self.max_buffer - self.next_loss())[index],
+            "assigned_blocks": self.assigned_blocks[index],
+        }
+
+    def round_series(self) -> dict:
+        """
+        Returns:
+            dict: A SeriesGroup over the users' bid_rec, payoff_rec and
+                utility_rec each, to record the price iterations of all users
+                at once.
+        """
+        return {
+            name: SeriesGroup([getattr(user, name) for user in self.views])
+            for name in ("bid_rec", "payoff_rec", "utility_rec")
+        }
+
+    @instrument()
+    def update(self) -> None:
+        # Vectorized User.update
+        self.x, self.y = self.channel.move(self.x, self.y)
+        self.rate_factor = self.channel.rate_factor(self.x, self.y)
+        data_rate = (self.assigned_blocks + self.trading_amount) * self.rate_factor
+
+        if isinstance(self.demand, np.ndarray):
+            demand = self.demand[:, self.round]
+        else:
+            demand = np.array([user_demand[self.round] for user_demand in self.demand])
+        arrival = demand - data_rate
+        self.round += 1
+        self.last_loss = np.maximum(0, arrival - self.emp_buffer)
+        self.last_waste = np.maximum(0, -arrival - (self.max_buffer - self.emp_buffer))
+        self.emp_buffer = np.maximum(
+            0, np.minimum(self.max_buffer, self.emp_buffer - arrival)
+        )
+
+    def expected_price(self) -> np.ndarray:
+        # Vectorized User.expected_price
+        return (
+            0.5 / np.sqrt(self.emp_buffer + self.max_buffer - self.next_loss())
+        ) * self.willingness_to_keep
+
+    def welfare(self, amounts: np.ndarray = None) -> float:
+        """
+        Vectorized social welfare, the sum of the users' absolute utilities.
+
+        Args:
+            amounts (np.ndarray): The traded amounts, none by default as in
+                tools.calculate_initial_welfare.
+
+        Returns:
+            float: The social welfare.
+        """
+        return float(np.sum(self.utilities(amounts)))
+
+    def utilities(self, amounts: np.ndarray = None) -> np.ndarray:
+        # The absolute utility of every user, whose sum is welfare()
+        if amounts is None:
+            amounts = np.zeros(len(self))
+        return self.willingness_to_keep * np.sqrt(
+            amounts * self.rate_factor + self.max_buffer - self.next_loss()
+        )
+
+    def record_current_state(self, histories: bool = True) -> None:
+        """
+        Vectorized User.record_current_state.
+
+        Args:
+            histories (bool): Whether to append to the users' history series,
+                which is a loop over the users.
+        """
+        loss, waste = self.last_loss > 0, self.last_waste > 0
+        self.loss_counter += loss
+        self.loss_amount_counter += np.where(loss, self.last_loss, 0.0)
+        self.waste_counter += waste
+        self.waste_amount_counter += np.where(waste, self.last_waste, 0.0)
+        if histories:
+            for user, emp_buffer, expected_price, is_buyer in zip(
+                self.views,
+                self.emp_buffer.tolist(),
+                self.expected_price().tolist(),
+                self.is_buyer.tolist(),
+            ):
+                user.emp_buffer_rec.append(emp_buffer)
+                user.expected_price_rec.append(expected_price)
+                user.role_rec.append(float(is_buyer))
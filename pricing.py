@@ -0,0 +1,203 @@
+import numpy as np
+
+# Lowest market price the broker accepts
+MIN_PRICE = 1e-2
+
+
+class GradientStep:
+    """
+    Fixed-step gradient update of the market price on the excess supply.
+
+    The excess supply total_supply - total_bid / price increases with the
+    price, so the price moves against it until supply and demand match.
+    """
+
+    def __init__(self, step_size: float):
+        """
+        Args:
+            step_size (float): The step applied to the excess supply.
+        """
+        self.step_size = step_size
+
+    def __call__(self, price: float, excess: float) -> float:
+        """
+        Calculates the next market price.
+
+        Args:
+            price (float): The current market price.
+            excess (float): The excess supply at the current market price.
+
+        Returns:
+            float: The next market price.
+        """
+        return max(MIN_PRICE, price - self.step_size * excess)
+
+
+class BarzilaiBorwein(GradientStep):
+    """
+    Gradient update whose step adapts to the observed slope of the excess
+    supply (Barzilai-Borwein step), kept within [step_size, max_step].
+    """
+
+    def __init__(self, step_size: float, max_step: float = None):
+        super().__init__(step_size)
+        self.max_step = max_step or 1e4 * step_size
+        self.step = step_size
+        self.last = None
+
+    def __call__(self, price: float, excess: float) -> float:
+        if self.last is not None:
+            delta_price, delta_excess = price - self.last[0], excess - self.last[1]
+            # Only a positive slope gives a usable step
+            if delta_price * delta_excess > 0:
+                self.step = min(
+                    self.max_step, max(self.step_size, delta_price / delta_excess)
+                )
+        self.last = (price, excess)
+        return max(MIN_PRICE, price - self.step * excess)
+
+
+class BracketedSecant(GradientStep):
+    """
+    Secant root-finding on the excess supply, safeguarded by bisection once
+    the clearing price is bracketed. Gradient steps are taken until there are
+    two points with different excess supply.
+    """
+
+    def __init__(self, step_size: float):
+        super().__init__(step_size)
+        self.last = None
+        # Highest price with excess demand, lowest price with excess supply
+        self.lower, self.upper = None, None
+
+    def __call__(self, price: float, excess: float) -> float:
+        if excess < 0 and (self.lower is None or price > self.lower):
+            self.lower = price
+        if excess > 0 and (self.upper is None or price < self.upper):
+            self.upper = price
+
+        if self.last is None or excess == self.last[1]:
+            next_price = price - self.step_size * excess
+        else:
+            next_price = price - excess * (price - self.last[0]) / (
+                excess - self.last[1]
+            )
+        if self.lower is not None and self.upper is not None:
+            if not self.lower < next_price < self.upper:
+                next_price = 0.5 * (self.lower + self.upper)
+        self.last = (price, excess)
+        return max(MIN_PRICE, next_price)
+
+
+class Anderson(GradientStep):
+    """
+    Anderson acceleration of the fixed-point map of the gradient update,
+    mixing the last `depth` iterates.
+    """
+
+    def __init__(self, step_size: float, depth: int = 3):
+        super().__init__(step_size)
+        self.depth = depth
+        self.prices, self.residuals = [], []
+
+    def __call__(self, price: float, excess: float) -> float:
+        residual = -self.step_size * excess
+        self.prices.append(price)
+        self.residuals.append(residual)
+        self.prices = self.prices[-(self.depth + 1) :]
+        self.residuals = self.residuals[-(self.depth + 1) :]
+
+        next_price = price + residual
+        if len(self.prices) > 1:
+            delta_prices = np.diff(self.prices)
+            delta_residuals = np.diff(self.residuals)
+            if np.any(delta_residuals != 0):
+                (gamma, _, _, _) = np.linalg.lstsq(
+                    delta_residuals[np.newaxis, :], [residual], rcond=None
+                )
+                next_price -= float((delta_prices + delta_residuals) @ gamma)
+        return max(MIN_PRICE, next_price)
+
+
+PRICE_UPDATES = {
+    "gradient": GradientStep,
+    "bb": BarzilaiBorwein,
+    "secant": BracketedSecant,
+    "anderson": Anderson,
+}
+
+
+def make_price_update(name: str, step_size: float) -> GradientStep:
+    """
+    Creates a price update strategy for one slot.
+
+    Args:
+        name (str): One of the keys of PRICE_UPDATES.
+        step_size (float): The step of the gradient update.
+
+    Returns:
+        GradientStep: The strategy, called as strategy(price, excess).
+
+    Raises:
+        ValueError: If the strategy is unknown.
+    """
+    if name not in PRICE_UPDATES:
+        raise ValueError(f"Unknown price update: {name}")
+    return PRICE_UPDATES[name](step_size)
+
+
+class WarmStart:
+    """
+    Chooses the initial market price of each slot.
+
+    "cold" always starts from the same price, "previous" starts from the
+    clearing price of the previous slot and "predict" fits a least-squares
+    model of the clearing price on the market features of recent slots.
+    """
+
+    MODES = ("cold", "previous", "predict")
+
+    def __init__(self, mode: str, cold_price: float = 1.095, window: int = 20):
+        """
+        Args:
+            mode (str): One of WarmStart.MODES.
+            cold_price (float): The price used without history.
+            window (int): The number of recent slots the predictor is fit on.
+
+        Raises:
+            ValueError: If the mode is unknown.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown warm start: {mode}")
+        self.mode = mode
+        self.cold_price = cold_price
+        self.window = window
+        self.features_rec = []
+        self.price_rec = []
+
+    def initial_price(self, features: list) -> float:
+        """
+        Args:
+            features (list): Aggregate market state of the slot, e.g. the
+                average expected price and the average empty buffer.
+
+        Returns:
+            float: The initial market price of the slot.
+        """
+        if self.mode == "cold" or not self.price_rec:
+            return self.cold_price
+        if self.mode == "previous" or len(self.price_rec) <= len(features) + 1:
+            return self.price_rec[-1]
+        # Least squares on [1, features] over the recent slots
+        X = np.column_stack(
+            [np.ones(len(self.features_rec)), np.array(self.features_rec)]
+        )
+        (coefficients, _, _, _) = np.linalg.lstsq(X, self.price_rec, rcond=None)
+        return max(MIN_PRICE, float(np.dot([1.0] + list(features), coefficients)))
+
+    def record(self, features: list, clearing_price: float) -> None:
+        """
+        Records the features and the clearing price of a cleared slot.
+        """
+        self.features_rec = (self.features_rec + [list(features)])[-self.window :]
+        self.price_rec = (self.price_rec + [clearing_price])[-self.window :]
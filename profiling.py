@@ -0,0 +1,211 @@
+import contextlib
+import csv
+import functools
+import time
+from collections import defaultdict
+
+# Instrumentation is off by default, instrumented functions then only pay for
+# one check of this flag per call
+ENABLED = False
+# Name -> number of calls or events, and seconds spent, since the last reset
+calls = defaultdict(int)
+seconds = defaultdict(float)
+
+# Profilers run() can wrap a whole run in
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+def enable(enabled: bool = True) -> bool:
+    # Switches the instrumentation on or off at runtime, returning the
+    # previous state to restore
+    global ENABLED
+    previous, ENABLED = ENABLED, enabled
+    return previous
+
+
+def reset() -> None:
+    calls.clear()
+    seconds.clear()
+
+
+def snapshot() -> tuple:
+    # Copies of the counters and timers, see added_since
+    return dict(calls), dict(seconds)
+
+
+def added_since(previous: tuple) -> tuple:
+    # The counters and timers added since the snapshot
+    previous_calls, previous_seconds = previous
+    return (
+        {
+            name: value - previous_calls.get(name, 0)
+            for name, value in calls.items()
+            if value != previous_calls.get(name, 0)
+        },
+        {
+            name: value - previous_seconds.get(name, 0.0)
+            for name, value in seconds.items()
+            if value != previous_seconds.get(name, 0.0)
+        },
+    )
+
+
+def merge(added: tuple) -> None:
+    # Adds counters and timers collected elsewhere, e.g. by added_since in a
+    # worker process
+    added_calls, added_seconds = added
+    for name, value in added_calls.items():
+        calls[name] += value
+    for name, value in added_seconds.items():
+        seconds[name] += value
+
+
+def instrument(name: str = None):
+    """
+    Counts the calls of a function and the time spent in it while the
+    instrumentation is enabled. Times are inclusive of nested instrumented
+    calls.
+
+    Args:
+        name (str): The name the function is reported under, its qualified
+            name by default.
+    """
+
+    def decorator(function):
+        key = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds[key] += time.perf_counter() - start
+                calls[key] += 1
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, events: int = 1) -> None:
+    # Counts events without timing them, e.g. solver evaluations
+    if ENABLED:
+        calls[name] += events
+
+
+class MetricsTable:
+    """
+    Per-slot table of the instrumentation counters and timers.
+
+    Every row holds the slot, its wall time and, for every name, the calls
+    and, for timed functions, the seconds added during the slot.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.names = []
+        self._start = None
+        self._calls = {}
+        self._seconds = {}
+
+    def start(self) -> None:
+        # Marks the beginning of a slot
+        self._calls = dict(calls)
+        self._seconds = dict(seconds)
+        self._start = time.perf_counter()
+
+    def record(self, slot: int) -> dict:
+        """
+        Adds the row of the slot started last.
+
+        Args:
+            slot (int): The index of the slot.
+
+        Returns:
+            dict: The row.
+        """
+        row = {"slot": slot, "seconds": time.perf_counter() - self._start}
+        for name in sorted(calls):
+            if name not in self.names:
+                self.names.append(name)
+        for name in self.names:
+            row[name + "_calls"] = calls.get(name, 0) - self._calls.get(name, 0)
+            if name in seconds:
+                row[name + "_seconds"] = seconds[name] - self._seconds.get(name, 0.0)
+        self.rows.append(row)
+        return row
+
+    def totals(self) -> dict:
+        # Name -> (calls, seconds) over all recorded slots
+        return {
+            name: (
+                sum(row.get(name + "_calls", 0) for row in self.rows),
+                sum(row.get(name + "_seconds", 0.0) for row in self.rows),
+            )
+            for name in self.names
+        }
+
+    def to_csv(self, path: str) -> None:
+        # Writes the table with one column per counter and timer
+        columns = ["slot", "seconds"]
+        for name in self.names:
+            columns.append(name + "_calls")
+            if name in seconds:
+                columns.append(name + "_seconds")
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns, restval=0)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def print_totals(self) -> None:
+        # Prints the totals, the most expensive first
+        total = sum(row["seconds"] for row in self.rows)
+        print("Instrumented time over %d slots (%.3f s):" % (len(self.rows), total))
+        for name, (name_calls, name_seconds) in sorted(
+            self.totals().items(), key=lambda item: -item[1][1]
+        ):
+            if name_seconds:
+                print("  %-40s %10d calls %10.3f s" % (name, name_calls, name_seconds))
+            else:
+                print("  %-40s %10d" % (name, name_calls))
+
+
+@contextlib.contextmanager
+def profile(profiler: str, path: str):
+    """
+    Profiles the enclosed code and writes the result to a file.
+
+    Args:
+        profiler (str): "cprofile" writes a pstats dump, "pyinstrument" an
+            HTML report and needs the pyinstrument package.
+        path (str): The file to write.
+
+    Raises:
+        ValueError: If the profiler is unknown.
+    """
+    if profiler == "cprofile":
+        import cProfile
+
+        session = cProfile.Profile()
+        session.enable()
+        try:
+            yield
+        finally:
+            session.disable()
+            session.dump_stats(path)
+    elif profiler == "pyinstrument":
+        from pyinstrument import Profiler
+
+        session = Profiler()
+        session.start()
+        try:
+            yield
+        finally:
+            session.stop()
+            with open(path, "w") as f:
+                f.write(session.output_html())
+    else:
+        raise ValueError(f"Unknown profiler: {profiler}")
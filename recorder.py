@@ -0,0 +1,306 @@
+import os
+from array import array
+
+import numpy as np
+
+# Recording levels, each one keeps everything the previous one keeps
+# "none" only keeps running aggregates (count, total, min, max) of every series,
+# "summary" also keeps the per-slot series and "trace" the per-iteration ones
+LEVELS = ("none", "summary", "trace")
+
+
+class Series:
+    """
+    Append-only series of floats.
+
+    Running aggregates are always kept. The values themselves are kept only if
+    the series is stored, in a compact array('d') buffer which is appended to
+    a raw float64 file every chunk_size values if the series has a path, so
+    the memory used does not grow with the length of the series.
+    """
+
+    def __init__(self, path: str = None, store: bool = True, chunk_size: int = 1024):
+        """
+        Args:
+            path (str): The file the values are streamed to, or None to keep
+                them in memory.
+            store (bool): Whether to keep the values or only the aggregates.
+            chunk_size (int): The number of values buffered before a write.
+        """
+        self.path = path
+        self.store = store
+        self.chunk_size = chunk_size
+        self.buffer = array("d")
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float("inf")
+        self.maximum = float("-inf")
+        if path is not None and store:
+            # Start from an empty file
+            open(path, "wb").close()
+
+    def append(self, value: float) -> None:
+        value = float(value)
+        self.count += 1
+        self.total += value
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        if self.store:
+            self.buffer.append(value)
+            if self.path is not None and len(self.buffer) >= self.chunk_size:
+                self.flush()
+
+    def extend(self, values) -> None:
+        for value in values:
+            self.append(value)
+
+    def merge(self, count, total, minimum, maximum, values=None) -> None:
+        """
+        Takes over the running aggregates a SeriesGroup kept for the series,
+        and the values appended meanwhile if the series is stored.
+        """
+        self.count, self.total = int(count), float(total)
+        self.minimum, self.maximum = float(minimum), float(maximum)
+        if self.store and values is not None and len(values):
+            self.buffer.extend(values.tolist())
+            if self.path is not None and len(self.buffer) >= self.chunk_size:
+                self.flush()
+
+    def flush(self) -> None:
+        # Write the buffered values to the file
+        if self.path is not None and self.buffer:
+            with open(self.path, "ab") as f:
+                self.buffer.tofile(f)
+            del self.buffer[:]
+
+    def __getstate__(self) -> dict:
+        # The values written so far, so that restore() can go back to them
+        state = self.__dict__.copy()
+        state["written"] = 0
+        if self.path is not None and os.path.exists(self.path):
+            state["written"] = os.path.getsize(self.path) // 8
+        return state
+
+    def restore(self, path: str = None) -> None:
+        """
+        Takes the file of an unpickled series back to the values written when
+        it was pickled, dropping those written since.
+
+        Args:
+            path (str): Where the series is streamed to from now on, with a
+                copy of those values. By default the series keeps its file.
+
+        Raises:
+            ValueError: If the file holds fewer values than were written.
+        """
+        written = self.__dict__.pop("written", 0)
+        if self.path is None:
+            return
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < 8 * written:
+            raise ValueError(f"{self.path} is shorter than at the checkpoint")
+        if path is not None and path != self.path:
+            with open(self.path, "rb") as source, open(path, "wb") as target:
+                target.write(source.read(8 * written))
+            self.path = path
+        else:
+            with open(self.path, "r+b") as f:
+                f.truncate(8 * written)
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def values(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: All values of the series, read back from the file.
+
+        Raises:
+            ValueError: If the series is not stored at the recording level.
+        """
+        if not self.store:
+            raise ValueError("The series is not stored at this recording level")
+        buffered = np.frombuffer(self.buffer, dtype=np.float64)
+        if self.path is None:
+            return buffered.copy()
+        return np.concatenate([np.fromfile(self.path, dtype=np.float64), buffered])
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def __getitem__(self, index):
+        return self.values()[index]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values() if dtype is None else self.values().astype(dtype)
+
+
+class SeriesGroup:
+    """
+    Appends to many series at once, at most one value per series and call.
+
+    The running aggregates of the series are kept in arrays, updated in
+    single NumPy operations, and handed back with the values by flush(), so
+    appending does not loop over the series in Python. The series must not
+    be appended to directly until the group is flushed.
+    """
+
+    def __init__(self, series: list):
+        """
+        Args:
+            series (list): The series, in the order of the appended values.
+        """
+        self.series = series
+        self.count = np.array([s.count for s in series])
+        self.total = np.array([s.total for s in series], dtype=float)
+        self.minimum = np.array([s.minimum for s in series], dtype=float)
+        self.maximum = np.array([s.maximum for s in series], dtype=float)
+        self.store = any(s.store for s in series)
+        # (index, values) of every append, kept if any series is stored
+        self.rows = []
+
+    def append(self, values: np.ndarray, index: np.ndarray = None) -> None:
+        """
+        Appends values[i] to the series index[i].
+
+        Args:
+            values (np.ndarray): The values.
+            index (np.ndarray): The positions of the series, without
+                duplicates, all series by default.
+        """
+        values = np.asarray(values, dtype=float)
+        if index is None:
+            index = slice(None)
+        self.count[index] += 1
+        self.total[index] += values
+        self.minimum[index] = np.minimum(self.minimum[index], values)
+        self.maximum[index] = np.maximum(self.maximum[index], values)
+        if self.store:
+            self.rows.append((index, values))
+
+    def extend(self, rows: np.ndarray, index: np.ndarray = None) -> None:
+        """
+        Appends the rows of a 2D array in order, as many calls of append.
+
+        Args:
+            rows (np.ndarray): One row of values per append.
+            index (np.ndarray): See append.
+        """
+        rows = np.asarray(rows, dtype=float)
+        if len(rows) == 0:
+            return
+        if index is None:
+            index = slice(None)
+        self.count[index] += len(rows)
+        # Accumulate, unlike a reduction, adds the rows one after the other
+        self.total[index] = np.add.accumulate(
+            np.vstack([self.total[index], rows]), axis=0
+        )[-1]
+        self.minimum[index] = np.minimum(self.minimum[index], rows.min(axis=0))
+        self.maximum[index] = np.maximum(self.maximum[index], rows.max(axis=0))
+        if self.store:
+            self.rows.extend((index, row) for row in rows)
+
+    def flush(self) -> None:
+        # Hands the aggregates and values over to the series
+        values = [None] * len(self.series)
+        if self.rows:
+            positions = np.arange(len(self.series))
+            index = np.concatenate([positions[index] for index, _ in self.rows])
+            order = np.argsort(index, kind="stable")
+            bounds = np.searchsorted(index[order], positions[1:])
+            values = np.split(
+                np.concatenate([row for _, row in self.rows])[order], bounds
+            )
+            self.rows = []
+        for series, count, total, minimum, maximum, series_values in zip(
+            self.series,
+            self.count.tolist(),
+            self.total.tolist(),
+            self.minimum.tolist(),
+            self.maximum.tolist(),
+            values,
+        ):
+            series.merge(count, total, minimum, maximum, series_values)
+
+
+class Recorder:
+    """
+    Creates the series of a simulation at a recording level, optionally
+    streaming them to raw float64 files in a directory.
+    """
+
+    def __init__(self, level: str = "trace", directory: str = None, chunk_size=1024):
+        """
+        Args:
+            level (str): One of LEVELS.
+            directory (str): Where the stored series are streamed to, or None
+                to keep them in memory.
+            chunk_size (int): The number of values buffered per series.
+
+        Raises:
+            ValueError: If the level is unknown.
+        """
+        if level not in LEVELS:
+            raise ValueError(f"Unknown recording level: {level}")
+        self.level = level
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.series_by_name = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def records(self, level: str) -> bool:
+        # Whether series of the given level are stored
+        return LEVELS.index(self.level) >= LEVELS.index(level)
+
+    def series(self, name: str, level: str) -> Series:
+        """
+        Creates a series, stored if the recorder's level includes its level.
+
+        Args:
+            name (str): The name of the series, also its file name.
+            level (str): "summary" for per-slot series, "trace" for
+                per-iteration series.
+
+        Returns:
+            Series: The new series.
+        """
+        store = self.records(level)
+        path = None
+        if store and self.directory is not None:
+            path = os.path.join(self.directory, name + ".f64")
+        series = Series(path, store, self.chunk_size)
+        self.series_by_name[name] = series
+        return series
+
+    def flush(self) -> None:
+        for series in self.series_by_name.values():
+            series.flush()
+
+    def restore(self, directory: str = None) -> None:
+        """
+        Takes the files of an unpickled recorder back to the values written
+        when it was pickled, see Series.restore.
+
+        Args:
+            directory (str): Where the series are streamed to from now on,
+                with a copy of those values. By default the recorder keeps
+                its directory.
+        """
+        if directory is not None and self.directory is not None:
+            if os.path.abspath(directory) == os.path.abspath(self.directory):
+                directory = None
+            else:
+                os.makedirs(directory, exist_ok=True)
+                self.directory = directory
+        for name, series in self.series_by_name.items():
+            path = None
+            if directory is not None and series.path is not None:
+                path = os.path.join(directory, name + ".f64")
+            series.restore(path)
@@ -0,0 +1,344 @@
+import numpy as np
+from scipy import stats
+
+from cells import MultiMarketSimulation
+from profiling import instrument
+from tools import random_roles
+
+# The per-replica results aggregated over the replicas
+METRICS = (
+    "loss_counter",
+    "loss_amount",
+    "waste_counter",
+    "waste_amount",
+    "total_welfare",
+    "min_welfare",
+)
+
+
+class RunningStatistics:
+    """
+    The mean and variance of a few metrics over a stream of samples.
+
+    Batches of samples are merged with the parallel form of Welford's
+    algorithm, so the statistics of any number of replicas are kept in
+    constant memory and are available after every batch.
+    """
+
+    def __init__(self, names: tuple = METRICS):
+        """
+        Args:
+            names (tuple): The names of the metrics, one column per sample.
+        """
+        self.names = names
+        self.count = 0
+        self.mean = np.zeros(len(names))
+        # The sum of the squared deviations from the mean
+        self.m2 = np.zeros(len(names))
+
+    def update(self, samples: np.ndarray) -> None:
+        """
+        Args:
+            samples (np.ndarray): One row per sample, one column per metric.
+        """
+        samples = np.asarray(samples, dtype=float).reshape(-1, len(self.names))
+        if len(samples) == 0:
+            return
+        count = self.count + len(samples)
+        mean = samples.mean(axis=0)
+        delta = mean - self.mean
+        self.m2 += ((samples - mean) ** 2).sum(axis=0) + (
+            delta**2 * self.count * len(samples) / count
+        )
+        self.mean += delta * len(samples) / count
+        self.count = count
+
+    def std(self) -> np.ndarray:
+        # The sample standard deviations, NaN below two samples
+        if self.count < 2:
+            return np.full(len(self.names), np.nan)
+        return np.sqrt(self.m2 / (self.count - 1))
+
+    def interval(self, confidence: float = 0.95) -> np.ndarray:
+        # The half widths of the Student t confidence intervals of the means
+        if self.count < 2:
+            return np.full(len(self.names), np.nan)
+        quantile = stats.t.ppf(0.5 + confidence / 2, self.count - 1)
+        return quantile * self.std() / np.sqrt(self.count)
+
+    def summary(self, confidence: float = 0.95) -> dict:
+        """
+        Returns:
+            dict: The "mean", "std" and confidence interval half width "ci"
+                of every metric, by name.
+        """
+        return {
+            name: {"mean": mean, "std": std, "ci": ci}
+            for name, mean, std, ci in zip(
+                self.names,
+                self.mean.tolist(),
+                self.std().tolist(),
+                self.interval(confidence).tolist(),
+            )
+        }
+
+
+class ReplicaSimulation(MultiMarketSimulation):
+    """
+    Independent replicas of the market, one per seed, advanced together.
+
+    The users of all replicas are stacked in one UserPopulation, replica
+    after replica, so the demand, the moves, the buffer updates and the roles
+    of all replicas are computed in single array passes, and the replicas'
+    markets are cleared together by tools.clearing_prices as the cells of
+    MultiCellSimulation are. Every replica draws from the streams of its own
+    seed in the order a Simulation with population and batched does, so it
+    follows that run, up to rounding. The loss, waste and welfare of every
+    replica are accumulated slot by slot, and summary() aggregates them.
+    """
+
+    market_name = "replica"
+
+    def __init__(
+        self,
+        seeds: list,
+        jobs: int = 1,
+        boundary: str = "clamp",
+        rate_table: int = 0,
+        batched: bool = True,
+        **kwargs,
+    ):
+        """
+        Args:
+            seeds (list): The seed of every replica.
+            jobs (int): The number of worker processes clearing the markets.
+            boundary (str): See channel.BOUNDARIES.
+            rate_table (int): See channel.Channel.
+            batched (bool): The replicas are always cleared with batched best
+                responses.
+            **kwargs: The options of Simulation except seed and those
+                MultiMarketSimulation does not support.
+
+        Raises:
+            ValueError: If there is no seed or an unsupported option is given.
+        """
+        if not seeds:
+            raise ValueError("At least one replica is needed")
+        if "seed" in kwargs:
+            raise ValueError("The replicas take their seeds from seeds")
+        self.seeds = list(seeds)
+        # The users of every seed, see _create_users, in a single grid-less
+        # market each
+        super().__init__(
+            len(self.seeds),
+            jobs,
+            batched,
+            seed=self.seeds[0],
+            boundary=boundary,
+            rate_table=rate_table,
+            **kwargs,
+        )
+        del self.config["seed"]
+        self.config["seeds"] = self.seeds
+        self.replica_size = len(self.population) // len(self.seeds)
+        # The users of every replica, as indices into the population
+        self.replica_users = np.split(np.arange(len(self.population)), len(self.seeds))
+        # The welfare of every replica, accumulated as the slots run
+        self.total_welfare = np.zeros(len(self.seeds))
+        self.min_welfare = np.full(len(self.seeds), np.inf)
+
+    def _create_users(
+        self,
+        seed: int,
+        hb_users: int,
+        lr_users: int,
+        generations: int,
+        demand_rng: str,
+        lazy_demand: bool,
+    ) -> list:
+        # The users of every replica from its own seed, ids numbered on
+        users, self.replica_role_rngs, mobility_rngs = [], [], []
+        for replica_seed in self.seeds:
+            replica_users = super()._create_users(
+                replica_seed, hb_users, lr_users, generations, demand_rng, lazy_demand
+            )
+            for user in replica_users:
+                user.id += len(users)
+            users += replica_users
+            self.replica_role_rngs.append(self.role_rng)
+            mobility_rngs.append(self.mobility_rng)
+        # The population's channel moves every replica from its own stream
+        self.mobility_rng = mobility_rngs
+        return users
+
+    def per_replica(self, values: np.ndarray) -> np.ndarray:
+        # The sums of per-user values over the users of every replica
+        return np.asarray(values).reshape(len(self.seeds), self.replica_size).sum(1)
+
+    @instrument()
+    def step(self) -> dict:
+        """
+        Simulates one time slot in every replica.
+
+        Returns:
+            dict: As Simulation.step(), with the mean clearing price of the
+                replicas that traded, their total number of iterations and
+                the mean welfare, plus the clearing price of every replica
+                (0 without trade).
+        """
+        population = self.population
+        replicas, size = len(self.seeds), self.replica_size
+        population.update()
+        expected_prices = population.expected_price()
+
+        # Every replica assigns the roles by its own average expected price
+        mean_prices = self.per_replica(expected_prices) / size
+        if self.mode == "RANDOM":
+            population.is_buyer = np.concatenate(
+                [random_roles(size, rng) for rng in self.replica_role_rngs]
+            )
+        else:
+            population.is_buyer = expected_prices > np.repeat(mean_prices, size)
+        welfare = self.per_replica(population.utilities())
+        self.welfare_rec.append(float(welfare.mean()))
+
+        replica_prices = np.zeros(replicas)
+        iterations = 0
+        if self.mode != "STATIC":
+            replica_prices, market_clearing_price, iterations = self._trade(
+                self.replica_users,
+                mean_prices,
+                self.per_replica(population.emp_buffer) / size,
+            )
+            welfare = self.per_replica(population.utilities(population.trading_amount))
+        else:
+            market_clearing_price = 0.0
+
+        self.total_welfare += welfare
+        self.min_welfare = np.minimum(self.min_welfare, welfare)
+        self.market_clearing_welfare.append(float(welfare.mean()))
+        # The users' histories are only kept when they are recorded
+        population.record_current_state(self.recorder.records("summary"))
+
+        self.slot += 1
+        result = {
+            "slot": self.slot,
+            "clearing_price": market_clearing_price,
+            "iterations": iterations,
+            "buyers": int(population.is_buyer.sum()),
+            "sellers": int((~population.is_buyer).sum()),
+            "welfare": float(welfare.mean()),
+            "replica_prices": replica_prices.tolist(),
+        }
+        if self.trace is not None:
+            self.trace.write(result, self.users)
+        return result
+
+    def results(self) -> np.ndarray:
+        # The METRICS of every replica so far, one row per replica
+        population = self.population
+        return np.column_stack(
+            [
+                self.per_replica(population.loss_counter),
+                self.per_replica(population.loss_amount_counter),
+                self.per_replica(population.waste_counter),
+                self.per_replica(population.waste_amount_counter),
+                self.total_welfare,
+                self.min_welfare if self.slot else np.zeros(len(self.seeds)),
+            ]
+        )
+
+    def summary(self, confidence: float = 0.95) -> dict:
+        """
+        Args:
+            confidence (float): The level of the confidence intervals.
+
+        Returns:
+            dict: The number of slots, replicas and price iterations, the
+                statistics of the METRICS over the replicas, see
+                RunningStatistics.summary, and the METRICS and seed of every
+                replica in "results".
+        """
+        results = self.results()
+        statistics = RunningStatistics()
+        statistics.update(results)
+        return {
+            "slots": self.slot,
+            "replicas": len(self.seeds),
+            "iterations": int(self.iteration_rec.total),
+            "statistics": statistics.summary(confidence),
+            "results": [
+                {"seed": seed, **dict(zip(METRICS, row))}
+                for seed, row in zip(self.seeds, results.tolist())
+            ],
+        }
+
+
+def run_replicas(
+    seeds: list,
+    batch_size: int = None,
+    confidence: float = 0.95,
+    progress: bool = False,
+    **options,
+) -> dict:
+    """
+    Runs a replica per seed, batch_size replicas at a time, and aggregates
+    their results as the batches finish, so the memory does not grow with
+    the number of seeds.
+
+    Args:
+        seeds (list): The seed of every replica.
+        batch_size (int): The replicas advanced together, all by default.
+        confidence (float): The level of the confidence intervals.
+        progress (bool): Whether to show a progress bar per batch.
+        **options: The options of ReplicaSimulation.
+
+    Returns:
+        dict: As ReplicaSimulation.summary, over all replicas.
+
+    Raises:
+        ValueError: If the batches would write to the same files.
+    """
+    if options.get("record_dir") or options.get("trace_dir"):
+        raise ValueError("The batches of replicas cannot share record files")
+    seeds = list(seeds)
+    batch_size = batch_size or len(seeds)
+    statistics = RunningStatistics()
+    results, iterations, slots = [], 0, 0
+    for first in range(0, len(seeds), batch_size):
+        simulation = ReplicaSimulation(seeds[first : first + batch_size], **options)
+        try:
+            summary = simulation.run(progress=progress)
+        finally:
+            simulation.close()
+        statistics.update(
+            [[result[name] for name in METRICS] for result in summary["results"]]
+        )
+        results += summary["results"]
+        iterations += summary["iterations"]
+        slots = summary["slots"]
+    return {
+        "slots": slots,
+        "replicas": len(seeds),
+        "iterations": iterations,
+        "statistics": statistics.summary(confidence),
+        "results": results,
+    }
+
+
+def print_statistics(summary: dict, confidence: float = 0.95) -> None:
+    # Prints the mean and confidence interval of the results print_summary shows
+    print(
+        f"Mean over {summary['replicas']} replicas "
+        f"(± {100 * confidence:g}% confidence interval):"
+    )
+    for name, label in [
+        ("loss_counter", "Loss counter"),
+        ("loss_amount", "Loss amount"),
+        ("waste_counter", "Waste counter"),
+        ("waste_amount", "Waste amount"),
+        ("total_welfare", "Total social welfare"),
+        ("min_welfare", "Min_welfare"),
+    ]:
+        metric = summary["statistics"][name]
+        print(f"{label}: {metric['mean']:.6g} ± {metric['ci']:.3g}")
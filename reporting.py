@@ -0,0 +1,100 @@
+import matplotlib.pyplot as plt
+
+from profiling import instrument
+
+SMALL_SIZE = 10
+MEDIUM_SIZE = 14
+BIG_SIZE = 15
+plt.rc("font", size=BIG_SIZE)  # controls default text sizes
+plt.rc("axes", titlesize=BIG_SIZE)  # fontsize of the axes title
+plt.rc("axes", labelsize=BIG_SIZE)  # fontsize of the x and y labels
+plt.rc("xtick", labelsize=BIG_SIZE)  # fontsize of the tick labels
+plt.rc("ytick", labelsize=BIG_SIZE)  # fontsize of the tick labels
+plt.rc("legend", fontsize=BIG_SIZE)  # legend fontsize
+plt.rc("figure", titlesize=BIG_SIZE)  # fontsize of the figure title
+
+
+@instrument()
+def plot_trends(users, output_dir: str) -> None:
+    """
+    Plots the buffer and willingness trends of the users over the slots.
+    """
+    plt.plot([], linestyle="--", label="LR users", linewidth=2, color="black")
+    plt.plot([], linestyle="-", label="HB users", linewidth=2, color="black")
+    for user in users:
+        if user.type == "LR":
+            plt.plot(user.emp_buffer_rec, linestyle="--", linewidth=2)
+        else:
+            plt.plot(user.emp_buffer_rec, linestyle="-", linewidth=2)
+    plt.xlabel("Number of Time Slots", fontsize=BIG_SIZE)
+    plt.ylabel("Bits", fontsize=BIG_SIZE)
+    plt.legend(loc="best", fontsize=MEDIUM_SIZE)
+    plt.savefig(
+        output_dir + "/" + "Empty Buffer Trend" + ".png",
+        dpi=300,
+        bbox_inches="tight",
+    )
+    plt.clf()
+
+    plt.plot([], linestyle="--", label="LR users", linewidth=2, color="black")
+    plt.plot([], linestyle="-", label="HB users", linewidth=2, color="black")
+    for user in users:
+        if user.type == "LR":
+            plt.plot(user.expected_price_rec, linestyle="--", linewidth=2)
+        else:
+            plt.plot(user.expected_price_rec, linestyle="-", linewidth=2)
+    plt.gca().ticklabel_format(
+        axis="y", style="sci", scilimits=(0, 0), useMathText=True
+    )
+    plt.xlabel("Number of Time Slots", fontsize=BIG_SIZE)
+    plt.ylabel("Willingness to Buy", fontsize=BIG_SIZE)
+    plt.legend(loc="best", fontsize=MEDIUM_SIZE)
+    plt.savefig(
+        output_dir + "/" + "Willingness Trend" + ".png",
+        dpi=300,
+        bbox_inches="tight",
+    )
+    plt.clf()
+
+
+@instrument()
+def plot_convergence(
+    price_rec, demand_rec, supply_rec, welfare_rec, output_dir: str
+) -> None:
+    """
+    Plots the price, resource, and social welfare convergence over the price
+    iterations.
+    """
+    plt.plot(price_rec, label="Market Price", linewidth=2.5)
+    plt.xlabel("Number of Iterations", fontsize=MEDIUM_SIZE)
+    plt.ylabel("Unit Price", fontsize=MEDIUM_SIZE)
+    plt.legend(loc="best", fontsize=BIG_SIZE)
+    plt.savefig(
+        output_dir + "/" + "Price Trend" + ".png",
+        dpi=300,
+        bbox_inches="tight",
+    )
+    plt.clf()
+
+    plt.plot(demand_rec[1:], linestyle="-", label="Resource Requesting", linewidth=1.5)
+    plt.plot(supply_rec[1:], linestyle="--", label="Resource Sharing", linewidth=1.5)
+    plt.xlabel("Number of Iterations", fontsize=MEDIUM_SIZE)
+    plt.ylabel("Number of RBs", fontsize=MEDIUM_SIZE)
+    plt.legend(loc="best", fontsize=BIG_SIZE)
+    plt.savefig(
+        output_dir + "/" + "Requested & Shared Resources Trend" + ".png",
+        dpi=300,
+        bbox_inches="tight",
+    )
+    plt.clf()
+
+    plt.plot(welfare_rec, label="Social Welfare", linewidth=2.5)
+    plt.xlabel("Number of Iterations", fontsize=MEDIUM_SIZE)
+    plt.ylabel("Utility Value", fontsize=MEDIUM_SIZE)
+    plt.legend(loc="best", fontsize=BIG_SIZE)
+    plt.savefig(
+        output_dir + "/" + "Social Welfare Trend" + ".png",
+        dpi=300,
+        bbox_inches="tight",
+    )
+    plt.clf()
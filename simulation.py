@@ -0,0 +1,855 @@
+import random
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+from user import User, set_kernel_backend, set_payoff_engine
+from tools import *
+from channel import Channel
+from population import UserPopulation
+from pricing import WarmStart
+from incremental import IncrementalClearing
+from equilibria import EquilibriumCache
+from recorder import Recorder
+from profiling import MetricsTable, enable, instrument
+from traces import TraceWriter
+from checkpoint import save as save_checkpoint
+
+MODES = ("STATIC", "RANDOM", "HEURISTIC", "FUTURE")
+
+
+class Simulation:
+    """
+    The PRB resale market over a number of time slots.
+
+    Each slot updates the users' buffers, assigns the buyer and seller roles,
+    clears the market with optimal_bidding and settles the integer trades.
+    The per-slot and per-iteration records are kept on the instance under the
+    same names game.py reports and plots them with.
+    """
+
+    def __init__(
+        self,
+        mode: str = "FUTURE",
+        slots: int = 1,
+        step_size: float = 1e-7,
+        generations: int = 2000,
+        hb_users: int = 5,
+        lr_users: int = 5,
+        seed: int = 2025,
+        payoff_engine: str = "analytic",
+        kernel_backend: str = "python",
+        batched: bool = False,
+        price_update: str = "gradient",
+        warm_start: str = "cold",
+        warm_bids: bool = False,
+        warm_start_check: bool = False,
+        record: str = "trace",
+        record_dir: str = None,
+        trace_dir: str = None,
+        demand_rng: str = "random",
+        lazy_demand: bool = False,
+        population: bool = False,
+        boundary: str = "clamp",
+        rate_table: int = 0,
+        incremental: float = None,
+        incremental_check: bool = False,
+        equilibrium_cache: float = None,
+        equilibrium_cache_size: int = 4096,
+        equilibrium_cache_dir: str = None,
+        equilibrium_cache_warm: bool = False,
+        equilibrium_cache_check: bool = False,
+        equilibrium_tolerance: float = None,
+        equilibrium_gap: bool = False,
+        metrics: bool = False,
+    ):
+        """
+        Initializes the simulation and its users.
+
+        Args:
+            mode (str): One of MODES.
+            slots (int): The number of slots run() simulates.
+            step_size (float): The step of the gradient price update.
+            generations (int): The number of demand samples per user, at
+                least the number of slots.
+            hb_users (int): The number of HB users.
+            lr_users (int): The number of LR users.
+            seed (int): The seed of the simulation's streams. Every
+                simulation draws from its own streams only, never from the
+                random module, so simulations in one process or in parallel
+                give the same results as on their own.
+            payoff_engine (str): See user.set_payoff_engine.
+            kernel_backend (str): The backend of the users' payoffs and best
+                responses, see user.set_kernel_backend. It does not change
+                the results, and the batched best responses do not use it.
+            batched (bool): Whether to solve the best responses with NumPy.
+            price_update (str): See pricing.PRICE_UPDATES.
+            warm_start (str): See pricing.WarmStart.
+            warm_bids (bool): See tools.optimal_bidding.
+            warm_start_check (bool): Whether to also clear each slot from
+                the cold start and record the deviation.
+            record (str): The recording level, see recorder.LEVELS.
+            record_dir (str): Where the recorded series are streamed to, or
+                None to keep them in memory.
+            trace_dir (str): Where the per-slot state is written as a
+                columnar store, see traces.Trace.
+            demand_rng (str): "random" draws the users' attributes, moves
+                and demand from the simulation's random.Random stream, one
+                user after the other. "numpy" gives every user its own NumPy
+                Generator, child i of SeedSequence(seed) for the user at
+                position i, and draws its demand in a single vectorized call,
+                so any subset of the users can be generated on its own, e.g.
+                in parallel shards. With population, "numpy" also draws the
+                moves of all users from one more spawned Generator, see
+                channel.Channel, and the RANDOM roles from another one.
+                Otherwise the RANDOM roles are drawn from the simulation's
+                random.Random stream.
+            lazy_demand (bool): Whether to draw the demand in chunks as the
+                slots advance instead of all generations at once, which
+                needs demand_rng "numpy".
+            population (bool): Whether to keep the users' state in the arrays
+                of a UserPopulation and do the per-slot work on all users at
+                once, see population.UserPopulation.
+            boundary (str): See channel.BOUNDARIES, needs population.
+            rate_table (int): See channel.Channel, needs population.
+            incremental (float): Clear the slots re-solving only the best
+                responses of the users whose rate factor or buffer term moved
+                by more than this relative tolerance, see
+                incremental.IncrementalClearing. None clears every slot in
+                full.
+            incremental_check (bool): Whether to also clear each slot in full
+                and record the deviation of the incremental clearing.
+            equilibrium_cache (float): Reuse the equilibrium of an earlier
+                slot whose roles match and whose users' inputs are within
+                bins of this relative width, see equilibria.EquilibriumCache.
+                None clears every slot.
+            equilibrium_cache_size (int): The equilibria kept in memory.
+            equilibrium_cache_dir (str): The folder the equilibria are also
+                stored in, shared by the runs using it.
+            equilibrium_cache_warm (bool): Whether a cached equilibrium only
+                starts the price iteration and the best response searches
+                instead of replacing them.
+            equilibrium_cache_check (bool): Whether to also clear the slots
+                found in the cache and record the deviation of the cached
+                equilibria.
+            equilibrium_tolerance (float): Clear each slot until the bids are
+                within this gap of a Nash equilibrium instead of until the
+                price settles, see tools.optimal_bidding, and record the gap
+                of every iteration. None stops on the price change.
+            equilibrium_gap (bool): Whether to record the gap of the last
+                bids of every slot and their excess demand at the clearing
+                price, see tools.equilibrium_gaps, which an
+                equilibrium_tolerance implies.
+            metrics (bool): Whether to keep a per-slot table of the
+                instrumentation's counters and timers in metrics, see
+                profiling.MetricsTable. The instrumentation is global and
+                only enabled while run() runs.
+
+        Raises:
+            ValueError: If the mode or the demand_rng is unknown, the
+                channel options are given without population, or an
+                equilibrium_tolerance with incremental.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode: {mode}")
+        if equilibrium_tolerance is not None and incremental is not None:
+            raise ValueError("The incremental clearing stops on the price change")
+        if not population and (boundary != "clamp" or rate_table):
+            raise ValueError("The channel options need population=True")
+        self.config = {
+            "mode": mode,
+            "slots": slots,
+            "step_size": step_size,
+            "generations": generations,
+            "hb_users": hb_users,
+            "lr_users": lr_users,
+            "seed": seed,
+        }
+        self.mode = mode
+        self.slots = slots
+        self.step_size = step_size
+        self.payoff_engine = payoff_engine
+        self.kernel_backend = kernel_backend
+        self.batched = batched
+        self.price_update = price_update
+        self.warm_start = WarmStart(warm_start)
+        self.warm_bids = warm_bids
+        self.warm_start_check = warm_start_check
+        self.incremental = None
+        if incremental is not None:
+            self.incremental = IncrementalClearing(step_size, price_update, incremental)
+        # The check compares against the incremental clearing only
+        self.incremental_check = incremental_check and incremental is not None
+        self.equilibrium_cache = None
+        if equilibrium_cache is not None:
+            self.equilibrium_cache = EquilibriumCache(
+                equilibrium_cache, equilibrium_cache_size, equilibrium_cache_dir
+            )
+        self.equilibrium_cache_warm = equilibrium_cache_warm
+        self.equilibrium_cache_check = (
+            equilibrium_cache_check and equilibrium_cache is not None
+        )
+        self.equilibrium_tolerance = equilibrium_tolerance
+        self.equilibrium_gap = equilibrium_gap or equilibrium_tolerance is not None
+        self.metrics = MetricsTable() if metrics else None
+
+        self.users = self._create_users(
+            seed, hb_users, lr_users, generations, demand_rng, lazy_demand
+        )
+        if mode == "FUTURE":
+            for user in self.users:
+                user.loss_factor = 10.0
+
+        self.slot = 0
+        self.recorder = Recorder(record, record_dir)
+        for user in self.users:
+            user.set_recorder(self.recorder)
+        self.population = None
+        if population:
+            self.population = UserPopulation(
+                self.users,
+                Channel(
+                    boundary=boundary, rate_table=rate_table, rng=self.mobility_rng
+                ),
+            )
+            self.users = self.population.views
+        self.trace = None
+        if trace_dir is not None:
+            self.trace = TraceWriter(trace_dir, self.users, self.config)
+        # Per-iteration records
+        self.price_rec = self.recorder.series("price", "trace")
+        self.demand_rec = self.recorder.series("demand", "trace")
+        self.supply_rec = self.recorder.series("supply", "trace")
+        self.welfare_rec = self.recorder.series("welfare", "trace")
+        # The largest gap of the bids, with an equilibrium tolerance
+        self.gap_rec = self.recorder.series("gap", "trace")
+        # The per-iteration welfare is only computed when it is kept
+        self.trace_welfare = self.recorder.records("trace")
+        # Per-slot records
+        self.clr_price_rec = self.recorder.series("clearing_price", "summary")
+        self.iteration_rec = self.recorder.series("iterations", "summary")
+        self.cold_iteration_rec = self.recorder.series("cold_iterations", "summary")
+        self.cold_price_deviation = self.recorder.series(
+            "cold_price_deviation", "summary"
+        )
+        self.cold_amount_deviation = self.recorder.series(
+            "cold_amount_deviation", "summary"
+        )
+        self.market_clearing_welfare = self.recorder.series(
+            "market_clearing_welfare", "summary"
+        )
+        self.skipped_rec = self.recorder.series("skipped_best_responses", "summary")
+        self.clearing_seconds = self.recorder.series("clearing_seconds", "summary")
+        self.full_price_deviation = self.recorder.series(
+            "full_price_deviation", "summary"
+        )
+        self.full_amount_deviation = self.recorder.series(
+            "full_amount_deviation", "summary"
+        )
+        self.cache_price_deviation = self.recorder.series(
+            "cache_price_deviation", "summary"
+        )
+        self.cache_amount_deviation = self.recorder.series(
+            "cache_amount_deviation", "summary"
+        )
+        # RBs bought minus RBs sold after rounding, the largest over markets
+        self.trade_imbalance = self.recorder.series("trade_imbalance", "summary")
+        # The largest gap of the last bids and their excess demand in RBs at
+        # the clearing price, with equilibrium_gap
+        self.equilibrium_gap_rec = self.recorder.series("equilibrium_gap", "summary")
+        self.excess_demand_rec = self.recorder.series("excess_demand", "summary")
+
+    def _create_users(
+        self,
+        seed: int,
+        hb_users: int,
+        lr_users: int,
+        generations: int,
+        demand_rng: str,
+        lazy_demand: bool,
+    ) -> list:
+        """
+        Creates the users and the simulation's streams, random,
+        mobility_rng and role_rng, from the seed.
+
+        Returns:
+            list: The HB users followed by the LR users, with ids from 1.
+
+        Raises:
+            ValueError: If the demand_rng is unknown.
+        """
+        # The stream of the roles, and of everything else unless numpy
+        self.random = random.Random(seed)
+        types = ["HB"] * hb_users + ["LR"] * lr_users
+        if demand_rng == "numpy":
+            # One stream per user, then one for the moves and one for the roles
+            rngs = [
+                np.random.default_rng(seed_sequence)
+                for seed_sequence in np.random.SeedSequence(seed).spawn(len(types) + 2)
+            ]
+            self.role_rng = rngs.pop()
+            self.mobility_rng = rngs.pop()
+        elif demand_rng == "random":
+            rngs = [self.random] * len(types)
+            self.mobility_rng = self.role_rng = self.random
+        else:
+            raise ValueError(f"Unknown demand_rng: {demand_rng}")
+        return [
+            User(i + 1, type, generations, rng, lazy_demand)
+            for i, (type, rng) in enumerate(zip(types, rngs))
+        ]
+
+    @instrument()
+    def step(self) -> dict:
+        """
+        Simulates one time slot.
+
+        Returns:
+            dict: The slot index, its market clearing price (0 without trade),
+                the number of price iterations, the number of buyers and
+                sellers and the social welfare after trading.
+        """
+        set_payoff_engine(self.payoff_engine)
+        set_kernel_backend(self.kernel_backend)
+        users = self.users
+        iterations = 0
+
+        population = self.population
+
+        if population is not None:
+            # Phase 1 on the arrays of all users at once
+            population.update()
+            expected_prices = population.expected_price()
+            initial_market_price = expected_prices.sum() / len(users)
+            if self.mode == "RANDOM":
+                population.is_buyer = random_roles(len(users), self.role_rng)
+            else:
+                population.is_buyer = expected_prices > initial_market_price
+        else:
+            # Phase 1: Update the user's buffer
+            for user in users:
+                user.update()
+
+            # Calculate the average expected price as the initial market price
+            initial_market_price = sum(user.expected_price() for user in users) / len(
+                users
+            )
+
+            if self.mode == "RANDOM":
+                roles = random_roles(len(users), self.role_rng)
+                for user, is_buyer in zip(users, roles.tolist()):
+                    user.is_buyer = is_buyer
+            else:
+                # Determine the role of each user based on the market price
+                for user in users:
+                    user.is_buyer = user.expected_price() > initial_market_price
+
+        if population is not None:
+            buyer_index = np.flatnonzero(population.is_buyer)
+            seller_index = np.flatnonzero(~population.is_buyer)
+            buyer_count, seller_count = len(buyer_index), len(seller_index)
+            buyers = sellers = None
+            if (
+                not self.batched
+                or self.incremental is not None
+                or self.equilibrium_cache is not None
+            ):
+                # The views are only used by the per-user code paths
+                buyers = [users[i] for i in buyer_index.tolist()]
+                sellers = [users[i] for i in seller_index.tolist()]
+        else:
+            buyer_index = seller_index = None
+            buyers = [user for user in users if user.is_buyer]
+            sellers = [user for user in users if user.is_seller()]
+            buyer_count, seller_count = len(buyers), len(sellers)
+        if population is not None:
+            market_clearing_welfare = population.welfare()
+        else:
+            market_clearing_welfare = calculate_initial_welfare(sellers, buyers)
+        self.welfare_rec.append(market_clearing_welfare)
+
+        market_clearing_price = 0.0
+        if self.mode != "STATIC":
+            # Aggregate market state for the warm start predictor
+            market_features = [
+                initial_market_price,
+                (
+                    population.emp_buffer.sum()
+                    if population is not None
+                    else sum(user.emp_buffer for user in users)
+                )
+                / len(users),
+            ]
+            initial_market_price = self.warm_start.initial_price(market_features)
+            ############### Do Trade ################
+            if buyer_count and seller_count > 1:
+                buyer_parameters = seller_parameters = None
+                if population is not None:
+                    buyer_parameters = population.parameters(buyer_index)
+                    seller_parameters = population.parameters(seller_index)
+                elif (
+                    self.warm_start_check
+                    or self.incremental_check
+                    or self.equilibrium_cache is not None
+                    or (self.equilibrium_gap and self.batched)
+                ):
+                    buyer_parameters = user_parameters(buyers)
+                    seller_parameters = user_parameters(sellers)
+                if self.warm_start_check:
+                    # Clear the slot from the cold start without touching the users
+                    cold_price, cold_iterations = clearing_price(
+                        buyer_parameters,
+                        seller_parameters,
+                        self.warm_start.cold_price,
+                        self.step_size,
+                        self.price_update,
+                    )
+                    cold_amount = requested_amount(
+                        buyer_parameters,
+                        cold_price,
+                        float(seller_parameters["assigned_blocks"].sum()),
+                    )
+                if self.incremental_check:
+                    # Clear the slot in full without touching the users
+                    full_price, _ = clearing_price(
+                        buyer_parameters,
+                        seller_parameters,
+                        initial_market_price,
+                        self.step_size,
+                        self.price_update,
+                    )
+                    full_amount = requested_amount(
+                        buyer_parameters,
+                        full_price,
+                        float(seller_parameters["assigned_blocks"].sum()),
+                    )
+                warm_bids = self.warm_bids
+                diagnostics = None
+                if self.equilibrium_tolerance is not None and self.trace_welfare:
+                    diagnostics = lambda report: self.gap_rec.append(report["gap"])
+                cached = fresh = None
+                if self.equilibrium_cache is not None:
+                    key, cached, fresh = self._cached_equilibrium(
+                        buyers,
+                        sellers,
+                        buyer_index,
+                        seller_index,
+                        buyer_parameters,
+                        seller_parameters,
+                        initial_market_price,
+                    )
+                if cached is not None and self.equilibrium_cache_warm:
+                    initial_market_price = cached["price"]
+                    warm_bids = True
+                start = time.perf_counter()
+                if cached is not None and not self.equilibrium_cache_warm:
+                    # The cached equilibrium, without price iterations
+                    market_clearing_price = cached["price"]
+                    local_price_rec, local_demand_rec = [], []
+                    local_supply_rec, local_welfare_rec = [], []
+                    demand = cached["demand"]
+                else:
+                    (
+                        market_clearing_price,
+                        local_price_rec,
+                        local_demand_rec,
+                        local_supply_rec,
+                        local_welfare_rec,
+                    ) = self._clear_market(
+                        buyers,
+                        sellers,
+                        buyer_index,
+                        seller_index,
+                        buyer_parameters,
+                        seller_parameters,
+                        initial_market_price,
+                        warm_bids,
+                        diagnostics,
+                    )
+                if local_demand_rec:
+                    demand = local_demand_rec[-1]
+                    if self.equilibrium_cache is not None:
+                        self.equilibrium_cache.put(
+                            key,
+                            market_clearing_price,
+                            demand,
+                            *self._market_bids(
+                                buyers, sellers, buyer_index, seller_index
+                            ),
+                        )
+                self.clearing_seconds.append(time.perf_counter() - start)
+                if self.equilibrium_gap:
+                    # With the solver the slot was cleared with
+                    if self.batched:
+                        buyer_bids, seller_bids = self._market_bids(
+                            buyers, sellers, buyer_index, seller_index
+                        )
+                        buyer_gaps, seller_gaps, induced_price = equilibrium_gaps(
+                            buyer_parameters, seller_parameters, buyer_bids, seller_bids
+                        )
+                        total_supply = float(seller_parameters["assigned_blocks"].sum())
+                    else:
+                        buyer_gaps, seller_gaps, induced_price = user_equilibrium_gaps(
+                            buyers, sellers
+                        )
+                        total_supply = float(
+                            sum(seller.assigned_blocks for seller in sellers)
+                        )
+                    self.equilibrium_gap_rec.append(
+                        float(
+                            max(
+                                buyer_gaps.max(initial=0.0),
+                                seller_gaps.max(initial=0.0),
+                            )
+                        )
+                    )
+                    # The RBs the bids leave unmatched at the clearing price
+                    self.excess_demand_rec.append(
+                        abs(total_supply * (induced_price / market_clearing_price - 1))
+                    )
+                if self.incremental_check:
+                    self.full_price_deviation.append(
+                        abs(market_clearing_price - full_price)
+                    )
+                    self.full_amount_deviation.append(abs(demand - full_amount))
+                if fresh is not None:
+                    fresh_price, fresh_amount = fresh
+                    self.cache_price_deviation.append(
+                        abs(market_clearing_price - fresh_price)
+                    )
+                    self.cache_amount_deviation.append(abs(demand - fresh_amount))
+                self.warm_start.record(market_features, market_clearing_price)
+                iterations = len(local_price_rec)
+                self.price_rec.extend(local_price_rec)
+                self.iteration_rec.append(iterations)
+                if self.warm_start_check:
+                    self.cold_iteration_rec.append(cold_iterations)
+                    self.cold_price_deviation.append(
+                        abs(market_clearing_price - cold_price)
+                    )
+                    self.cold_amount_deviation.append(abs(demand - cold_amount))
+                self.demand_rec.extend(local_demand_rec)
+                self.supply_rec.extend(local_supply_rec)
+                self.welfare_rec.extend(local_welfare_rec)
+
+                # Round up
+                if population is not None:
+                    population.trading_amount = settle(
+                        population.bid,
+                        market_clearing_price,
+                        population.assigned_blocks,
+                        buyer_index,
+                        seller_index,
+                    )
+                    imbalance = float(population.trading_amount.sum())
+                else:
+                    buyer_amounts, seller_amounts = [], []
+                    for user in users:
+                        if user.is_buyer:
+                            buyer_amounts.append(user.bid / market_clearing_price)
+                        else:
+                            seller_amounts.append(
+                                user.bid / market_clearing_price - user.assigned_blocks
+                            )
+                    buyer_int = iter(largest_remainder_method(buyer_amounts))
+                    seller_int = iter(largest_remainder_method(seller_amounts))
+                    imbalance = 0.0
+                    for user in users:
+                        user.trading_amount = next(
+                            buyer_int if user.is_buyer else seller_int
+                        )
+                        imbalance += user.trading_amount
+                self.trade_imbalance.append(abs(imbalance))
+
+            # Record the market clearing price
+            self.clr_price_rec.append(market_clearing_price)
+
+            if population is not None:
+                market_clearing_welfare = population.welfare(population.trading_amount)
+            else:
+                market_clearing_welfare = calculate_social_welfare(sellers, buyers)
+            ############### Do Trade ################
+
+        self.market_clearing_welfare.append(market_clearing_welfare)
+
+        # Record the current state of each user
+        if population is not None:
+            population.record_current_state()
+        else:
+            for user in users:
+                user.record_current_state()
+
+        self.slot += 1
+        result = {
+            "slot": self.slot,
+            "clearing_price": market_clearing_price,
+            "iterations": iterations,
+            "buyers": buyer_count,
+            "sellers": seller_count,
+            "welfare": market_clearing_welfare,
+        }
+        if self.trace is not None:
+            self.trace.write(result, users)
+        return result
+
+    def _cached_equilibrium(
+        self,
+        buyers: list,
+        sellers: list,
+        buyer_index: np.ndarray,
+        seller_index: np.ndarray,
+        buyer_parameters: dict,
+        seller_parameters: dict,
+        initial_price: float,
+    ) -> tuple:
+        """
+        Looks the market of the slot up in the equilibrium cache. On a hit,
+        the users start from the cached bids, and with equilibrium_cache_check
+        the market is also cleared in full without touching the users.
+
+        Returns:
+            tuple: The fingerprint of the market, its cached equilibrium or
+                None, and the price and traded RBs of the full clearing or
+                None.
+        """
+        key = self.equilibrium_cache.fingerprint(
+            [user.id for user in buyers], buyer_parameters, seller_parameters
+        )
+        cached = self.equilibrium_cache.get(key)
+        if cached is None:
+            return key, None, None
+        fresh = None
+        if self.equilibrium_cache_check:
+            fresh_price, _ = clearing_price(
+                buyer_parameters,
+                seller_parameters,
+                initial_price,
+                self.step_size,
+                self.price_update,
+            )
+            fresh = fresh_price, requested_amount(
+                buyer_parameters,
+                fresh_price,
+                float(seller_parameters["assigned_blocks"].sum()),
+            )
+        # Start from the cached bids, or keep them
+        if self.population is not None:
+            self.population.bid[buyer_index] = cached["buyer_bids"]
+            self.population.bid[seller_index] = cached["seller_bids"]
+        else:
+            for group, bids in [
+                (buyers, cached["buyer_bids"]),
+                (sellers, cached["seller_bids"]),
+            ]:
+                for user, bid in zip(group, bids.tolist()):
+                    user.bid = bid
+        return key, cached, fresh
+
+    def _market_bids(
+        self,
+        buyers: list,
+        sellers: list,
+        buyer_index: np.ndarray,
+        seller_index: np.ndarray,
+    ) -> tuple:
+        # The last bids of the buyers and of the sellers
+        if self.population is not None:
+            return self.population.bid[buyer_index], self.population.bid[seller_index]
+        return [user.bid for user in buyers], [user.bid for user in sellers]
+
+    def _clear_market(
+        self,
+        buyers: list,
+        sellers: list,
+        buyer_index: np.ndarray,
+        seller_index: np.ndarray,
+        buyer_parameters: dict,
+        seller_parameters: dict,
+        initial_price: float,
+        warm_bids: bool,
+        diagnostics=None,
+    ) -> tuple:
+        """
+        Clears the market of the slot with incremental re-clearing, batched
+        best responses on the population's arrays or optimal_bidding on the
+        users, as the options select.
+
+        Returns:
+            tuple: As optimal_bidding.
+        """
+        if self.incremental is not None:
+            solved, full = self.incremental.solved, self.incremental.full
+            result = self.incremental.clear(
+                buyers, sellers, initial_price, self.trace_welfare
+            )
+            self.skipped_rec.append(
+                1.0
+                - (self.incremental.solved - solved) / (self.incremental.full - full)
+            )
+            return result
+        if self.population is not None and self.batched:
+            return self._clear_population(
+                buyer_index,
+                seller_index,
+                buyer_parameters,
+                seller_parameters,
+                initial_price,
+                warm_bids,
+                diagnostics,
+            )
+        return optimal_bidding(
+            buyers,
+            sellers,
+            initial_price,
+            self.step_size,
+            self.batched,
+            self.price_update,
+            warm_bids=warm_bids,
+            welfare=self.trace_welfare,
+            equilibrium_tolerance=self.equilibrium_tolerance,
+            diagnostics=diagnostics,
+        )
+
+    def _clear_population(
+        self,
+        buyer_index: np.ndarray,
+        seller_index: np.ndarray,
+        buyer_parameters: dict,
+        seller_parameters: dict,
+        initial_price: float,
+        warm_bids: bool = False,
+        diagnostics=None,
+    ) -> tuple:
+        """
+        Clears the market with batched best responses on the population's
+        arrays, recording the price iterations of all users at once.
+
+        Returns:
+            tuple: As optimal_bidding.
+        """
+        population = self.population
+        groups = population.round_series()
+
+        def record(buyer_rounds, seller_rounds):
+            for index, rounds in [
+                (buyer_index, buyer_rounds),
+                (seller_index, seller_rounds),
+            ]:
+                groups["bid_rec"].append(rounds["bids"], index)
+                groups["payoff_rec"].append(rounds["payoffs"], index)
+                groups["utility_rec"].append(rounds["utilities"], index)
+
+        result = batched_optimal_bidding(
+            buyer_parameters,
+            seller_parameters,
+            initial_price,
+            self.step_size,
+            self.price_update,
+            buyer_bids=population.bid[buyer_index] if warm_bids else None,
+            seller_bids=population.bid[seller_index] if warm_bids else None,
+            record=record,
+            welfare=self.trace_welfare,
+            equilibrium_tolerance=self.equilibrium_tolerance,
+            diagnostics=diagnostics,
+        )
+        for group in groups.values():
+            group.flush()
+        population.bid[buyer_index] = result[5]
+        population.bid[seller_index] = result[6]
+        return result[:5]
+
+    def run(
+        self,
+        slots: int = None,
+        progress: bool = False,
+        checkpoint: str = None,
+        checkpoint_every: int = 0,
+    ) -> dict:
+        """
+        Simulates the remaining slots.
+
+        Args:
+            slots (int): The number of slots to simulate, all remaining slots
+                of the configuration by default.
+            progress (bool): Whether to show a progress bar.
+            checkpoint (str): The file the state is saved to every
+                checkpoint_every slots, see checkpoint.save.
+            checkpoint_every (int): The slots between checkpoints, counted
+                from the first slot, 0 for none.
+
+        Returns:
+            dict: The summary of the simulation so far, see summary().
+        """
+        if slots is None:
+            slots = self.slots - self.slot
+        # The instrumentation is global, so it is only on while this runs
+        enabled = enable(True) if self.metrics is not None else None
+        try:
+            for _ in tqdm(range(slots), disable=not progress):
+                if self.metrics is not None:
+                    self.metrics.start()
+                    self.step()
+                    self.metrics.record(self.slot)
+                else:
+                    self.step()
+                if checkpoint_every and self.slot % checkpoint_every == 0:
+                    save_checkpoint(self, checkpoint)
+        finally:
+            if enabled is not None:
+                enable(enabled)
+        self.recorder.flush()
+        if self.trace is not None:
+            self.trace.flush()
+        return self.summary()
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: The loss and waste counters and amounts, the total and
+                minimum social welfare, the price iterations and one entry
+                per user with its counters and accumulated utility.
+        """
+        users = self.users
+        return {
+            "slots": self.slot,
+            "loss_counter": sum(user.loss_counter for user in users),
+            "loss_amount": sum(user.loss_amount_counter for user in users),
+            "waste_counter": sum(user.waste_counter for user in users),
+            "waste_amount": sum(user.waste_amount_counter for user in users),
+            "total_welfare": self.market_clearing_welfare.total,
+            "min_welfare": self.market_clearing_welfare.minimum if self.slot else 0.0,
+            "iterations": int(self.iteration_rec.total),
+            "users": [
+                {
+                    "id": user.id,
+                    "type": user.type,
+                    "loss_counter": user.loss_counter,
+                    "loss_amount": user.loss_amount_counter,
+                    "waste_counter": user.waste_counter,
+                    "waste_amount": user.waste_amount_counter,
+                    "utility": user.utility_rec.total,
+                }
+                for user in users
+            ],
+        }
+
+
+def print_summary(summary: dict) -> None:
+    # Prints the numerical results reported for the 12-hour setting
+    print("Loss counter:", summary["loss_counter"])
+    print("Loss amount:", summary["loss_amount"])
+    print("Waste counter:", summary["waste_counter"])
+    print("Waste amount:", summary["waste_amount"])
+    print("Total social welfare:", summary["total_welfare"])
+    print("Min_welfare:", summary["min_welfare"])
+
+    for user in summary["users"]:
+        print(
+            user["id"],
+            user["loss_counter"],
+            user["loss_amount"],
+            user["waste_counter"],
+            user["waste_amount"],
+            user["utility"],
+        )
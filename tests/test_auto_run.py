@@ -0,0 +1,19 @@
+import os
+
+from auto_run import is_finished, run_config, run_directory, run_game
+
+
+def test_run_game_marks_the_run_finished(tmp_path):
+    setting = {"slots": 1, "step_size": 1e-7, "generations": 10}
+    config = run_config("STATIC", setting, 2025)
+    directory = run_directory(str(tmp_path), "STATIC", setting)
+    assert directory == os.path.join(str(tmp_path), "STATIC", "1_slots")
+    assert not is_finished(directory, config, [])
+
+    assert run_game(config, directory, []) == directory
+    for name in ("log.txt", "progress.txt", "done.json"):
+        assert os.path.exists(os.path.join(directory, name))
+    assert is_finished(directory, config, [])
+    # A different configuration runs again
+    assert not is_finished(directory, {**config, "seed": 1}, [])
+    assert not is_finished(directory, config, ["--batched"])
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from cells import MultiCellSimulation
+from simulation import Simulation
+
+
+@pytest.mark.parametrize("seed", [1, 3])
+@pytest.mark.parametrize("mode", ["RANDOM", "HEURISTIC", "FUTURE"])
+def test_single_cell_matches_single_market(mode, seed):
+    # With 2 + 2 users many slots have too few sellers to trade
+    options = dict(
+        mode=mode,
+        slots=40,
+        seed=seed,
+        generations=40,
+        hb_users=2,
+        lr_users=2,
+        price_update="secant",
+        record="trace",
+    )
+    cells = MultiCellSimulation(cells=(1, 1), **options)
+    market = Simulation(population=True, batched=True, **options)
+    cell_summary = cells.run()
+    market_summary = market.run()
+    for cell_user, market_user in zip(
+        cell_summary.pop("users"), market_summary.pop("users")
+    ):
+        assert cell_user == pytest.approx(market_user, rel=1e-9)
+    assert cell_summary == pytest.approx(market_summary, rel=1e-9)
+    # Both record every price iteration of every user
+    for cell_user, market_user in zip(cells.users, market.users):
+        for name in ["bid_rec", "payoff_rec", "utility_rec"]:
+            assert len(getattr(cell_user, name)) == len(getattr(market_user, name))
+            np.testing.assert_allclose(
+                getattr(cell_user, name).values(),
+                getattr(market_user, name).values(),
+                rtol=1e-9,
+            )
+
+
+@pytest.mark.parametrize(
+    "option",
+    [
+        {"batched": False},
+        {"incremental": 0.01},
+        {"incremental_check": True},
+        {"warm_bids": True},
+        {"warm_start_check": True},
+        {"payoff_engine": "quad"},
+    ],
+)
+def test_unsupported_options_are_rejected(option):
+    with pytest.raises(ValueError):
+        MultiCellSimulation(cells=(2, 2), mode="HEURISTIC", slots=1, **option)
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from channel import Channel
+from simulation import Simulation
+from user import X_area, Y_area
+
+
+def test_rate_table_matches_exact_rates():
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(0, X_area, 1000), rng.uniform(0, Y_area, 1000)
+    exact = Channel().rate_factor(x, y)
+    np.testing.assert_allclose(Channel(rate_table=4096).rate_factor(x, y), exact, 1e-6)
+
+
+@pytest.mark.parametrize("boundary", ["clamp", "reflect"])
+def test_moves_stay_in_the_area(boundary):
+    channel = Channel(boundary=boundary, rng=np.random.default_rng(1))
+    x, y = np.zeros(500), np.full(500, Y_area)
+    for _ in range(20):
+        next_x, next_y = channel.move(x, y)
+        assert np.all((next_x >= 0) & (next_x <= X_area))
+        assert np.all((next_y >= 0) & (next_y <= Y_area))
+        assert np.all(np.hypot(next_x - x, next_y - y) <= channel.speed + 1e-9)
+        x, y = next_x, next_y
+
+
+def test_unknown_boundary():
+    with pytest.raises(ValueError):
+        Channel(boundary="wrap")
+
+
+def test_numpy_streams_draw_the_moves():
+    def positions(**options):
+        simulation = Simulation("STATIC", 5, 1e-6, 10, population=True, **options)
+        simulation.run()
+        return simulation.population.x.copy()
+
+    numpy_moves = positions(demand_rng="numpy")
+    np.testing.assert_array_equal(positions(demand_rng="numpy"), numpy_moves)
+    assert not np.array_equal(positions(), numpy_moves)
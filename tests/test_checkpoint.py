@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+import checkpoint
+from simulation import Simulation
+from traces import Trace
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"mode": "FUTURE"},
+        {"mode": "RANDOM"},
+        {"mode": "HEURISTIC", "incremental": 0.05, "warm_start": "predict"},
+        {
+            "mode": "FUTURE",
+            "population": True,
+            "batched": True,
+            "demand_rng": "numpy",
+            "lazy_demand": True,
+        },
+    ],
+)
+def test_resume_is_bit_identical(tmp_path, options):
+    path = str(tmp_path / "checkpoint.pkl")
+    uninterrupted = Simulation(slots=8, generations=30, seed=5, **options)
+    summary = uninterrupted.run()
+    # Run past the checkpoint, as a crashed run would
+    Simulation(slots=8, generations=30, seed=5, **options).run(
+        6, checkpoint=path, checkpoint_every=4
+    )
+    resumed = checkpoint.load(path)
+    assert resumed.slot == 4
+    assert resumed.run() == summary
+    for name in ["price_rec", "welfare_rec", "clr_price_rec"]:
+        np.testing.assert_array_equal(
+            getattr(resumed, name).values(), getattr(uninterrupted, name).values()
+        )
+    np.testing.assert_array_equal(
+        resumed.users[0].bid_rec.values(), uninterrupted.users[0].bid_rec.values()
+    )
+
+
+def test_resume_and_fork_streamed_records(tmp_path):
+    options = {"slots": 8, "generations": 30, "seed": 5, "record": "summary"}
+    uninterrupted = Simulation(
+        record_dir=str(tmp_path / "full"), trace_dir=str(tmp_path / "full"), **options
+    )
+    uninterrupted.run()
+    path = str(tmp_path / "checkpoint.pkl")
+    simulation = Simulation(
+        record_dir=str(tmp_path / "run"), trace_dir=str(tmp_path / "run"), **options
+    )
+    # Write every slot, so the files run past the checkpoint
+    simulation.trace.chunk_size = 1
+    for series in simulation.recorder.series_by_name.values():
+        series.chunk_size = 1
+    simulation.run(checkpoint=path, checkpoint_every=5)
+
+    # The fork starts from a copy of the first 5 slots
+    fork = checkpoint.load(
+        path,
+        record_dir=str(tmp_path / "fork"),
+        trace_dir=str(tmp_path / "fork"),
+        step_size=1e-6,
+    )
+    fork.run()
+    assert Trace(str(tmp_path / "fork")).slots == 8
+    assert Trace(str(tmp_path / "run")).slots == 8
+
+    # Resuming in place drops the slots written after the checkpoint
+    resumed = checkpoint.load(path)
+    assert Trace(str(tmp_path / "run")).slots == 5
+    resumed.run()
+    np.testing.assert_array_equal(
+        Trace(str(tmp_path / "run")).column("clearing_price"),
+        Trace(str(tmp_path / "full")).column("clearing_price"),
+    )
+    np.testing.assert_array_equal(
+        resumed.clr_price_rec.values(), uninterrupted.clr_price_rec.values()
+    )
+    assert not np.array_equal(
+        fork.clr_price_rec.values()[5:], uninterrupted.clr_price_rec.values()[5:]
+    )
+    np.testing.assert_array_equal(
+        fork.clr_price_rec.values()[:5], uninterrupted.clr_price_rec.values()[:5]
+    )
+
+
+def test_fork_rejects_other_settings(tmp_path):
+    path = str(tmp_path / "checkpoint.pkl")
+    Simulation(slots=2, generations=5).run(checkpoint=path, checkpoint_every=1)
+    with pytest.raises(ValueError):
+        checkpoint.load(path, mode="STATIC")
+
+
+def test_fork_to_an_equilibrium_tolerance(tmp_path):
+    path = str(tmp_path / "checkpoint.pkl")
+    Simulation(slots=4, generations=5).run(2, checkpoint=path, checkpoint_every=2)
+    fork = checkpoint.load(path, equilibrium_tolerance=1e-2)
+    fork.run()
+    assert fork.equilibrium_gap_rec.count == 2
+    assert fork.equilibrium_gap_rec.maximum <= 1e-2
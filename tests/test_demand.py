@@ -0,0 +1,70 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import demand
+from demand import ParetoGenerator, UniformGenerator, calibrate_alpha
+from simulation import Simulation
+
+
+@pytest.fixture
+def cache_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(demand, "_alpha_cache", {})
+    monkeypatch.setattr(demand, "_alpha_cache_file", None)
+    return str(tmp_path / "alphas.json")
+
+
+def test_alpha_cache_file_is_merged_and_replaced(cache_file, tmp_path):
+    # Another run stored its calibration in the meantime
+    with open(cache_file, "w") as f:
+        json.dump({"other": 2.5}, f)
+    demand.use_alpha_cache_file(cache_file)
+    alpha = calibrate_alpha(10.0, 100.0, 11.0)
+    with open(cache_file) as f:
+        stored = json.load(f)
+    assert stored["other"] == 2.5
+    assert stored[demand._cache_key(10.0, 100.0, 11.0)] == alpha
+    assert os.listdir(tmp_path) == ["alphas.json"]
+
+
+def test_numpy_pareto_mean():
+    generator = ParetoGenerator(10.0, 100.0, 11.0, np.random.default_rng(1))
+    samples = generator.generate(200_000)
+    assert samples.min() >= 10.0 and samples.max() <= 100.0
+    assert samples.mean() == pytest.approx(11.0, rel=1e-2)
+
+
+def test_numpy_demand_is_vectorized_and_bounded():
+    generator = ParetoGenerator(10.0, 100.0, 11.0, np.random.default_rng(1))
+    samples = generator.generate(10_000)
+    assert samples.shape == (10_000,)
+    assert samples.min() >= 10.0 and samples.max() <= 100.0
+    again = ParetoGenerator(10.0, 100.0, 11.0, np.random.default_rng(1))
+    np.testing.assert_array_equal(again.generate(10_000), samples)
+
+
+@pytest.mark.parametrize(
+    "make",
+    [
+        lambda rng: ParetoGenerator(10.0, 100.0, 11.0, rng),
+        lambda rng: UniformGenerator(10.0, 100.0, rng),
+    ],
+)
+def test_stream_draws_the_same_demand_in_chunks(make):
+    eager = make(np.random.default_rng(2)).generate(3000)
+    stream = make(np.random.default_rng(2)).stream(chunk_size=1024)
+    np.testing.assert_array_equal([stream[i] for i in range(3000)], eager)
+    with pytest.raises(IndexError):
+        stream[0]
+    with pytest.raises(ValueError):
+        make(None).stream()
+
+
+def test_lazy_demand_keeps_the_results():
+    options = dict(mode="FUTURE", slots=3, generations=10, demand_rng="numpy")
+    summary = Simulation(**options).run()
+    assert Simulation(lazy_demand=True, **options).run() == summary
+    with pytest.raises(ValueError):
+        Simulation(demand_rng="torch")
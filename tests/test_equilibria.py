@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from equilibria import EquilibriumCache
+from simulation import Simulation
+
+
+def parameters(scale=1.0):
+    return {
+        "willingness": np.array([22.0, 24.0]),
+        "rate_factor": np.array([1.5e6, 2.5e6]) * scale,
+        "buffer": np.array([9e8, 8e8]),
+        "assigned_blocks": np.array([40000.0, 4000.0]),
+    }
+
+
+def test_fingerprint_quantizes_the_inputs():
+    cache = EquilibriumCache(quantum=1e-2)
+    key = cache.fingerprint([1], parameters(), parameters())
+    assert cache.fingerprint([1], parameters(1.0001), parameters()) == key
+    assert cache.fingerprint([1], parameters(1.05), parameters()) != key
+    assert cache.fingerprint([2], parameters(), parameters()) != key
+
+
+def test_least_recently_used_entries_are_dropped(tmp_path):
+    cache = EquilibriumCache(size=2, directory=str(tmp_path))
+    for key in ["a", "b", "c"]:
+        cache.put(key, 1.0, 10.0, [1.0], [2.0])
+    cache.get("b")
+    assert list(cache.entries) == ["c", "b"]
+    # The disk store keeps them all, for this and other runs
+    shared = EquilibriumCache(directory=str(tmp_path))
+    entry = shared.get("a")
+    assert entry["price"] == 1.0
+    np.testing.assert_array_equal(entry["seller_bids"], [2.0])
+    assert shared.get("d") is None
+    assert (shared.disk_hits, shared.misses) == (1, 1)
+
+
+def test_cached_equilibria_are_reused(tmp_path):
+    options = dict(
+        mode="HEURISTIC",
+        slots=8,
+        generations=10,
+        seed=3,
+        record="summary",
+        equilibrium_cache_dir=str(tmp_path),
+    )
+    first = Simulation(equilibrium_cache=1e-3, **options)
+    summary = first.run()
+    # A second run of the same seed finds every slot on disk
+    second = Simulation(equilibrium_cache=1e-3, equilibrium_cache_check=True, **options)
+    assert second.run()["total_welfare"] == summary["total_welfare"]
+    assert second.equilibrium_cache.disk_hits == first.equilibrium_cache.misses
+    assert second.equilibrium_cache.misses == 0
+    assert second.iteration_rec.total == 0
+    np.testing.assert_array_equal(
+        second.clr_price_rec.values(), first.clr_price_rec.values()
+    )
+    assert second.cache_price_deviation.count == first.equilibrium_cache.misses
+    assert second.cache_price_deviation.maximum == pytest.approx(0.0, abs=1e-3)
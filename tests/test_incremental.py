@@ -0,0 +1,49 @@
+import numpy as np
+
+from recorder import Series, SeriesGroup
+from simulation import Simulation
+
+
+def test_incremental_clearing_stays_close_to_full_clearing():
+    simulation = Simulation(
+        "FUTURE",
+        20,
+        1e-6,
+        30,
+        hb_users=5,
+        lr_users=5,
+        incremental=0.05,
+        incremental_check=True,
+    )
+    simulation.run()
+    assert simulation.skipped_rec.maximum > 0.0
+    assert simulation.full_price_deviation.maximum < 1e-2
+    assert len(simulation.clearing_seconds) == 20
+    # Every user records every price iteration, estimated or solved
+    iterations = int(simulation.iteration_rec.total)
+    for user in simulation.users:
+        assert len(user.bid_rec) == len(user.utility_rec) == iterations
+
+
+def test_series_group_extend_matches_append():
+    rows = np.random.default_rng(1).lognormal(size=(300, 3)) * 1e3
+    expected = [Series() for _ in range(3)]
+    grouped = [Series() for _ in range(3)]
+    for series in expected + grouped:
+        series.append(2.5)
+    for row in rows:
+        for series, value in zip(expected, row):
+            series.append(value)
+    group = SeriesGroup(grouped)
+    group.extend(rows[:100])
+    group.extend(rows[100:])
+    group.flush()
+    for series, reference in zip(grouped, expected):
+        # The totals are summed in the same order, so they are equal
+        assert series.total == reference.total
+        assert (series.count, series.minimum, series.maximum) == (
+            reference.count,
+            reference.minimum,
+            reference.maximum,
+        )
+        np.testing.assert_array_equal(series.values(), reference.values())
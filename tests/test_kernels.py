@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import user
+from simulation import Simulation
+from user import check_kernels, sample_market, set_kernel_backend
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    # Restores the kernel backend, and without Numba runs the same kernels
+    # interpreted behind the numba backend
+    monkeypatch.setattr(user, "KERNEL_BACKEND", user.KERNEL_BACKEND)
+    if not user.NUMBA_AVAILABLE:
+        monkeypatch.setattr(user, "NUMBA_AVAILABLE", True)
+        monkeypatch.setattr(user, "KERNELS_CHECKED", True)
+
+
+@pytest.mark.parametrize("price", [0.5, 1.095, 2.0])
+def test_kernels_match_the_methods(price):
+    users, total_supply = sample_market()
+    assert check_kernels(users, price, total_supply) == 0.0
+    assert user.KERNEL_BACKEND == "python"
+
+
+@pytest.mark.parametrize("mode", ["FUTURE", "HEURISTIC"])
+def test_kernels_give_the_same_simulation(backend, mode):
+    options = dict(
+        mode=mode, slots=4, generations=10, seed=5, warm_bids=True, record="summary"
+    )
+    reference = Simulation(**options)
+    summary = reference.run()
+    compiled = Simulation(kernel_backend="numba", **options)
+    assert compiled.run() == summary
+    assert user.KERNEL_BACKEND == "numba"
+    np.testing.assert_array_equal(
+        compiled.clr_price_rec.values(), reference.clr_price_rec.values()
+    )
+
+
+def test_kernel_backend_selection(monkeypatch, backend):
+    with pytest.raises(ValueError):
+        set_kernel_backend("cython")
+    monkeypatch.setattr(user, "NUMBA_AVAILABLE", False)
+    assert set_kernel_backend("auto") == "python"
+    with pytest.raises(ValueError):
+        set_kernel_backend("numba")
+    assert user.KERNEL_BACKEND == "python"
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from population import UserView
+from recorder import Series, SeriesGroup
+from simulation import Simulation
+
+
+@pytest.mark.parametrize("mode", ["RANDOM", "HEURISTIC", "FUTURE"])
+@pytest.mark.parametrize("batched", [False, True])
+def test_population_matches_users(mode, batched):
+    results = []
+    for population in [False, True]:
+        simulation = Simulation(
+            mode,
+            8,
+            1e-6,
+            10,
+            batched=batched,
+            population=population,
+            record="trace",
+        )
+        summary = simulation.run()
+        results.append((simulation, summary))
+    (users, summary), (views, population_summary) = results
+    # The welfare sums of the population are pairwise, not sequential
+    for view_summary, user_summary in zip(
+        population_summary.pop("users"), summary.pop("users")
+    ):
+        assert view_summary == pytest.approx(user_summary, rel=1e-12)
+    assert population_summary == pytest.approx(summary, rel=1e-12)
+    # The channel of the population rounds differently in the last bit
+    for user, view in zip(users.users, views.users):
+        for name in ["bid_rec", "payoff_rec", "utility_rec"]:
+            np.testing.assert_allclose(
+                getattr(view, name).values(),
+                getattr(user, name).values(),
+                rtol=1e-9,
+                atol=1e-9,
+            )
+        assert view.emp_buffer == pytest.approx(user.emp_buffer, rel=1e-12)
+
+
+def test_views_are_not_updated_one_by_one():
+    simulation = Simulation("HEURISTIC", 1, 1e-6, 5, population=True)
+    view = simulation.users[0]
+    assert isinstance(view, UserView)
+    assert not hasattr(view, "update")
+    assert not hasattr(view, "record_current_state")
+
+
+def test_series_group_matches_series(tmp_path):
+    values = np.random.default_rng(0).normal(size=(20, 4))
+    index = np.array([0, 2])
+    expected = [Series() for _ in range(4)]
+    grouped = [Series(str(tmp_path / f"{i}.f64"), chunk_size=3) for i in range(4)]
+    for series in expected + grouped:
+        series.append(1.5)
+    group = SeriesGroup(grouped)
+    for row in values:
+        for i, value in enumerate(row):
+            expected[i].append(value)
+        group.append(row)
+        for i in index:
+            expected[i].append(-row[i])
+        group.append(-row[index], index)
+    group.flush()
+    for series, reference in zip(grouped, expected):
+        assert (series.count, series.total) == (reference.count, reference.total)
+        assert (series.minimum, series.maximum) == (
+            reference.minimum,
+            reference.maximum,
+        )
+        np.testing.assert_array_equal(series.values(), reference.values())
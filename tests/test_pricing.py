@@ -0,0 +1,92 @@
+import random
+
+import numpy as np
+import pytest
+
+from pricing import MIN_PRICE, PRICE_UPDATES, WarmStart, make_price_update
+from tools import clearing_price, optimal_bidding, user_parameters
+from user import User
+
+
+def make_market():
+    # The same market whatever the other tests drew before
+    random.seed(2025)
+    users = [User(i, "HB", 10) for i in range(1, 6)]
+    users += [User(i, "LR", 10) for i in range(6, 11)]
+    for u in users:
+        u.update()
+        u.is_buyer = u.type == "LR"
+    buyers = [u for u in users if u.is_buyer]
+    sellers = [u for u in users if not u.is_buyer]
+    return buyers, sellers
+
+
+@pytest.mark.parametrize("name", sorted(PRICE_UPDATES))
+def test_price_updates_clear_a_fixed_demand(name):
+    # 150 spent on 100 RBs clear at a price of 1.5
+    update_price = make_price_update(name, 1e-2)
+    price = 1.0
+    for _ in range(10_000):
+        next_price = update_price(price, 100.0 - 150.0 / price)
+        if abs(next_price - price) < 1e-10:
+            break
+        price = next_price
+    assert price == pytest.approx(1.5, rel=1e-8)
+
+
+def test_price_updates_keep_the_minimum_price():
+    update_price = make_price_update("gradient", 1.0)
+    assert update_price(0.5, 100.0) == MIN_PRICE
+
+
+def test_unknown_price_update():
+    with pytest.raises(ValueError):
+        make_price_update("newton", 1e-7)
+
+
+def test_secant_clears_the_market_in_fewer_iterations():
+    buyers, sellers = make_market()
+    gradient = optimal_bidding(buyers, sellers, 1.095, 1e-7)
+    secant = optimal_bidding(buyers, sellers, 1.095, 1e-7, price_update="secant")
+    assert secant[0] == pytest.approx(gradient[0], abs=1e-5)
+    assert len(secant[1]) < len(gradient[1]) / 10
+
+
+def test_warm_start_modes():
+    for mode in WarmStart.MODES:
+        assert WarmStart(mode).initial_price([1.0, 2.0]) == 1.095
+    previous = WarmStart("previous")
+    previous.record([1.0, 2.0], 1.2)
+    assert previous.initial_price([3.0, 4.0]) == 1.2
+    # The clearing price is linear in the features
+    predict = WarmStart("predict")
+    for x in range(6):
+        predict.record([x, x**2], 2.0 + 0.5 * x - 0.01 * x**2)
+    assert predict.initial_price([10, 100]) == pytest.approx(6.0)
+    with pytest.raises(ValueError):
+        WarmStart("hot")
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_warm_bids_reach_the_same_equilibrium(batched):
+    buyers, sellers = make_market()
+    cold = optimal_bidding(buyers, sellers, 1.095, 1e-7, batched, "secant")
+    cold_bids = [u.bid for u in buyers + sellers]
+    warm = optimal_bidding(
+        buyers, sellers, 1.095, 1e-7, batched, "secant", warm_bids=True
+    )
+    assert warm[0] == pytest.approx(cold[0], rel=1e-9)
+    np.testing.assert_allclose(
+        [u.bid for u in buyers + sellers], cold_bids, rtol=1e-8, atol=1e-8
+    )
+
+
+def test_clearing_price_leaves_the_users_untouched():
+    buyers, sellers = make_market()
+    price, iterations = clearing_price(
+        user_parameters(buyers), user_parameters(sellers), 1.095, 1e-7, "secant"
+    )
+    assert all(u.bid is None for u in buyers + sellers)
+    result = optimal_bidding(buyers, sellers, 1.095, 1e-7, price_update="secant")
+    assert price == pytest.approx(result[0], rel=1e-9)
+    assert iterations == len(result[1])
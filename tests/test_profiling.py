@@ -0,0 +1,39 @@
+import pytest
+
+import profiling
+from cells import MultiCellSimulation
+from simulation import Simulation
+
+
+@pytest.mark.parametrize("enabled", [False, True])
+def test_metrics_restore_the_instrumentation(enabled):
+    previous = profiling.enable(enabled)
+    try:
+        simulation = Simulation("HEURISTIC", 2, 1e-6, 5, metrics=True)
+        assert profiling.ENABLED == enabled
+        simulation.run()
+        assert profiling.ENABLED == enabled
+        assert len(simulation.metrics.rows) == 2
+        assert simulation.metrics.totals()["Simulation.step"][0] == 2
+    finally:
+        profiling.enable(previous)
+
+
+def test_metrics_include_the_cell_workers():
+    simulation = MultiCellSimulation(
+        cells=(2, 1),
+        jobs=2,
+        mode="HEURISTIC",
+        slots=2,
+        hb_users=6,
+        lr_users=6,
+        price_update="secant",
+        metrics=True,
+    )
+    try:
+        simulation.run()
+    finally:
+        simulation.close()
+    # clearing_prices only runs in the worker processes, once per slot each
+    calls, seconds = simulation.metrics.totals()["clearing_prices"]
+    assert calls == 4 and seconds > 0.0
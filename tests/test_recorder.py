@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pytest
+
+from recorder import Recorder, Series
+from simulation import Simulation
+
+
+def test_series_streams_its_values_in_chunks(tmp_path):
+    path = str(tmp_path / "series.f64")
+    series = Series(path, chunk_size=4)
+    series.extend(range(10))
+    # Two chunks are written, two values are still buffered
+    assert os.path.getsize(path) == 8 * 8
+    np.testing.assert_array_equal(series.values(), np.arange(10.0))
+    assert (series.count, series.total, series.minimum, series.maximum) == (
+        10,
+        45.0,
+        0.0,
+        9.0,
+    )
+    series.flush()
+    assert os.path.getsize(path) == 10 * 8
+
+
+def test_unstored_series_keeps_the_aggregates():
+    series = Series(store=False)
+    series.extend([3.0, -1.0, 4.0])
+    assert series.mean() == 2.0
+    assert (series.minimum, series.maximum) == (-1.0, 4.0)
+    with pytest.raises(ValueError):
+        series.values()
+
+
+def test_recorder_levels(tmp_path):
+    recorder = Recorder("summary", str(tmp_path))
+    assert recorder.series("price", "trace").store is False
+    assert recorder.series("clearing_price", "summary").store is True
+    assert os.listdir(tmp_path) == ["clearing_price.f64"]
+    with pytest.raises(ValueError):
+        Recorder("everything")
+
+
+def test_recording_level_keeps_the_results(tmp_path):
+    options = dict(mode="FUTURE", slots=3, generations=10, seed=3)
+    summary = Simulation(record="trace", **options).run()
+    for level in ("summary", "none"):
+        assert Simulation(record=level, **options).run() == summary
+    streamed = Simulation(record="trace", record_dir=str(tmp_path), **options)
+    assert streamed.run() == summary
+    assert len(streamed.price_rec.values()) == summary["iterations"]
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from replicas import METRICS, ReplicaSimulation, RunningStatistics, run_replicas
+from simulation import Simulation
+
+OPTIONS = dict(
+    slots=5,
+    generations=10,
+    hb_users=3,
+    lr_users=3,
+    price_update="secant",
+    record="none",
+)
+
+
+@pytest.mark.parametrize(
+    "mode,demand_rng",
+    [("RANDOM", "random"), ("HEURISTIC", "numpy"), ("FUTURE", "random")],
+)
+def test_replicas_match_separate_runs(mode, demand_rng):
+    options = dict(mode=mode, demand_rng=demand_rng, **OPTIONS)
+    summary = ReplicaSimulation([3, 7], **options).run()
+    assert summary["replicas"] == 2
+    for result, seed in zip(summary["results"], [3, 7]):
+        single = Simulation(seed=seed, population=True, batched=True, **options).run()
+        assert result["seed"] == seed
+        for name in METRICS:
+            assert result[name] == pytest.approx(single[name], rel=1e-9)
+
+
+def test_statistics_merge_batches():
+    samples = np.random.default_rng(1).normal(size=(9, len(METRICS)))
+    statistics = RunningStatistics()
+    for batch in np.array_split(samples, 3):
+        statistics.update(batch)
+    np.testing.assert_allclose(statistics.mean, samples.mean(axis=0))
+    np.testing.assert_allclose(statistics.std(), samples.std(axis=0, ddof=1))
+    assert np.all(statistics.interval(0.99) > statistics.interval(0.9))
+
+
+def test_batches_give_the_same_statistics():
+    options = dict(mode="HEURISTIC", **OPTIONS)
+    together = run_replicas([1, 2, 3], **options)
+    batched = run_replicas([1, 2, 3], batch_size=2, **options)
+    assert batched["results"] == pytest.approx(together["results"], rel=1e-9)
+    for name in METRICS:
+        assert batched["statistics"][name] == pytest.approx(
+            together["statistics"][name], rel=1e-9
+        )
+
+
+@pytest.mark.parametrize("option", [{"seed": 1}, {"incremental": 0.01}])
+def test_unsupported_options_are_rejected(option):
+    with pytest.raises(ValueError):
+        ReplicaSimulation([1, 2], **option)
@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_game(output_dir, *options) -> bool:
+    # Runs a 1-slot game.py in a fresh interpreter and returns whether it
+    # loaded matplotlib
+    argv = ["game.py", "--slots", "1", "--generations", "10"]
+    argv += ["--output_dir", str(output_dir), *options]
+    statement = (
+        "import runpy, sys; "
+        f"sys.argv = {argv!r}; "
+        "runpy.run_path('game.py', run_name='__main__'); "
+        "print('matplotlib' in sys.modules)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", statement],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "MPLBACKEND": "Agg"},
+    )
+    return result.stdout.split()[-1] == "True"
+
+
+def test_headless_run_never_loads_matplotlib(tmp_path):
+    assert not run_game(tmp_path, "--no_plots")
+    assert os.listdir(tmp_path) == []
+
+
+def test_figures_load_matplotlib(tmp_path):
+    assert run_game(tmp_path)
+    assert os.listdir(tmp_path)
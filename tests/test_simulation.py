@@ -0,0 +1,95 @@
+import random
+
+import numpy as np
+import pytest
+
+from simulation import MODES, Simulation
+from user import User
+
+
+def test_step_advances_one_slot():
+    simulation = Simulation(mode="HEURISTIC", slots=3, generations=10)
+    result = simulation.step()
+    assert result["slot"] == simulation.slot == 1
+    assert result["buyers"] + result["sellers"] == len(simulation.users) == 10
+    assert result["iterations"] == len(simulation.price_rec)
+    summary = simulation.run()
+    assert summary["slots"] == 3
+    assert len(summary["users"]) == 10
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_runs_are_reproducible(mode):
+    options = dict(mode=mode, slots=3, generations=10, seed=7)
+    assert Simulation(**options).run() == Simulation(**options).run()
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        Simulation(mode="ORACLE")
+
+
+def test_future_next_loss_reads_the_users_own_loss():
+    simulation = Simulation(mode="FUTURE", slots=2, generations=10)
+    simulation.run()
+    users = simulation.users
+    for user in users:
+        user.last_loss = float(user.id)
+    assert [user.next_loss() for user in users] == [10.0 * user.id for user in users]
+
+
+def test_simulations_do_not_share_streams():
+    options = dict(mode="RANDOM", slots=4, generations=10, seed=7)
+    alone = Simulation(**options).run()
+    # Interleaved with another simulation and draws from the random module
+    first = Simulation(**options)
+    second = Simulation(**{**options, "seed": 8})
+    random.seed(0)
+    second.run(2)
+    random.random()
+    assert first.run() == alone
+
+
+def test_numpy_users_can_be_generated_in_shards():
+    simulation = Simulation(slots=1, generations=10, seed=7, demand_rng="numpy")
+    # The user at position 3 only depends on the seed and its position
+    rng = np.random.default_rng(np.random.SeedSequence(7, spawn_key=(3,)))
+    user = User(4, "HB", 10, rng)
+    shard = simulation.users[3]
+    assert (user.x, user.y, user.emp_buffer) == (shard.x, shard.y, shard.emp_buffer)
+    np.testing.assert_array_equal(user.demand, shard.demand)
+
+
+def test_equilibrium_gap_is_recorded_per_slot():
+    options = dict(
+        mode="FUTURE", slots=5, generations=10, seed=7, price_update="secant"
+    )
+    summary = Simulation(step_size=1e-6, **options).run()
+    simulation = Simulation(step_size=1e-6, equilibrium_gap=True, **options)
+    # Measuring the gaps does not change the run
+    assert simulation.run() == summary
+    gaps = simulation.equilibrium_gap_rec.values()
+    assert len(gaps) == simulation.iteration_rec.count
+    assert np.all(gaps >= 0)
+    assert simulation.excess_demand_rec.count == len(gaps)
+
+
+@pytest.mark.parametrize("population", [False, True])
+def test_equilibrium_tolerance_bounds_every_slot(population):
+    simulation = Simulation(
+        mode="FUTURE",
+        slots=5,
+        generations=10,
+        seed=7,
+        population=population,
+        batched=population,
+        equilibrium_tolerance=1e-3,
+    )
+    simulation.run()
+    gaps = simulation.equilibrium_gap_rec.values()
+    assert len(gaps) == 5 and np.all(gaps <= 1e-3)
+    # The slots clear at the price the last bids induce
+    assert simulation.excess_demand_rec.maximum < 1e-6
+    assert len(simulation.gap_rec) == simulation.iteration_rec.total
+    with pytest.raises(ValueError):
+        Simulation(incremental=0.01, equilibrium_tolerance=1e-3)
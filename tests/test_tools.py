@@ -0,0 +1,180 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from tools import (
+    apportion,
+    batched_bids_as_buyer,
+    batched_bids_as_seller,
+    calculate_social_welfare,
+    equilibrium_gaps,
+    largest_remainder_method,
+    optimal_bidding,
+    random_roles,
+    settle,
+    user_parameters,
+)
+from user import User
+
+
+def make_market(seed=None):
+    rng = random.Random(seed)
+    users = [User(i, "HB", 10, rng) for i in range(1, 6)]
+    users += [User(i, "LR", 10, rng) for i in range(6, 11)]
+    for u in users:
+        u.update()
+        u.is_buyer = u.type == "LR"
+    buyers = [u for u in users if u.is_buyer]
+    sellers = [u for u in users if not u.is_buyer]
+    return buyers, sellers
+
+
+def test_batched_bids_match_scalar_solver():
+    buyers, sellers = make_market()
+    total_supply = float(sum(s.assigned_blocks for s in sellers))
+    for price in [0.5, 1.095, 2.0]:
+        bids = batched_bids_as_buyer(user_parameters(buyers), price, total_supply)
+        for buyer, bid in zip(buyers, bids):
+            buyer.find_optimal_bid_as_buyer(price, total_supply)
+            assert bid == pytest.approx(buyer.bid, rel=1e-9, abs=1e-9)
+        bids = batched_bids_as_seller(user_parameters(sellers), price, total_supply)
+        for seller, bid in zip(sellers, bids):
+            seller.find_optimal_bid_as_seller(price, total_supply)
+            assert bid == pytest.approx(seller.bid, rel=1e-9, abs=1e-9)
+
+
+def test_batched_bidding_matches_scalar():
+    buyers, sellers = make_market()
+    scalar = optimal_bidding(buyers, sellers, 1.095, 1e-7)
+    scalar_bids = [u.bid for u in buyers + sellers]
+    batched = optimal_bidding(buyers, sellers, 1.095, 1e-7, batched=True)
+    assert batched[0] == pytest.approx(scalar[0], rel=1e-9)
+    assert len(batched[1]) == len(scalar[1])
+    np.testing.assert_allclose(
+        [u.bid for u in buyers + sellers], scalar_bids, rtol=1e-8, atol=1e-8
+    )
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_welfare_is_recorded_only_on_request(batched):
+    buyers, sellers = make_market(1)
+    result = optimal_bidding(buyers, sellers, 1.095, 1e-7, batched=batched)
+    # The last iteration's welfare from the utilities is the absolute one
+    assert len(result[4]) == len(result[1])
+    assert result[4][-1] == pytest.approx(
+        calculate_social_welfare(sellers, buyers), rel=1e-12
+    )
+    buyers, sellers = make_market(1)
+    lazy = optimal_bidding(buyers, sellers, 1.095, 1e-7, batched=batched, welfare=False)
+    assert lazy[4] == []
+    assert lazy[:4] == result[:4]
+
+
+def test_equilibrium_gaps_vanish_at_the_equilibrium():
+    buyers, sellers = make_market(2)
+    optimal_bidding(buyers, sellers, 1.095, 1e-6, price_update="secant")
+    buyer_parameters, seller_parameters = user_parameters(buyers), user_parameters(
+        sellers
+    )
+    bids = [[u.bid for u in buyers], [u.bid for u in sellers]]
+    gaps = equilibrium_gaps(buyer_parameters, seller_parameters, *bids)
+    assert max(gaps[0].max(), gaps[1].max()) < 1e-4
+    # Any user moved off its best response can gain by moving back
+    moved = int(np.argmax(bids[0]))
+    bids[0][moved] *= 1.5
+    perturbed = equilibrium_gaps(buyer_parameters, seller_parameters, *bids)
+    assert perturbed[0][moved] > 1.0
+    assert np.all(perturbed[0] >= 0) and np.all(perturbed[1] >= 0)
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_equilibrium_tolerance_stops_on_the_gap(batched):
+    iterations = []
+    for tolerance in [1e-2, 1e-6]:
+        buyers, sellers = make_market(2)
+        reports = []
+        result = optimal_bidding(
+            buyers,
+            sellers,
+            1.095,
+            1e-7,
+            batched=batched,
+            equilibrium_tolerance=tolerance,
+            diagnostics=reports.append,
+        )
+        iterations.append(len(result[1]))
+        assert len(reports) == len(result[1])
+        assert reports[-1]["gap"] <= tolerance < reports[-2]["gap"]
+        # The market clears at the price the certified bids induce
+        assert result[0] == reports[-1]["price"] == result[1][-1]
+        assert reports[-1]["excess_demand"] == pytest.approx(
+            result[2][-1] - result[3][-1]
+        )
+    assert iterations[0] < iterations[1]
+    with pytest.raises(ValueError):
+        optimal_bidding(buyers, sellers, 1.095, 1e-7, equilibrium_tolerance=0.0)
+
+
+def test_largest_remainder_method_keeps_the_rounded_total():
+    values = [0.4, 1.6, 2.5, -0.3, 7.75]
+    rounded = largest_remainder_method(values)
+    assert sum(rounded) == round(sum(values))
+    assert all(abs(r - v) < 1 for r, v in zip(rounded, values))
+    assert largest_remainder_method([]) == []
+
+
+def sorted_largest_remainders(values):
+    # The largest remainder method with a stable sort, ties to the first
+    integers = [math.floor(value) for value in values]
+    missing = round(sum(values)) - sum(integers)
+    order = sorted(
+        range(len(values)), key=lambda i: values[i] - integers[i], reverse=True
+    )
+    for i in order[:missing]:
+        integers[i] += 1
+    return integers
+
+
+def test_apportion_matches_a_full_sort():
+    rng = random.Random(4)
+    for _ in range(200):
+        # Repeated remainders exercise the tie-breaking
+        values = [
+            rng.choice([0.5, 1.5, -2.5, 3.25, rng.uniform(-9, 9)])
+            for _ in range(rng.randint(1, 20))
+        ]
+        assert apportion(np.array(values)).tolist() == sorted_largest_remainders(values)
+        groups = np.array([rng.randrange(3) for _ in values])
+        rounded = apportion(np.array(values), np.unique(groups, return_inverse=True)[1])
+        for group in set(groups.tolist()):
+            index = np.flatnonzero(groups == group)
+            assert rounded[index].tolist() == sorted_largest_remainders(
+                [values[i] for i in index]
+            )
+
+
+def test_settled_trades_balance_up_to_the_excess_demand():
+    rng = np.random.default_rng(2)
+    bids = rng.uniform(1e3, 1e5, 1001)
+    assigned_blocks = rng.integers(100, 5000, 1001).astype(float)
+    is_buyer = rng.random(1001) < 0.5
+    buyer_index, seller_index = np.flatnonzero(is_buyer), np.flatnonzero(~is_buyer)
+    trades = settle(bids, 1.05, assigned_blocks, buyer_index, seller_index)
+    amounts = bids / 1.05 - np.where(is_buyer, 0.0, assigned_blocks)
+    np.testing.assert_array_equal(trades, np.round(trades))
+    assert trades[buyer_index].sum() == round(amounts[buyer_index].sum())
+    assert trades[seller_index].sum() == round(amounts[seller_index].sum())
+    assert abs(trades.sum() - amounts.sum()) <= 1.0
+    assert np.all(np.abs(trades - amounts) < 1.0)
+
+
+def test_random_roles_pick_half_of_the_users():
+    for count in [0, 1, 7, 10]:
+        assert random_roles(count, np.random.default_rng(1)).sum() == count // 2
+    # A random.Random picks the buyers its sample() picks
+    roles = random_roles(10, random.Random(3))
+    assert sorted(np.flatnonzero(roles).tolist()) == sorted(
+        random.Random(3).sample(range(10), 5)
+    )
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from simulation import Simulation
+from traces import Trace
+
+
+@pytest.mark.parametrize("mode", ["STATIC", "FUTURE"])
+def test_trace_round_trip(tmp_path, mode):
+    simulation = Simulation(
+        mode, 12, 1e-6, 20, record="summary", trace_dir=str(tmp_path)
+    )
+    summary = simulation.run()
+    trace = Trace(str(tmp_path))
+
+    assert trace.slots == 12
+    restored = trace.summary()
+    for key in ["slots", "loss_counter", "waste_counter", "iterations"]:
+        assert restored[key] == summary[key]
+    for key in ["loss_amount", "waste_amount", "total_welfare", "min_welfare"]:
+        assert restored[key] == pytest.approx(summary[key], rel=1e-12)
+    for restored_user, user in zip(restored["users"], summary["users"]):
+        assert restored_user["id"] == user["id"]
+        assert restored_user["loss_counter"] == user["loss_counter"]
+        assert restored_user["utility"] == pytest.approx(user["utility"], rel=1e-12)
+
+    prices = simulation.clr_price_rec.values() if mode != "STATIC" else np.zeros(12)
+    np.testing.assert_array_equal(trace.column("clearing_price"), prices)
+    for restored_user, user in zip(trace.users(), simulation.users):
+        np.testing.assert_array_equal(
+            restored_user.emp_buffer_rec, user.emp_buffer_rec.values()
+        )
+        np.testing.assert_array_equal(
+            restored_user.expected_price_rec, user.expected_price_rec.values()
+        )
+
+
+def test_unknown_column(tmp_path):
+    Simulation("STATIC", 1, 1e-6, 5, trace_dir=str(tmp_path)).run()
+    with pytest.raises(ValueError):
+        Trace(str(tmp_path)).column("bids")
@@ -0,0 +1,46 @@
+import pytest
+
+import user
+from user import User, check_payoff_engine, set_payoff_engine
+
+
+@pytest.fixture
+def market():
+    # The sample market of python user.py, HB sellers and LR buyers
+    users = [User(i, "HB", 10) for i in range(1, 6)]
+    users += [User(i, "LR", 10) for i in range(6, 11)]
+    for u in users:
+        u.update()
+        u.is_buyer = u.type == "LR"
+    total_supply = sum(u.assigned_blocks for u in users if not u.is_buyer)
+    return users, total_supply
+
+
+@pytest.mark.parametrize("price", [0.5, 1.095, 2.0])
+def test_payoff_engines_agree(market, price):
+    users, total_supply = market
+    assert check_payoff_engine(users, price, total_supply) <= 1e-6
+
+
+def test_check_payoff_engine_restores_engine(market):
+    users, total_supply = market
+    set_payoff_engine("analytic")
+    check_payoff_engine(users, 1.095, total_supply)
+    assert user.PAYOFF_ENGINE == "analytic"
+    with pytest.raises(ValueError):
+        check_payoff_engine(users, 1.095, total_supply, rtol=-1.0)
+    assert user.PAYOFF_ENGINE == "analytic"
+
+
+def test_utility_area_matches_quad(market):
+    users, _ = market
+    for u in users:
+        for lower, upper in [(0.0, 100.0), (-1000.0, 0.0), (0.0, 20000.0)]:
+            assert u.utility_area(lower, upper, "analytic") == pytest.approx(
+                u.utility_area(lower, upper, "quad"), rel=1e-8
+            )
+
+
+def test_unknown_payoff_engine():
+    with pytest.raises(ValueError):
+        set_payoff_engine("simpson")
@@ -1,5 +1,10 @@
 import math
 
+import numpy as np
+
+from pricing import make_price_update
+from profiling import count, instrument
+
 
 def largest_remainder_method(values: list[float]) -> list[int]:
     """
@@ -14,40 +19,113 @@ def largest_remainder_method(values: list[float]) -> list[int]:
     Returns:
         A list of integers representing the apportioned values.
     """
-    if not values:
+    if not len(values):
         return []
+    return apportion(np.asarray(values, dtype=float)).astype(np.int64).tolist()
 
-    # --- 1. Calculate the Target Total Integer Amount ---
-    # Round the total sum of the original values to the nearest integer.
-    total_value = sum(values)
-    target_sum = round(total_value)
 
-    # --- 2. Initial Allocation (Floor) & Calculate Remainders ---
-    integer_parts = [math.floor(v) for v in values]
-    # Store remainders along with their original index to track them
-    remainders = [(v - math.floor(v), i) for i, v in enumerate(values)]
+def apportion(values: np.ndarray, groups: np.ndarray = None) -> np.ndarray:
+    """
+    Vectorized largest remainder method, rounding values to integers that
+    keep the rounded total of every group.
 
-    # --- 3. Calculate Initial Sum ---
-    current_sum = sum(integer_parts)
+    Every value is rounded down and the units missing from the rounded total
+    go to the largest remainders, ties to the first values, as a stable sort
+    by remainder would hand them out. A single group only needs a partial
+    selection of its largest remainders, which takes linear time; many
+    groups are ranked by a single sort.
 
-    # --- 4. Determine the Difference ---
-    difference = int(target_sum - current_sum)  # Ensure difference is integer
+    Args:
+        values (np.ndarray): The values.
+        groups (np.ndarray): The group of every value, from 0 on. All values
+            are one group by default.
+
+    Returns:
+        np.ndarray: The integers, as floats.
+    """
+    integers = np.floor(values)
+    remainders = values - integers
+    if groups is None:
+        missing = int(round(float(values.sum())) - integers.sum())
+        if missing >= len(values):
+            return integers + 1.0
+        if missing > 0:
+            # The missing-th largest remainder, and the ties taking the rest
+            threshold = np.partition(remainders, len(values) - missing)[
+                len(values) - missing
+            ]
+            larger = remainders > threshold
+            ties = np.flatnonzero(remainders == threshold)
+            integers += larger
+            integers[ties[: missing - np.count_nonzero(larger)]] += 1.0
+        return integers
+    sizes = np.bincount(groups)
+    missing = np.round(np.bincount(groups, weights=values)) - np.bincount(
+        groups, weights=integers
+    )
+    # The rank of every remainder within its group, ties by position
+    order = np.lexsort((-remainders, groups))
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[order] = np.arange(len(values)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return integers + (ranks < missing[groups])
 
-    # --- 5. Distribute Remaining Units ---
-    # Sort indices based on remainders in descending order.
-    # If remainders are equal, the original order (index) is preserved,
-    # which acts as a simple tie-breaker.
-    remainders.sort(key=lambda x: x[0], reverse=True)
 
-    # Distribute the difference by adding 1 to the integer parts
-    # corresponding to the largest remainders.
-    for i in range(difference):
-        # Get the index of the item with the i-th largest remainder
-        index_to_increment = remainders[i][1]
-        integer_parts[index_to_increment] += 1
+def random_roles(count: int, rng) -> np.ndarray:
+    """
+    Draws the roles of the RANDOM mode, half of the users buy.
+
+    Args:
+        count (int): The number of users.
+        rng: A NumPy Generator, drawn from in a single vectorized call, or a
+            random.Random, whose sample() picks the buyers as the original
+            code did.
 
-    # --- 6. Return the final integer allocations ---
-    return integer_parts
+    Returns:
+        np.ndarray: Whether every user is a buyer.
+    """
+    is_buyer = np.zeros(count, dtype=bool)
+    if isinstance(rng, np.random.Generator):
+        is_buyer[rng.choice(count, count // 2, replace=False)] = True
+    else:
+        is_buyer[rng.sample(range(count), count // 2)] = True
+    return is_buyer
+
+
+def settle(
+    bids: np.ndarray,
+    price: float,
+    assigned_blocks: np.ndarray,
+    buyer_index: np.ndarray,
+    seller_index: np.ndarray,
+) -> np.ndarray:
+    """
+    Rounds the trades of the last bids at the clearing price to whole RBs,
+    the buyers' and the sellers' apportioned separately by the largest
+    remainder method.
+
+    Args:
+        bids (np.ndarray): The last bid of every user.
+        price (float): The clearing price.
+        assigned_blocks (np.ndarray): The RBs assigned to every user.
+        buyer_index (np.ndarray): The positions of the buyers.
+        seller_index (np.ndarray): The positions of the sellers.
+
+    Returns:
+        np.ndarray: The whole RBs every user buys, negative when sold. The
+            buyers' total is their rounded total and so is the sellers', so
+            the RBs bought and sold differ by at most one more than the
+            excess demand at the last bids.
+    """
+    # Positions rather than masks, which are several times slower to gather
+    trades = np.empty(len(bids))
+    amounts = bids[buyer_index]
+    amounts /= price
+    trades[buyer_index] = apportion(amounts)
+    amounts = bids[seller_index]
+    amounts /= price
+    amounts -= assigned_blocks[seller_index]
+    trades[seller_index] = apportion(amounts)
+    return trades
 
 
 def calculate_initial_welfare(sellers, buyers) -> float:
@@ -59,6 +137,7 @@ def calculate_initial_welfare(sellers, buyers) -> float:
     return social_welfare
 
 
+@instrument()
 def calculate_social_welfare(sellers, buyers) -> float:
     social_welfare = 0.0
     for buyer in buyers:
@@ -68,61 +147,721 @@ def calculate_social_welfare(sellers, buyers) -> float:
     return social_welfare
 
 
-def optimal_bidding(buyers, sellers, initial_price, step_size):
+def user_parameters(users) -> dict:
+    """
+    Collects the parameters of the users' payoffs into arrays.
+
+    Args:
+        users: The users, in the order of the returned arrays.
+
+    Returns:
+        A dict of arrays with the willingness to keep, the rate factor, the
+        buffer term (max_buffer - next_loss) and the assigned blocks.
+    """
+    return {
+        "willingness": np.array([user.willingness_to_keep for user in users]),
+        "rate_factor": np.array([user.rate_factor for user in users]),
+        "buffer": np.array([user.max_buffer - user.next_loss() for user in users]),
+        "assigned_blocks": np.array([user.assigned_blocks for user in users]),
+    }
+
+
+def last_bids(users) -> np.ndarray:
+    # The users' last bids as warm-start guesses, NaN where there is none
+    return np.array([np.nan if user.bid is None else user.bid for user in users])
+
+
+def batched_utility(parameters: dict, demand: np.ndarray) -> np.ndarray:
+    # Vectorized User.utility, w * (sqrt(a * x + b) - sqrt(b))
+    a, b = parameters["rate_factor"], parameters["buffer"]
+    return (
+        parameters["willingness"] * a * demand / (np.sqrt(demand * a + b) + np.sqrt(b))
+    )
+
+
+def batched_marginal_utility(parameters: dict, demand: np.ndarray) -> np.ndarray:
+    # Vectorized User.marginal_utility
+    a, b = parameters["rate_factor"], parameters["buffer"]
+    return 0.5 * parameters["willingness"] * a / np.sqrt(demand * a + b)
+
+
+def batched_utility_area(parameters: dict, demand: np.ndarray) -> np.ndarray:
+    # Vectorized User.utility_area over [0, demand]
+    a, b = parameters["rate_factor"], parameters["buffer"]
+    s0, s1 = np.sqrt(b), np.sqrt(demand * a + b)
+    return (
+        parameters["willingness"] * a * demand**2 * (2 * s1 + s0) / (3 * (s1 + s0) ** 2)
+    )
+
+
+def batched_payoff_as_buyer(parameters, bids, price, total_supply) -> np.ndarray:
+    # Vectorized User.payoff_as_buyer
+    amounts = bids / price
+    return (
+        (1 - (amounts / total_supply)) * batched_utility(parameters, amounts)
+        + batched_utility_area(parameters, amounts) / total_supply
+        - bids
+    )
+
+
+def batched_payoff_as_seller(parameters, bids, price, total_supply) -> np.ndarray:
+    # Vectorized User.payoff_as_seller
+    assigned_blocks = parameters["assigned_blocks"]
+    amounts = assigned_blocks - bids / price
+    others = total_supply - assigned_blocks
+    return (
+        assigned_blocks * price
+        - bids
+        + (1 + (amounts / others)) * batched_utility(parameters, -amounts)
+        - batched_utility_area(parameters, -amounts) / others
+    )
+
+
+def batched_payoff_gradient_as_buyer(
+    parameters, bids, price, total_supply
+) -> np.ndarray:
+    # Vectorized User.payoff_gradient_as_buyer
+    amounts = bids / price
+    return (
+        (1 - (amounts / total_supply)) * batched_marginal_utility(parameters, amounts)
+        - price
+    ) / price
+
+
+def batched_payoff_gradient_as_seller(
+    parameters, bids, price, total_supply
+) -> np.ndarray:
+    # Vectorized User.payoff_gradient_as_seller
+    amounts = parameters["assigned_blocks"] - bids / price
+    others = total_supply - parameters["assigned_blocks"]
+    return (
+        -(
+            price
+            + 2 * batched_utility(parameters, -amounts) / others
+            - (1 + (amounts / others)) * batched_marginal_utility(parameters, -amounts)
+        )
+        / price
+    )
+
+
+@instrument()
+def batched_first_order_condition(
+    gradient, upper_bounds: np.ndarray, guesses: np.ndarray = None, width=1e-2
+) -> np.ndarray:
+    """
+    Solves the first-order conditions of many concave payoffs at once.
+
+    Each payoff is maximized over [0, upper_bound]: the optimum is a bound if
+    the gradient does not change sign, otherwise the root of the gradient is
+    found by bisection on all users together.
+
+    Args:
+        gradient: Vectorized gradient of the payoffs with respect to the bids.
+        upper_bounds: The upper bounds of the bids.
+        guesses: Optional warm-start bids, e.g. from the previous iteration.
+            The bisection starts from [guess * (1 - width), guess * (1 + width)]
+            wherever that interval brackets the root.
+        width: The relative half-width of the warm-start brackets.
+
+    Returns:
+        The optimal bids.
+    """
+    lower = np.zeros_like(upper_bounds, dtype=float)
+    upper = np.array(upper_bounds, dtype=float)
+    at_lower = gradient(lower) <= 0
+    at_upper = gradient(upper) >= 0
+    if guesses is not None:
+        guess_lower = np.clip(guesses * (1 - width), lower, upper)
+        guess_upper = np.clip(guesses * (1 + width), lower, upper)
+        bracketed = (gradient(guess_lower) > 0) & (gradient(guess_upper) < 0)
+        lower = np.where(bracketed, guess_lower, lower)
+        upper = np.where(bracketed, guess_upper, upper)
+    # Same tolerance as scipy.optimize.brentq
+    for _ in range(200):
+        middle = 0.5 * (lower + upper)
+        if np.all(upper - lower <= 2e-12 + 8.9e-16 * np.abs(middle)):
+            break
+        increasing = gradient(middle) > 0
+        lower = np.where(increasing, middle, lower)
+        upper = np.where(increasing, upper, middle)
+    bids = 0.5 * (lower + upper)
+    bids[at_upper] = upper_bounds[at_upper]
+    bids[at_lower] = 0.0
+    return bids
+
+
+def batched_bids_as_buyer(
+    parameters: dict, price, total_supply, guesses=None
+) -> np.ndarray:
+    # Vectorized User.find_optimal_bid_as_buyer
+    return batched_first_order_condition(
+        lambda bids: batched_payoff_gradient_as_buyer(
+            parameters, bids, price, total_supply
+        ),
+        np.full(len(parameters["buffer"]), total_supply * price),
+        guesses,
+    )
+
+
+def batched_bids_as_seller(
+    parameters: dict, price, total_supply, guesses=None
+) -> np.ndarray:
+    # Vectorized User.find_optimal_bid_as_seller
+    return batched_first_order_condition(
+        lambda bids: batched_payoff_gradient_as_seller(
+            parameters, bids, price, total_supply
+        ),
+        parameters["assigned_blocks"] * price,
+        guesses,
+    )
+
+
+@instrument()
+def clearing_price(
+    buyer_parameters: dict,
+    seller_parameters: dict,
+    initial_price,
+    step_size,
+    price_update="gradient",
+    tolerance=None,
+):
+    """
+    Runs the price iteration of optimal_bidding on the users' parameter arrays
+    only, leaving the users untouched.
+
+    Returns:
+        The market clearing price and the number of iterations.
+    """
+    if tolerance is None:
+        tolerance = 5.0 * step_size
+    update_price = make_price_update(price_update, step_size)
+    total_supply = float(seller_parameters["assigned_blocks"].sum())
+    market_price = initial_price
+    iterations = 0
+    delta_price = 100
+    while abs(delta_price) > tolerance:
+        iterations += 1
+        count("price_iterations")
+        total_bid = float(
+            batched_bids_as_buyer(buyer_parameters, market_price, total_supply).sum()
+            + batched_bids_as_seller(
+                seller_parameters, market_price, total_supply
+            ).sum()
+        )
+        next_price = update_price(market_price, total_supply - total_bid / market_price)
+        delta_price = next_price - market_price
+        market_price = next_price
+    return market_price, iterations
+
+
+@instrument()
+def clearing_prices(
+    buyer_parameters: dict,
+    seller_parameters: dict,
+    buyer_markets: np.ndarray,
+    seller_markets: np.ndarray,
+    initial_prices,
+    step_size,
+    price_update="gradient",
+    tolerance=None,
+    record=None,
+):
+    """
+    Runs clearing_price for many independent markets at once.
+
+    The price iterations of all markets run in lockstep, and the best
+    responses of the users of all markets still iterating are solved in one
+    batched call per role, with every user at the price of its market.
+
+    Args:
+        buyer_parameters: The parameters of the buyers of all markets.
+        seller_parameters: The parameters of the sellers of all markets.
+        buyer_markets: The market of every buyer, an index into initial_prices.
+        seller_markets: The market of every seller.
+        initial_prices: The market price of the first iteration per market.
+        step_size: The step of the gradient price update.
+        price_update: The price update strategy, a key of pricing.PRICE_UPDATES.
+        tolerance: See clearing_price.
+        record: Called after every iteration with a dict of the buyers' and
+            one of the sellers' "index", the positions of the users whose
+            markets are still iterating, and their "bids", "payoffs" and
+            "utilities".
+
+    Returns:
+        The market clearing prices and the numbers of iterations per market.
+    """
+    if tolerance is None:
+        tolerance = 5.0 * step_size
+    markets = len(initial_prices)
+    updates = [make_price_update(price_update, step_size) for _ in range(markets)]
+    total_supply = np.bincount(
+        seller_markets, weights=seller_parameters["assigned_blocks"], minlength=markets
+    )
+    prices = np.array(initial_prices, dtype=float)
+    iterations = np.zeros(markets, dtype=int)
+    active = np.ones(markets, dtype=bool)
+    while active.any():
+        iterations[active] += 1
+        total_bid = np.zeros(markets)
+        rounds = []
+        for parameters, user_markets, is_buyer in [
+            (buyer_parameters, buyer_markets, True),
+            (seller_parameters, seller_markets, False),
+        ]:
+            iterating = active[user_markets]
+            user_markets = user_markets[iterating]
+            parameters = {name: value[iterating] for name, value in parameters.items()}
+            price, supply = prices[user_markets], total_supply[user_markets]
+            if is_buyer:
+                bids = batched_bids_as_buyer(parameters, price, supply)
+            else:
+                bids = batched_bids_as_seller(parameters, price, supply)
+            total_bid += np.bincount(user_markets, weights=bids, minlength=markets)
+            if record is not None:
+                if is_buyer:
+                    amounts = bids / price
+                    payoffs = batched_payoff_as_buyer(parameters, bids, price, supply)
+                else:
+                    amounts = parameters["assigned_blocks"] - bids / price
+                    payoffs = batched_payoff_as_seller(parameters, bids, price, supply)
+                rounds.append(
+                    {
+                        "index": np.flatnonzero(iterating),
+                        "bids": bids,
+                        "payoffs": payoffs,
+                        "utilities": batched_utility(parameters, amounts),
+                    }
+                )
+        if record is not None:
+            record(*rounds)
+        for market in np.flatnonzero(active).tolist():
+            price = float(prices[market])
+            next_price = updates[market](
+                price, float(total_supply[market]) - float(total_bid[market]) / price
+            )
+            active[market] = abs(next_price - price) > tolerance
+            prices[market] = next_price
+    return prices, iterations
+
+
+def requested_amount(buyer_parameters: dict, price, total_supply) -> float:
+    # Total amount of RBs the buyers request at the given price
+    return float(
+        batched_bids_as_buyer(buyer_parameters, price, total_supply).sum() / price
+    )
+
+
+@instrument()
+def equilibrium_gaps(
+    buyer_parameters: dict, seller_parameters: dict, buyer_bids, seller_bids
+) -> tuple:
+    """
+    Measures how far bids are from a Nash equilibrium of the market.
+
+    The bids induce the price at which they clear the market, their total
+    over the total supply. A user's gap is the payoff it would gain at that
+    price by its best response instead of its bid. The gaps are all zero
+    exactly at an equilibrium, so the largest gap certifies how close to one
+    the bids are, in the units of the payoffs.
+
+    Args:
+        buyer_parameters (dict): The parameters of the buyers, see
+            user_parameters.
+        seller_parameters (dict): The parameters of the sellers.
+        buyer_bids: The bids of the buyers.
+        seller_bids: The bids of the sellers.
+
+    Returns:
+        tuple: The gaps of the buyers and of the sellers, and the price the
+            bids induce. The gaps are infinite if no one bids.
+    """
+    buyer_bids = np.asarray(buyer_bids, dtype=float)
+    seller_bids = np.asarray(seller_bids, dtype=float)
+    total_supply = float(seller_parameters["assigned_blocks"].sum())
+    price = (float(buyer_bids.sum()) + float(seller_bids.sum())) / total_supply
+    if price <= 0:
+        return np.full(len(buyer_bids), np.inf), np.full(len(seller_bids), np.inf), 0.0
+    gaps = []
+    for parameters, bids, bids_as, payoff_as in [
+        (buyer_parameters, buyer_bids, batched_bids_as_buyer, batched_payoff_as_buyer),
+        (
+            seller_parameters,
+            seller_bids,
+            batched_bids_as_seller,
+            batched_payoff_as_seller,
+        ),
+    ]:
+        # The bids are close to the best responses, which start around them
+        best = bids_as(parameters, price, total_supply, bids)
+        gap = payoff_as(parameters, best, price, total_supply) - payoff_as(
+            parameters, bids, price, total_supply
+        )
+        # A bid that is already the best response loses only rounding
+        gaps.append(np.maximum(gap, 0.0))
+    return gaps[0], gaps[1], price
+
+
+@instrument()
+def user_equilibrium_gaps(buyers, sellers) -> tuple:
+    """
+    Computes equilibrium_gaps from the users' last bids with their own
+    solvers and payoffs, which for a few users is faster than batching.
+    The users' bids are left as they are.
+
+    Returns:
+        tuple: As equilibrium_gaps.
+    """
+    total_supply = float(sum(seller.assigned_blocks for seller in sellers))
+    price = (
+        sum(buyer.bid for buyer in buyers) + sum(seller.bid for seller in sellers)
+    ) / total_supply
+    if price <= 0:
+        return np.full(len(buyers), np.inf), np.full(len(sellers), np.inf), 0.0
+    gaps = []
+    for users in (buyers, sellers):
+        role_gaps = []
+        for user in users:
+            if user.is_buyer:
+                payoff = user.payoff_as_buyer
+                find_optimal_bid = user.find_optimal_bid_as_buyer
+            else:
+                payoff = user.payoff_as_seller
+                find_optimal_bid = user.find_optimal_bid_as_seller
+            bid = user.bid
+            find_optimal_bid(price, total_supply, bid)
+            gap = payoff(user.bid, price, total_supply) - payoff(
+                bid, price, total_supply
+            )
+            role_gaps.append(max(gap, 0.0))
+            user.bid = bid
+        gaps.append(np.array(role_gaps))
+    return gaps[0], gaps[1], price
+
+
+def _diagnose(gaps: tuple, excess_demand: float, report) -> tuple:
+    # The largest of an iteration's gaps and the price its bids induce,
+    # passed on to the diagnostics callback if any
+    buyer_gaps, seller_gaps, price = gaps
+    gap = max(float(buyer_gaps.max(initial=0.0)), float(seller_gaps.max(initial=0.0)))
+    if report is not None:
+        report(
+            {
+                "buyer_gaps": buyer_gaps,
+                "seller_gaps": seller_gaps,
+                "gap": gap,
+                "excess_demand": excess_demand,
+                "price": price,
+            }
+        )
+    return gap, price
+
+
+def _equilibrium_step(gap, equilibrium_tolerance, induced_price, next_price, delta):
+    # The next price and the price change the loops stop on with an
+    # equilibrium tolerance: the price the bids induce once their gap is
+    # within it, and otherwise the update, unless the price no longer moves
+    # and so neither can the bids
+    if gap <= equilibrium_tolerance:
+        return induced_price, 0.0
+    if delta == 0:
+        return next_price, 0.0
+    return next_price, math.inf
+
+
+@instrument()
+def batched_optimal_bidding(
+    buyer_parameters: dict,
+    seller_parameters: dict,
+    initial_price,
+    step_size,
+    price_update="gradient",
+    tolerance=None,
+    buyer_bids=None,
+    seller_bids=None,
+    record=None,
+    welfare=True,
+    equilibrium_tolerance=None,
+    diagnostics=None,
+):
+    """
+    Runs the iterations of optimal_bidding with batched best responses on the
+    users' parameter arrays, leaving the users untouched.
+
+    Args:
+        buyer_parameters: The parameters of the buyers, see user_parameters.
+        seller_parameters: The parameters of the sellers.
+        initial_price: The market price of the first iteration.
+        step_size: The step of the gradient price update.
+        price_update: The price update strategy, a key of pricing.PRICE_UPDATES.
+        tolerance: See optimal_bidding.
+        buyer_bids: The bids the buyers' first best response searches start
+            around, and those of the previous iteration after that. None
+            searches every best response cold.
+        seller_bids: The same for the sellers.
+        record: Called after every iteration with a dict of the buyers' and
+            one of the sellers' "bids", "amounts", "payoffs" and "utilities".
+        welfare: See optimal_bidding.
+        equilibrium_tolerance: See optimal_bidding.
+        diagnostics: See optimal_bidding.
+
+    Returns:
+        The market clearing price, the per-iteration records of price,
+        demand, supply and social welfare, and the last bids of the buyers
+        and of the sellers.
+
+    Raises:
+        ValueError: If the equilibrium tolerance is not positive.
+    """
+    if equilibrium_tolerance is not None and not equilibrium_tolerance > 0:
+        raise ValueError("The equilibrium tolerance must be positive")
+    if tolerance is None:
+        tolerance = 5.0 * step_size
+    update_price = make_price_update(price_update, step_size)
+    total_supply = float(seller_parameters["assigned_blocks"].sum())
+    if welfare:
+        # The welfare without trade, to which each iteration adds the utilities
+        base_welfare = sum(
+            float(np.sum(parameters["willingness"] * np.sqrt(parameters["buffer"])))
+            for parameters in (buyer_parameters, seller_parameters)
+        )
+    market_price = initial_price
+    local_price_rec = []
+    local_demand_rec = []
+    local_supply_rec = []
+    local_welfare_rec = []
+    delta_price = 100
+    while abs(delta_price) > tolerance:
+        count("price_iterations")
+        bids = batched_bids_as_buyer(
+            buyer_parameters, market_price, total_supply, buyer_bids
+        )
+        buyer_rounds = {"bids": bids, "amounts": bids / market_price}
+        bids = batched_bids_as_seller(
+            seller_parameters, market_price, total_supply, seller_bids
+        )
+        seller_rounds = {
+            "bids": bids,
+            "amounts": seller_parameters["assigned_blocks"] - bids / market_price,
+        }
+        if buyer_bids is not None:
+            buyer_bids = buyer_rounds["bids"]
+        if seller_bids is not None:
+            seller_bids = seller_rounds["bids"]
+
+        for parameters, rounds, payoff_as in [
+            (buyer_parameters, buyer_rounds, batched_payoff_as_buyer),
+            (seller_parameters, seller_rounds, batched_payoff_as_seller),
+        ]:
+            if record is not None:
+                rounds["payoffs"] = payoff_as(
+                    parameters, rounds["bids"], market_price, total_supply
+                )
+            if record is not None or welfare:
+                rounds["utilities"] = batched_utility(parameters, rounds["amounts"])
+        if welfare:
+            local_welfare_rec.append(
+                base_welfare
+                + float(buyer_rounds["utilities"].sum())
+                + float(seller_rounds["utilities"].sum())
+            )
+        if record is not None:
+            record(buyer_rounds, seller_rounds)
+
+        total_bid = float(buyer_rounds["bids"].sum()) + float(
+            seller_rounds["bids"].sum()
+        )
+        demand = float(buyer_rounds["amounts"].sum())
+        supply = float(seller_rounds["amounts"].sum())
+        if equilibrium_tolerance is not None or diagnostics is not None:
+            gap, induced_price = _diagnose(
+                equilibrium_gaps(
+                    buyer_parameters,
+                    seller_parameters,
+                    buyer_rounds["bids"],
+                    seller_rounds["bids"],
+                ),
+                demand - supply,
+                diagnostics,
+            )
+        # Stop on the price change that is actually applied
+        next_price = update_price(market_price, total_supply - total_bid / market_price)
+        delta_price = next_price - market_price
+        if equilibrium_tolerance is not None:
+            next_price, delta_price = _equilibrium_step(
+                gap, equilibrium_tolerance, induced_price, next_price, delta_price
+            )
+        market_price = next_price
+        local_price_rec.append(market_price)
+        local_demand_rec.append(demand)
+        local_supply_rec.append(supply)
+    return (
+        market_price,
+        local_price_rec,
+        local_demand_rec,
+        local_supply_rec,
+        local_welfare_rec,
+        buyer_rounds["bids"],
+        seller_rounds["bids"],
+    )
+
+
+@instrument()
+def optimal_bidding(
+    buyers,
+    sellers,
+    initial_price,
+    step_size,
+    batched=False,
+    price_update="gradient",
+    tolerance=None,
+    warm_bids=False,
+    welfare=True,
+    equilibrium_tolerance=None,
+    diagnostics=None,
+):
+    """
+    Iterates best responses and price updates until the market price settles,
+    or until the bids are within a tolerance of a Nash equilibrium.
+
+    Args:
+        buyers: The buyers of the slot.
+        sellers: The sellers of the slot.
+        initial_price: The market price of the first iteration.
+        step_size: The step of the gradient price update.
+        batched: Whether to solve all best responses together with NumPy,
+            see batched_optimal_bidding.
+        price_update: The price update strategy, a key of pricing.PRICE_UPDATES.
+        tolerance: The price change below which the market is cleared.
+            Defaults to the change of a gradient step at an excess supply of
+            5 RBs.
+        warm_bids: Whether to start each best response search around the
+            user's last bid.
+        welfare: Whether to record the social welfare of every iteration,
+            as the welfare without trade plus the users' utilities. The
+            welfare record is empty otherwise.
+        equilibrium_tolerance: Stop once the largest gap of the bids, see
+            equilibrium_gaps, is at most this instead of on the price change,
+            and clear at the price the bids induce. The gaps take one more
+            best response per user and iteration, warm started from its bid.
+            If the price stops moving first, the loop stops there.
+        diagnostics: Called after every iteration with a dict of the
+            "buyer_gaps" and "seller_gaps" of the bids, the largest "gap",
+            the "excess_demand" in RBs at the iteration's price and the
+            "price" the bids induce.
+
+    Returns:
+        The market clearing price and the per-iteration records of price,
+        demand, supply and social welfare. The number of iterations is the
+        length of the price record.
+
+    Raises:
+        ValueError: If the equilibrium tolerance is not positive.
+    """
+    if batched:
+
+        def record(buyer_rounds, seller_rounds):
+            for users, rounds in [(buyers, buyer_rounds), (sellers, seller_rounds)]:
+                for user, bid, amount, payoff, utility in zip(
+                    users,
+                    rounds["bids"].tolist(),
+                    rounds["amounts"].tolist(),
+                    rounds["payoffs"].tolist(),
+                    rounds["utilities"].tolist(),
+                ):
+                    user.bid = bid
+                    user.payoff_rec.append(payoff)
+                    user.utility_rec.append(utility)
+                    user.bid_rec.append(bid)
+                    user.trading_amount = amount
+
+        return batched_optimal_bidding(
+            user_parameters(buyers),
+            user_parameters(sellers),
+            initial_price,
+            step_size,
+            price_update,
+            tolerance,
+            last_bids(buyers) if warm_bids else None,
+            last_bids(sellers) if warm_bids else None,
+            record,
+            welfare,
+            equilibrium_tolerance,
+            diagnostics,
+        )[:5]
+
+    if equilibrium_tolerance is not None and not equilibrium_tolerance > 0:
+        raise ValueError("The equilibrium tolerance must be positive")
+    if tolerance is None:
+        tolerance = 5.0 * step_size
+    update_price = make_price_update(price_update, step_size)
     market_price = initial_price
     round_counter = 0
     local_price_rec = []
     local_demand_rec = []
     local_supply_rec = []
     local_welfare_rec = []
+    if welfare:
+        base_welfare = calculate_initial_welfare(sellers, buyers)
     delta_price = 100
     # while round_counter < 100:
-    while abs(delta_price) > 1e-5:
+    while abs(delta_price) > tolerance:
         round_counter += 1
+        count("price_iterations")
         total_bid = 0.0
         local_demand = 0.0
         local_supply = 0.0
         total_supply = 0.0
+        total_utility = 0.0
 
         for seller in sellers:
             total_supply += seller.assigned_blocks
         for buyer in buyers:
-            buyer.find_optimal_bid_as_buyer(market_price, total_supply)
+            buyer.find_optimal_bid_as_buyer(
+                market_price, total_supply, buyer.bid if warm_bids else None
+            )
             buyer.payoff_rec.append(
                 buyer.payoff_as_buyer(buyer.bid, market_price, total_supply)
             )
-            buyer.utility_rec.append(buyer.utility(buyer.bid / market_price))
+            utility = buyer.utility(buyer.bid / market_price)
+            buyer.utility_rec.append(utility)
+            total_utility += utility
             buyer.bid_rec.append(buyer.bid)
             buyer.trading_amount = buyer.bid / market_price
             total_bid += buyer.bid
             local_demand += buyer.bid / market_price
         for seller in sellers:
-            seller.find_optimal_bid_as_seller(market_price, total_supply)
+            seller.find_optimal_bid_as_seller(
+                market_price, total_supply, seller.bid if warm_bids else None
+            )
             seller.payoff_rec.append(
                 seller.payoff_as_seller(seller.bid, market_price, total_supply)
             )
-            seller.utility_rec.append(
-                seller.utility(seller.assigned_blocks - seller.bid / market_price)
-            )
+            utility = seller.utility(seller.assigned_blocks - seller.bid / market_price)
+            seller.utility_rec.append(utility)
+            total_utility += utility
             seller.bid_rec.append(seller.bid)
             seller.trading_amount = seller.assigned_blocks - seller.bid / market_price
             total_bid += seller.bid
             local_supply += seller.assigned_blocks - seller.bid / market_price
-        delta_price = (
-            max(
-                1e-2,
-                market_price - 2e-6 * (total_supply - total_bid / market_price),
+        if equilibrium_tolerance is not None or diagnostics is not None:
+            gap, induced_price = _diagnose(
+                user_equilibrium_gaps(buyers, sellers),
+                local_demand - local_supply,
+                diagnostics,
             )
-            - market_price
-        )
-        market_price = max(
-            1e-2,
-            market_price - step_size * (total_supply - total_bid / market_price),
-        )
+        # Stop on the price change that is actually applied
+        next_price = update_price(market_price, total_supply - total_bid / market_price)
+        delta_price = next_price - market_price
+        if equilibrium_tolerance is not None:
+            next_price, delta_price = _equilibrium_step(
+                gap, equilibrium_tolerance, induced_price, next_price, delta_price
+            )
+        market_price = next_price
         local_price_rec.append(market_price)
         local_demand_rec.append(local_demand)
         local_supply_rec.append(local_supply)
-        local_welfare_rec.append(calculate_social_welfare(sellers, buyers))
+        if welfare:
+            local_welfare_rec.append(base_welfare + total_utility)
     return (
         market_price,
         local_price_rec,
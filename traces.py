@@ -0,0 +1,305 @@
+import argparse
+import json
+import os
+import shutil
+from types import SimpleNamespace
+
+import numpy as np
+
+# Columns with one value per slot
+SLOT_COLUMNS = {
+    "clearing_price": "float64",
+    "welfare": "float64",
+    "iterations": "int32",
+}
+# Columns with one value per slot and user, in the order of the users
+# utility_total is the running total of the user's utility over all price
+# iterations so far, role is 1 for a buyer and 0 for a seller
+USER_COLUMNS = {
+    "emp_buffer": "float64",
+    "expected_price": "float64",
+    "rate_factor": "float64",
+    "loss": "float64",
+    "waste": "float64",
+    "trading_amount": "float64",
+    "role": "int8",
+    "utility_total": "float64",
+}
+
+
+class TraceWriter:
+    """
+    Writes the per-slot state of a simulation as a columnar store.
+
+    Every column is a raw binary file of fixed-width rows, appended every
+    chunk_size slots, and meta.json records the users, the columns and the
+    number of slots written, so the store can be memory-mapped by Trace.
+    """
+
+    def __init__(self, directory: str, users, config: dict = None, chunk_size=256):
+        """
+        Args:
+            directory (str): The folder of the store.
+            users: The users of the simulation.
+            config (dict): The configuration of the simulation, kept as is.
+            chunk_size (int): The number of slots buffered before a write.
+        """
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.slots = 0
+        self.meta = {
+            "config": config or {},
+            "users": [{"id": user.id, "type": user.type} for user in users],
+            "slot_columns": SLOT_COLUMNS,
+            "user_columns": USER_COLUMNS,
+            "slots": 0,
+        }
+        self.rows = {name: [] for name in {**SLOT_COLUMNS, **USER_COLUMNS}}
+
+        os.makedirs(directory, exist_ok=True)
+        for name in self.rows:
+            open(self._path(name), "wb").close()
+        # The state before the first slot
+        np.save(
+            os.path.join(directory, "initial_emp_buffer.npy"),
+            [user.emp_buffer for user in users],
+        )
+        np.save(
+            os.path.join(directory, "initial_expected_price.npy"),
+            [user.expected_price() for user in users],
+        )
+        self._write_meta()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name + ".bin")
+
+    def _write_meta(self) -> None:
+        self.meta["slots"] = self.slots
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=1)
+
+    def write(self, slot: dict, users) -> None:
+        """
+        Appends the state after a slot.
+
+        Args:
+            slot (dict): The result of Simulation.step().
+            users: The users of the simulation, after the slot.
+        """
+        self.rows["clearing_price"].append(slot["clearing_price"])
+        self.rows["welfare"].append(slot["welfare"])
+        self.rows["iterations"].append(slot["iterations"])
+        self.rows["emp_buffer"].append([user.emp_buffer for user in users])
+        self.rows["expected_price"].append([user.expected_price() for user in users])
+        self.rows["rate_factor"].append([user.rate_factor for user in users])
+        self.rows["loss"].append([user.last_loss for user in users])
+        self.rows["waste"].append([user.last_waste for user in users])
+        self.rows["trading_amount"].append([user.trading_amount for user in users])
+        self.rows["role"].append([user.is_buyer for user in users])
+        self.rows["utility_total"].append([user.utility_rec.total for user in users])
+        self.slots += 1
+        if len(self.rows["welfare"]) >= self.chunk_size:
+            self.flush()
+
+    def __getstate__(self) -> dict:
+        # The slots written so far, so that restore() can go back to them
+        state = self.__dict__.copy()
+        state["written"] = self.slots - len(self.rows["welfare"])
+        return state
+
+    def restore(self, directory: str = None) -> None:
+        """
+        Takes the store of an unpickled writer back to the slots written when
+        it was pickled, dropping those written since.
+
+        Args:
+            directory (str): Where the store is written to from now on, with
+                a copy of those slots. By default the writer keeps its folder.
+
+        Raises:
+            ValueError: If a column holds fewer slots than were written.
+        """
+        written = self.__dict__.pop("written")
+        users = len(self.meta["users"])
+        source = self.directory
+        moved = directory is not None and (
+            os.path.abspath(directory) != os.path.abspath(source)
+        )
+        if moved:
+            os.makedirs(directory, exist_ok=True)
+            for name in ("initial_emp_buffer.npy", "initial_expected_price.npy"):
+                shutil.copyfile(
+                    os.path.join(source, name), os.path.join(directory, name)
+                )
+            self.directory = directory
+        for name, dtype in {**SLOT_COLUMNS, **USER_COLUMNS}.items():
+            width = users if name in USER_COLUMNS else 1
+            size = written * width * np.dtype(dtype).itemsize
+            path = os.path.join(source, name + ".bin")
+            if os.path.getsize(path) < size:
+                raise ValueError(f"{path} is shorter than at the checkpoint")
+            if moved:
+                with open(path, "rb") as f, open(self._path(name), "wb") as target:
+                    target.write(f.read(size))
+            else:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        self.meta["slots"] = written
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=1)
+
+    def flush(self) -> None:
+        # Append the buffered rows to the column files
+        for name, dtype in {**SLOT_COLUMNS, **USER_COLUMNS}.items():
+            if self.rows[name]:
+                with open(self._path(name), "ab") as f:
+                    np.asarray(self.rows[name], dtype=dtype).tofile(f)
+                self.rows[name] = []
+        self._write_meta()
+
+
+class Trace:
+    """
+    Reads a store written by TraceWriter, memory-mapping its columns.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.slots = self.meta["slots"]
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Args:
+            name (str): A key of SLOT_COLUMNS or USER_COLUMNS.
+
+        Returns:
+            np.ndarray: A read-only memory map with one row per slot, and one
+                column per user for the user columns.
+
+        Raises:
+            ValueError: If the column is unknown.
+        """
+        if name in self.meta["slot_columns"]:
+            dtype, shape = self.meta["slot_columns"][name], (self.slots,)
+        elif name in self.meta["user_columns"]:
+            dtype = self.meta["user_columns"][name]
+            shape = (self.slots, len(self.meta["users"]))
+        else:
+            raise ValueError(f"Unknown column: {name}")
+        if self.slots == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(
+            os.path.join(self.directory, name + ".bin"),
+            dtype=dtype,
+            mode="r",
+            shape=shape,
+        )
+
+    def initial(self, name: str) -> np.ndarray:
+        # The users' emp_buffer or expected_price before the first slot
+        return np.load(os.path.join(self.directory, f"initial_{name}.npy"))
+
+    def users(self) -> list:
+        """
+        Returns:
+            list: One object per user with its id, type and the histories
+                emp_buffer_rec and expected_price_rec, including the initial
+                state, as reporting.plot_trends expects them.
+        """
+        users = []
+        for i, user in enumerate(self.meta["users"]):
+            users.append(
+                SimpleNamespace(
+                    id=user["id"],
+                    type=user["type"],
+                    emp_buffer_rec=np.concatenate(
+                        [
+                            self.initial("emp_buffer")[i : i + 1],
+                            self.column("emp_buffer")[:, i],
+                        ]
+                    ),
+                    expected_price_rec=np.concatenate(
+                        [
+                            self.initial("expected_price")[i : i + 1],
+                            self.column("expected_price")[:, i],
+                        ]
+                    ),
+                )
+            )
+        return users
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: The same summary as Simulation.summary().
+        """
+        loss, waste = self.column("loss"), self.column("waste")
+        welfare = self.column("welfare").tolist()
+        utility_total = self.column("utility_total")
+        users = []
+        for i, user in enumerate(self.meta["users"]):
+            user_loss, user_waste = loss[:, i].tolist(), waste[:, i].tolist()
+            users.append(
+                {
+                    "id": user["id"],
+                    "type": user["type"],
+                    "loss_counter": sum(1 for x in user_loss if x > 0),
+                    "loss_amount": sum(x for x in user_loss if x > 0),
+                    "waste_counter": sum(1 for x in user_waste if x > 0),
+                    "waste_amount": sum(x for x in user_waste if x > 0),
+                    "utility": float(utility_total[-1, i]) if self.slots else 0.0,
+                }
+            )
+        return {
+            "slots": self.slots,
+            "loss_counter": sum(user["loss_counter"] for user in users),
+            "loss_amount": sum(user["loss_amount"] for user in users),
+            "waste_counter": sum(user["waste_counter"] for user in users),
+            "waste_amount": sum(user["waste_amount"] for user in users),
+            "total_welfare": sum(welfare),
+            "min_welfare": min(welfare, default=0.0),
+            "iterations": int(self.column("iterations").sum()),
+            "users": users,
+        }
+
+    def to_npz(self, path: str) -> None:
+        # Exports all columns to a single compressed NumPy archive
+        columns = {
+            name: np.asarray(self.column(name))
+            for name in {**self.meta["slot_columns"], **self.meta["user_columns"]}
+        }
+        for name in ["emp_buffer", "expected_price"]:
+            columns["initial_" + name] = self.initial(name)
+        np.savez_compressed(path, **columns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report a saved trace")
+    parser.add_argument("trace_dir", type=str)
+    parser.add_argument(
+        "--plots",
+        type=str,
+        default=None,
+        help="save the buffer and willingness trends to this folder",
+    )
+    parser.add_argument(
+        "--npz",
+        type=str,
+        default=None,
+        help="export the trace to this .npz file",
+    )
+    args = parser.parse_args()
+
+    from simulation import print_summary
+
+    trace = Trace(args.trace_dir)
+    print_summary(trace.summary())
+    if args.plots:
+        from reporting import plot_trends
+
+        os.makedirs(args.plots, exist_ok=True)
+        plot_trends(trace.users(), args.plots)
+    if args.npz:
+        trace.to_npz(args.npz)
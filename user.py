@@ -1,12 +1,99 @@
-import math, random
+import importlib.util, math, random
+import numpy as np
 from scipy import integrate
-from scipy.optimize import minimize_scalar
+from scipy.optimize import brentq, minimize_scalar
 
 from demand import ParetoGenerator
+from profiling import count, instrument
 
-random.seed(2025)
+# Payoff engine used by the bid solvers
+# "analytic" evaluates the utility integral in closed form and solves the
+# first-order condition of the payoff, "quad" is the numerical reference path
+PAYOFF_ENGINES = ("analytic", "quad")
+PAYOFF_ENGINE = "analytic"
 
 
+def set_payoff_engine(engine: str) -> None:
+    """
+    Selects the payoff engine used by User.payoff_as_* and the bid solvers.
+
+    Args:
+        engine (str): Either "analytic" (default) or "quad".
+
+    Raises:
+        ValueError: If the engine is unknown.
+    """
+    global PAYOFF_ENGINE
+    if engine not in PAYOFF_ENGINES:
+        raise ValueError(f"Unknown payoff engine: {engine}")
+    PAYOFF_ENGINE = engine
+
+
+# Kernel backend of the payoffs and best responses of the analytic engine
+# "python" runs the methods of Bidder, "numba" the kernels of kernels.py
+# compiled in nopython mode, and "auto" picks numba if it is installed
+KERNEL_BACKENDS = ("python", "numba", "auto")
+KERNEL_BACKEND = "python"
+# Whether Numba is installed, found without importing it
+NUMBA_AVAILABLE = importlib.util.find_spec("numba") is not None
+# The kernels module, imported with Numba when the numba backend is used
+kernels = None
+# Whether the compiled kernels passed check_kernels in this process
+KERNELS_CHECKED = False
+
+
+def _import_kernels() -> None:
+    global kernels
+    if kernels is None:
+        import kernels
+
+
+def set_kernel_backend(backend: str) -> str:
+    """
+    Selects the kernel backend of Bidder.payoff_as_* and
+    Bidder.find_optimal_bid_as_*.
+
+    The first time the numba backend is selected, its kernels are compiled
+    and checked against the methods on the sample market of sample_market.
+
+    Args:
+        backend (str): One of KERNEL_BACKENDS.
+
+    Returns:
+        str: The backend selected, "python" or "numba".
+
+    Raises:
+        ValueError: If the backend is unknown, if numba is selected but
+            Numba is not installed, or if the kernels fail the check.
+    """
+    global KERNEL_BACKEND, KERNELS_CHECKED
+    if backend not in KERNEL_BACKENDS:
+        raise ValueError(f"Unknown kernel backend: {backend}")
+    if backend == "auto":
+        backend = "numba" if NUMBA_AVAILABLE else "python"
+    if backend == "numba":
+        if not NUMBA_AVAILABLE:
+            raise ValueError("The numba kernel backend needs Numba installed")
+        _import_kernels()
+        if not KERNELS_CHECKED:
+            users, total_supply = sample_market()
+            for price in [0.5, 1.095, 2.0]:
+                check_kernels(users, price, total_supply)
+            KERNELS_CHECKED = True
+    KERNEL_BACKEND = backend
+    return backend
+
+
+# History attributes of a user and the recording level they are kept at
+USER_SERIES = {
+    "emp_buffer_rec": "summary",
+    "expected_price_rec": "summary",
+    "role_rec": "summary",
+    "bid_rec": "trace",
+    "payoff_rec": "trace",
+    "utility_rec": "trace",
+}
+
 # Target area is 10x10 meters
 X_area, Y_area = 100.0, 100.0
 # Broker's position is at the center of the area
@@ -25,40 +112,253 @@ c = 3e8
 H = 10.0
 
 
-class User:
-    def __init__(self, id: int, type: str, generations: int):
+class Bidder:
+    """
+    The payoff model and best responses of a user, shared by User and
+    population.UserView, which provide the state the formulas read:
+    willingness_to_keep, rate_factor, max_buffer, emp_buffer, assigned_blocks,
+    next_loss() and bid.
+    """
+
+    def _kernel_state(self) -> tuple:
+        # The state the kernels read, as the floats they are compiled for
+        return (
+            float(self.willingness_to_keep),
+            float(self.rate_factor),
+            float(self.max_buffer),
+            float(self.next_loss()),
+        )
+
+    def utility(self, demand: float) -> float:
+        # Concave, strictly increasing, and continuously differentiable
+        # utility(0) = 0, domain: [emp_buffer - max_buffer, +∞)
+        def f(x):
+            return math.sqrt(x * self.rate_factor + self.max_buffer - self.next_loss())
+
+        return self.willingness_to_keep * (f(demand) - f(0.0))
+
+    def absolute_utility(self, amount: float) -> float:
+        return self.willingness_to_keep * math.sqrt(
+            amount * self.rate_factor + self.max_buffer - self.next_loss()
+        )
+
+    def expected_price(self) -> float:
+        # Calculate the expected price based on the user's empty buffer
+        return (
+            0.5 / math.sqrt(self.emp_buffer + self.max_buffer - self.next_loss())
+        ) * self.willingness_to_keep
+
+    def marginal_utility(self, demand: float) -> float:
+        # Derivative of utility, strictly positive and decreasing
+        return (
+            0.5
+            * self.willingness_to_keep
+            * self.rate_factor
+            / math.sqrt(demand * self.rate_factor + self.max_buffer - self.next_loss())
+        )
+
+    def utility_area(self, lower: float, upper: float, engine: str = None) -> float:
+        # Integral of utility over [lower, upper]
+        if (engine or PAYOFF_ENGINE) == "quad":
+            area, err = integrate.quad(self.utility, lower, upper)
+            count("quad")
+            return area
+
+        # With s(x) = sqrt(a * x + b), the antiderivative of s(x) - s(0) is
+        # 2 / (3a) * (s(x)^3 - s(0)^3) - s(0) * x, which is rewritten as
+        # a * x^2 * (2s(x) + s(0)) / (3 * (s(x) + s(0))^2) to avoid cancellation
+        def F(x):
+            a = self.rate_factor
+            s0 = math.sqrt(self.max_buffer - self.next_loss())
+            s1 = math.sqrt(x * a + s0**2)
+            return a * x**2 * (2 * s1 + s0) / (3 * (s1 + s0) ** 2)
+
+        return self.willingness_to_keep * (F(upper) - F(lower))
+
+    @instrument()
+    def payoff_as_buyer(
+        self, bid: float, price: float, total_supply: float, engine: str = None
+    ) -> float:
+        # Calculate the payoff based on the bid, price, and total supply
+        # return self.utility(bid / price) - bid
+        if KERNEL_BACKEND == "numba" and (engine or PAYOFF_ENGINE) == "analytic":
+            return kernels.payoff_as_buyer(
+                *self._kernel_state(), float(bid), float(price), float(total_supply)
+            )
+        amount = bid / price
+        fArea = self.utility_area(0, amount, engine)
+        return (
+            (1 - (amount / total_supply)) * self.utility(amount)
+            + (fArea / total_supply)
+            - bid
+        )
+
+    @instrument()
+    def payoff_as_seller(
+        self, bid: float, price: float, total_supply: float, engine: str = None
+    ) -> float:
+        # Calculate the payoff based on the bid, price, and total supply
+        if KERNEL_BACKEND == "numba" and (engine or PAYOFF_ENGINE) == "analytic":
+            return kernels.payoff_as_seller(
+                *self._kernel_state(),
+                float(self.assigned_blocks),
+                float(bid),
+                float(price),
+                float(total_supply),
+            )
+        amount = self.assigned_blocks - bid / price
+        fArea = self.utility_area(-amount, 0, engine)
+        return (
+            self.assigned_blocks * price
+            - bid
+            + (1 + (amount / (total_supply - self.assigned_blocks)))
+            * self.utility(-amount)
+            + (fArea / (total_supply - self.assigned_blocks))
+        )
+
+    def payoff_gradient_as_buyer(
+        self, bid: float, price: float, total_supply: float
+    ) -> float:
+        # Derivative of payoff_as_buyer with respect to the bid
+        amount = bid / price
+        return (
+            (1 - (amount / total_supply)) * self.marginal_utility(amount) - price
+        ) / price
+
+    def payoff_gradient_as_seller(
+        self, bid: float, price: float, total_supply: float
+    ) -> float:
+        # Derivative of payoff_as_seller with respect to the bid
+        amount = self.assigned_blocks - bid / price
+        others = total_supply - self.assigned_blocks
+        return (
+            -(
+                price
+                + 2 * self.utility(-amount) / others
+                - (1 + (amount / others)) * self.marginal_utility(-amount)
+            )
+            / price
+        )
+
+    def _solve_first_order_condition(
+        self, gradient, upper_bound: float, guess: float = None, width=1e-2
+    ) -> float:
+        # The payoffs are concave in the bid, so the optimum is either a bound
+        # or the unique root of the gradient
+        if gradient(0.0) <= 0:
+            return 0.0
+        if gradient(upper_bound) >= 0:
+            return upper_bound
+        # Search around a warm-start guess first if it brackets the root
+        if guess is not None:
+            lower = min(upper_bound, max(0.0, guess * (1 - width)))
+            upper = min(upper_bound, max(0.0, guess * (1 + width)))
+            if gradient(lower) > 0 and gradient(upper) < 0:
+                return brentq(gradient, lower, upper)
+        return brentq(gradient, 0.0, upper_bound)
+
+    @instrument()
+    def find_optimal_bid_as_buyer(
+        self, price: float, total_supply: float, guess: float = None
+    ) -> None:
+        if PAYOFF_ENGINE == "analytic" and KERNEL_BACKEND == "numba":
+            self.bid = kernels.best_bid_as_buyer(
+                *self._kernel_state(),
+                float(price),
+                float(total_supply),
+                math.nan if guess is None else float(guess),
+            )
+            return
+        if PAYOFF_ENGINE == "analytic":
+            self.bid = self._solve_first_order_condition(
+                lambda bid: self.payoff_gradient_as_buyer(bid, price, total_supply),
+                total_supply * price,
+                guess,
+            )
+            return
+        objective = lambda bid: -self.payoff_as_buyer(bid, price, total_supply)
+        result = minimize_scalar(
+            objective, bounds=(0.0, total_supply * price), method="bounded"
+        )
+        count("minimize_scalar_evaluations", result.nfev)
+        if result.success:
+            self.bid = result.x
+        else:
+            raise ValueError("Failed to find an optimal bid (buyer)")
+
+    @instrument()
+    def find_optimal_bid_as_seller(
+        self, price: float, total_supply: float, guess: float = None
+    ) -> None:
+        if PAYOFF_ENGINE == "analytic" and KERNEL_BACKEND == "numba":
+            self.bid = kernels.best_bid_as_seller(
+                *self._kernel_state(),
+                float(self.assigned_blocks),
+                float(price),
+                float(total_supply),
+                math.nan if guess is None else float(guess),
+            )
+            return
+        if PAYOFF_ENGINE == "analytic":
+            self.bid = self._solve_first_order_condition(
+                lambda bid: self.payoff_gradient_as_seller(bid, price, total_supply),
+                self.assigned_blocks * price,
+                guess,
+            )
+            return
+        objective = lambda bid: -self.payoff_as_seller(bid, price, total_supply)
+        result = minimize_scalar(
+            objective, bounds=(0.0, self.assigned_blocks * price), method="bounded"
+        )
+        count("minimize_scalar_evaluations", result.nfev)
+        if result.success:
+            self.bid = result.x
+        else:
+            raise ValueError("Failed to find an optimal bid (seller)")
+
+
+class User(Bidder):
+    def __init__(
+        self, id: int, type: str, generations: int, rng=None, lazy_demand=False
+    ):
+        # rng: the user's stream, for its attributes, moves and demand, a
+        # random.Random or a NumPy Generator (vectorized demand), by default
+        # the random module
+        # lazy_demand: draw the demand in chunks as the rounds advance
+        self.rng = rng
+        stream = random if rng is None else rng
+        # A NumPy Generator draws the demand from a child stream, so drawing
+        # it lazily does not shift the moves
+        demand_rng = rng.spawn(1)[0] if isinstance(rng, np.random.Generator) else rng
         # Location
-        self.x = random.uniform(0, X_area)
-        self.y = random.uniform(0, Y_area)
+        self.x = stream.uniform(0, X_area)
+        self.y = stream.uniform(0, Y_area)
         self.rate_factor = 1.0
         # Initialize user attributes
         self.id = id
         self.round = 0
         self.type = type
         self.is_buyer = True
-        self.is_seller = lambda: not self.is_buyer
         # in bits
         self.last_loss = 0
-        self.next_loss = lambda: self.last_loss
+        # next_loss is loss_factor * last_loss, 10 in FUTURE mode
+        self.loss_factor = 1.0
         self.trading_amount = 0
+        self.bid = None
         self.max_buffer = 1_000_000_000
-        self.emp_buffer = random.uniform(30_000_000, 70_000_000)
-        self.ocu_buffer = lambda: self.max_buffer - self.emp_buffer
+        self.emp_buffer = stream.uniform(30_000_000, 70_000_000)
         # LR user tends to keep more resources
         if type == "HB":
-            self.willingness_to_keep = random.uniform(21.0, 23.0)
+            self.willingness_to_keep = stream.uniform(21.0, 23.0)
             self.assigned_blocks = 40000
             # Min 10Mb/s, Max 15Mb/s, Avg 10.8Mb/s
-            self.demand = ParetoGenerator(
-                100_000_000, 150_000_000, 108_000_000
-            ).generate(generations)
+            demand = ParetoGenerator(100_000_000, 150_000_000, 108_000_000, demand_rng)
         elif type == "LR":
-            self.willingness_to_keep = random.uniform(23.0, 25.0)
+            self.willingness_to_keep = stream.uniform(23.0, 25.0)
             self.assigned_blocks = 4000
             # Min 1Mb, Max 10Mb, Avg 1.1Mb
-            self.demand = ParetoGenerator(10_000_000, 100_000_000, 11_000_000).generate(
-                generations
-            )
+            demand = ParetoGenerator(10_000_000, 100_000_000, 11_000_000, demand_rng)
+        self.demand = demand.stream() if lazy_demand else demand.generate(generations)
         # Record the last loss and waste
         self.loss_counter = 0
         self.waste_counter = 0
@@ -71,7 +371,17 @@ class User:
         self.payoff_rec = []
         self.utility_rec = []
         self.expected_price_rec = [self.expected_price()]
-        self.role_rec = ["Buyer" if self.is_buyer else "Seller"]
+        # 1.0 for a buyer and 0.0 for a seller
+        self.role_rec = [float(self.is_buyer)]
+
+    def is_seller(self) -> bool:
+        return not self.is_buyer
+
+    def next_loss(self) -> float:
+        return self.loss_factor * self.last_loss
+
+    def ocu_buffer(self) -> float:
+        return self.max_buffer - self.emp_buffer
 
     def record_current_state(self) -> None:
         if self.last_loss > 0:
@@ -84,10 +394,17 @@ class User:
         self.emp_buffer_rec.append(self.emp_buffer)
         # self.utility_rec.append(self.absolute_utility(0))
         self.expected_price_rec.append(self.expected_price())
-        self.role_rec.append("Buyer" if self.is_buyer else "Seller")
+        self.role_rec.append(float(self.is_buyer))
+
+    def set_recorder(self, recorder) -> None:
+        # Moves the history of attributes into series of the recorder
+        for name, level in USER_SERIES.items():
+            series = recorder.series(f"user_{self.id}_{name}", level)
+            series.extend(getattr(self, name))
+            setattr(self, name, series)
 
     # Random waypoint generation
-    def calculate_next_position(current_x, current_y, speed):
+    def calculate_next_position(current_x, current_y, speed, rng=None):
         """
         Calculates the next position of a user based on a Simple Random Walk model.
         The user moves a distance equal to 'speed' in a random direction.
@@ -96,6 +413,8 @@ class User:
             current_x (float): The user's current x-coordinate (0 <= x <= 100).
             current_y (float): The user's current y-coordinate (0 <= y <= 100).
             speed (float): The distance the user moves in this step.
+            rng: The stream the direction is drawn from, a random.Random or
+                a NumPy Generator, by default the random module.
 
         Returns:
             tuple: A tuple containing:
@@ -104,7 +423,7 @@ class User:
         """
 
         # Choose a random direction (angle in radians)
-        angle_radians = random.uniform(0, 2 * math.pi)
+        angle_radians = (random if rng is None else rng).uniform(0, 2 * math.pi)
 
         # Calculate the displacement in x and y based on speed and angle
         delta_x = speed * math.cos(angle_radians)
@@ -125,11 +444,14 @@ class User:
 
         return next_x, next_y
 
+    @instrument()
     def update(self) -> float:
 
         # calculate the data rate (bit/s) between a user and the broker
         def calculate_data_rate():
-            self.x, self.y = User.calculate_next_position(self.x, self.y, 10.0)
+            self.x, self.y = User.calculate_next_position(
+                self.x, self.y, 10.0, self.rng
+            )
             # Calculate wavelength (lambda = c / f)
             wavelength = c / frequency
             # Compute received power using the Friis transmission equation
@@ -171,64 +493,159 @@ class User:
         if self.emp_buffer == 0:
             pass
 
-    def utility(self, demand: float) -> float:
-        # Concave, strictly increasing, and continuously differentiable
-        # utility(0) = 0, domain: [emp_buffer - max_buffer, +∞)
-        def f(x):
-            return math.sqrt(x * self.rate_factor + self.max_buffer - self.next_loss())
 
-        return self.willingness_to_keep * (f(demand) - f(0.0))
+def check_payoff_engine(
+    users: list, price: float, total_supply: float, rtol: float = 1e-6
+) -> float:
+    """
+    Checks the analytic payoff engine against the quad reference path.
 
-    def absolute_utility(self, amount: float) -> float:
-        return self.willingness_to_keep * math.sqrt(
-            amount * self.rate_factor + self.max_buffer - self.next_loss()
-        )
+    Payoffs are compared on a grid of bids for every user in its current role,
+    and the optimal bids of both engines are compared by their payoffs.
 
-    def expected_price(self) -> float:
-        # Calculate the expected price based on the user's empty buffer
-        return (
-            0.5 / math.sqrt(self.emp_buffer + self.max_buffer - self.next_loss())
-        ) * self.willingness_to_keep
+    Args:
+        users (list): Users to check, with their roles already assigned.
+        price (float): The market price to evaluate at.
+        total_supply (float): The total supply of the market.
+        rtol (float): The tolerated relative deviation.
 
-    def payoff_as_buyer(self, bid: float, price: float, total_supply: float) -> float:
-        # Calculate the payoff based on the bid, price, and total supply
-        # return self.utility(bid / price) - bid
-        amount = bid / price
-        fArea, err = integrate.quad(self.utility, 0, amount)
-        return (
-            (1 - (amount / total_supply)) * self.utility(amount)
-            + (fArea / total_supply)
-            - bid
-        )
+    Returns:
+        float: The largest relative deviation found.
 
-    def payoff_as_seller(self, bid: float, price: float, total_supply: float) -> float:
-        # Calculate the payoff based on the bid, price, and total supply
-        amount = self.assigned_blocks - bid / price
-        fArea, err = integrate.quad(self.utility, -amount, 0)
-        return (
-            self.assigned_blocks * price
-            - bid
-            + (1 + (amount / (total_supply - self.assigned_blocks)))
-            * self.utility(-amount)
-            + (fArea / (total_supply - self.assigned_blocks))
-        )
+    Raises:
+        ValueError: If any deviation exceeds rtol.
+    """
+    engine = PAYOFF_ENGINE
+    max_deviation = 0.0
 
-    def find_optimal_bid_as_buyer(self, price: float, total_supply: float) -> None:
-        objective = lambda bid: -self.payoff_as_buyer(bid, price, total_supply)
-        result = minimize_scalar(
-            objective, bounds=(0.0, total_supply * price), method="bounded"
-        )
-        if result.success:
-            self.bid = result.x
+    def deviation(a, b):
+        return abs(a - b) / max(1.0, abs(b))
+
+    for user in users:
+        if user.is_buyer:
+            payoff, upper_bound = user.payoff_as_buyer, total_supply * price
+            find_optimal_bid = user.find_optimal_bid_as_buyer
         else:
-            raise ValueError("Failed to find an optimal bid (buyer)")
+            payoff, upper_bound = user.payoff_as_seller, user.assigned_blocks * price
+            find_optimal_bid = user.find_optimal_bid_as_seller
+        for k in range(11):
+            bid = upper_bound * k / 10
+            max_deviation = max(
+                max_deviation,
+                deviation(
+                    payoff(bid, price, total_supply, "analytic"),
+                    payoff(bid, price, total_supply, "quad"),
+                ),
+            )
+        # The analytic optimal bid must reach at least the payoff of the
+        # reference solver, which stops short of the bounds by its tolerance
+        best = []
+        try:
+            for solver_engine in PAYOFF_ENGINES:
+                set_payoff_engine(solver_engine)
+                find_optimal_bid(price, total_supply)
+                best.append(payoff(user.bid, price, total_supply, "quad"))
+        finally:
+            set_payoff_engine(engine)
+        max_deviation = max(max_deviation, deviation(min(best[0], best[1]), best[1]))
 
-    def find_optimal_bid_as_seller(self, price: float, total_supply: float) -> None:
-        objective = lambda bid: -self.payoff_as_seller(bid, price, total_supply)
-        result = minimize_scalar(
-            objective, bounds=(0.0, self.assigned_blocks * price), method="bounded"
+    if max_deviation > rtol:
+        raise ValueError(
+            f"Payoff engines deviate by {max_deviation:.3e} (rtol {rtol:.0e})"
         )
-        if result.success:
-            self.bid = result.x
+    return max_deviation
+
+
+def check_kernels(
+    users: list, price: float, total_supply: float, rtol: float = 1e-12
+) -> float:
+    """
+    Checks the kernels of the numba backend against the methods of Bidder.
+
+    The payoffs on a grid of bids and the cold and warm started optimal bids
+    are compared for every user in its current role. Without Numba the
+    kernels run interpreted, which checks their formulas.
+
+    Args:
+        users (list): Users to check, with their roles already assigned.
+        price (float): The market price to evaluate at.
+        total_supply (float): The total supply of the market.
+        rtol (float): The tolerated relative deviation.
+
+    Returns:
+        float: The largest relative deviation found.
+
+    Raises:
+        ValueError: If any deviation exceeds rtol.
+    """
+    global KERNEL_BACKEND
+    _import_kernels()
+    backend = KERNEL_BACKEND
+    max_deviation = 0.0
+
+    def deviation(a, b):
+        return abs(a - b) / max(1.0, abs(b))
+
+    def evaluate(user):
+        # The values compared, with the backend selected
+        if user.is_buyer:
+            payoff, upper_bound = user.payoff_as_buyer, total_supply * price
+            find_optimal_bid = user.find_optimal_bid_as_buyer
         else:
-            raise ValueError("Failed to find an optimal bid (seller)")
+            payoff, upper_bound = user.payoff_as_seller, user.assigned_blocks * price
+            find_optimal_bid = user.find_optimal_bid_as_seller
+        values = [
+            payoff(upper_bound * k / 10, price, total_supply, "analytic")
+            for k in range(11)
+        ]
+        bid = user.bid
+        find_optimal_bid(price, total_supply)
+        values.append(user.bid)
+        find_optimal_bid(price, total_supply, values[-1] * 1.001)
+        values.append(user.bid)
+        user.bid = bid
+        return values
+
+    try:
+        for user in users:
+            KERNEL_BACKEND = "python"
+            reference = evaluate(user)
+            KERNEL_BACKEND = "numba"
+            for value, expected in zip(evaluate(user), reference):
+                max_deviation = max(max_deviation, deviation(value, expected))
+    finally:
+        KERNEL_BACKEND = backend
+
+    if max_deviation > rtol:
+        raise ValueError(
+            f"Kernels deviate from the methods by {max_deviation:.3e} (rtol {rtol:.0e})"
+        )
+    return max_deviation
+
+
+def sample_market() -> tuple:
+    """
+    Returns:
+        tuple: Five HB sellers and five LR buyers after one update, and their
+            total supply, the market the engines and kernels are checked on.
+    """
+    rng = random.Random(2025)
+    users = [User(i, "HB", 10, rng) for i in range(1, 6)] + [
+        User(j, "LR", 10, rng) for j in range(6, 11)
+    ]
+    for user in users:
+        user.update()
+        user.is_buyer = user.type == "LR"
+    total_supply = sum(user.assigned_blocks for user in users if not user.is_buyer)
+    return users, total_supply
+
+
+if __name__ == "__main__":
+    # Equivalence checks of the payoff engines and the kernels on a sample market
+    users, total_supply = sample_market()
+    for price in [0.5, 1.0, 1.095, 2.0]:
+        print(
+            price,
+            check_payoff_engine(users, price, total_supply),
+            check_kernels(users, price, total_supply),
+        )